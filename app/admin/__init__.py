@@ -1 +1,2 @@
 from app.admin.price_updates.price_updates import price_updates
+from app.admin.metrics import metrics
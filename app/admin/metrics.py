@@ -0,0 +1,44 @@
+"""process-level telemetry for admins: connection pools, caches, the in-memory
+stores and query timings, as seen by the worker that answers the request"""
+
+import os
+import logging
+from typing import Annotated, Any, Literal
+from fastapi import HTTPException, Depends, status
+from fastapi.routing import APIRouter
+from app import auth
+from app.db import DB_V2, DB_V2_ASYNC, CACHE, perf
+from app.downloads import DownloadIDs
+
+metrics = APIRouter(prefix="/admin", tags=["admin"])
+Token = Annotated[auth.VerifiedToken, Depends(auth.authenticate_auth0_token)]
+logger = logging.getLogger("uvicorn.info")
+
+
+def require_admin(token: Token) -> None:
+    if token.permissions < auth.Permissions.sca_admin:
+        logger.info("Insufficient permissions. Rejected.")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+
+
+@metrics.get("/metrics")
+async def process_metrics(token: Token) -> dict[str, Any]:
+    require_admin(token)
+    return {
+        "pid": os.getpid(),
+        "db_pool": DB_V2.pool_stats(),
+        "db_pool_async": DB_V2_ASYNC.pool_stats(),
+        "cache": CACHE.stats(),
+        "downloads": DownloadIDs.stats(),
+        "tokens": auth.LocalTokenStore.stats(),
+    }
+
+
+@metrics.get("/perf")
+async def query_performance(
+    token: Token, sort: Literal["total", "p95"] = "total", limit: int = 20
+) -> dict[str, Any]:
+    """the slowest named queries and spans since the worker started,
+    by total time spent in them or by their 95th percentile"""
+    require_admin(token)
+    return perf.report(by=sort, limit=limit)
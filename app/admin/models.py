@@ -147,6 +147,25 @@ class ModelLookupADP(BaseModel):
     future: Optional[bool] = False
 
 
+class ModelLookupADPBatch(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+    model_numbers: list[str] = Field(min_length=1, max_length=1000)
+    customer_id: Optional[int] = 0
+    future: Optional[bool] = False
+
+
+class ModelLookupError(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+    model_number: str
+    status: int
+    detail: str
+
+
+class ModelLookupADPBatchResp(BaseModel):
+    data: list[dict]
+    errors: list[ModelLookupError]
+
+
 class ModelLookupGlasfloss(BaseModel):
     model_config = ConfigDict(protected_namespaces=())
     series: Optional[str] = ""
@@ -1,3 +1,4 @@
+import asyncio
 from typing import Literal
 from datetime import datetime
 from logging import getLogger
@@ -6,7 +7,7 @@ from fastapi import HTTPException, status, BackgroundTasks
 
 import app.db.sql as SQL
 from app.db.sql import queries
-from app.db import Session, DB_V2
+from app.db import Session, DB_V2, CACHE
 from app.admin.models import (
     ADPProductSheet,
     ADPCustomerRefSheet,
@@ -17,6 +18,7 @@ from app.admin.models import (
 import app.admin.price_updates.price_sheet_parsers as parsers
 
 from app.adp.extraction.models import parse_model_string, ParsingModes
+from app.adp.extraction.repricing import reprice_models, reprice_customer_models
 
 logger = getLogger("uvicorn.info")
 
@@ -51,6 +53,7 @@ def recalc(
             sig,
             update_only,
         )
+        CACHE.invalidate_vendor(vendor_id)
 
 
 def calc_customer_pricing_from_discount(
@@ -148,6 +151,7 @@ def apply_percentage(
             f"{increase_pct*100:0.2f}%, effective {effective_date.date()}"
         )
         session.commit()
+        CACHE.invalidate_vendor(vendor_id)
     finally:
         session.close()
 
@@ -239,6 +243,8 @@ def atco_price_update(
         logger.error(e)
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR)
     else:
+        session.commit()
+        CACHE.invalidate_vendor(VendorId.ATCO)
         return 200
     finally:
         drop_ = SQL.queries.atco_teardown
@@ -268,24 +274,9 @@ async def _adp_update_zero_disc_prices(
             dict(product_categories=prod_cats),
         ).fetchall()
         logger.info(f"Repricing {len(all_models)} models ...")
-        new_pricing_by_id = []
-        for i, rec in enumerate(all_models):
-            id_, model = rec
-            logger.info(f"    {model} ({i+1} of {len(all_models)})")
-            try:
-                fresh_build = parse_model_string(
-                    session, 0, model, ParsingModes.BASE_PRICE_FUTURE
-                )
-            except Exception as e:
-                logger.error(f"   failed to price {model}: {e}")
-                continue
-            else:
-                repriced = (id_, fresh_build["zero_discount_price"] * 100)
-                new_pricing_by_id.append(repriced)
-        new_pricing_params = [
-            {"id": id_, "price": price} for id_, price in new_pricing_by_id
-        ]
-        logger.info("Finished calculations")
+        repriced = reprice_models(session, all_models, ParsingModes.BASE_PRICE_FUTURE)
+        new_pricing_params = repriced.params()
+        logger.info(f"Finished calculations. {repriced.summary()}")
         update_setup = SQL.queries.adp_zero_disc_setup
         populate_update = SQL.queries.adp_zero_disc_pop_temp
         establish_future_pricing = SQL.queries.adp_zero_disc_establish_future
@@ -303,6 +294,7 @@ async def _adp_update_zero_disc_prices(
             logger.critical(tb.format_exc())
         else:
             session.commit()
+            CACHE.invalidate_vendor(VendorId.ADP)
             logger.info("Update Successful")
     finally:
         session.close()
@@ -311,46 +303,77 @@ async def _adp_update_zero_disc_prices(
 async def _adp_update_customer_prices(
     session: Session, effective_date: datetime
 ) -> None:
+    """Reprice every ADP customer price in parallel, one customer per unit of work.
+
+    Prices are committed in chunks to a progress table keyed on the effective date
+    as the workers go. If the process dies partway through, or any customer fails
+    to reprice, future pricing isn't established, and running the update again
+    with the same effective date only reprices what's left.
+    """
     logger.info("Background Update Process begun")
     all_models_sql = SQL.queries.adp_customer_pricing_all_models
+    ed_param = dict(ed=effective_date)
     try:
+        DB_V2.execute(session, SQL.queries.adp_customer_pricing_progress_setup)
+        completed = set(
+            DB_V2.execute(
+                session, SQL.queries.adp_customer_pricing_progress_completed, ed_param
+            ).scalars()
+        )
+        session.commit()
         logger.info("Retriving all customer pricing ...")
         all_models = DB_V2.execute(session, all_models_sql).fetchall()
-        logger.info(f"Repricing {len(all_models)} models ...")
-
-        new_pricing_by_id = []
-        for i, rec in enumerate(all_models):
-            id_, model, customer_id, private_label = rec
-            if private_label:
-                model = private_label
+        remaining = [
+            (id_, private_label if private_label else model, customer_id)
+            for id_, model, customer_id, private_label in all_models
+            if id_ not in completed
+        ]
+        if completed:
             logger.info(
-                f"customer:{customer_id} - {model} ({i+1} of {len(all_models)})"
+                f"Resuming a previous run: {len(completed)} of {len(all_models)} "
+                "models were already repriced"
             )
-            try:
-                fresh_build = parse_model_string(
-                    session, customer_id, model, ParsingModes.CUSTOMER_PRICING_FUTURE
-                )
-            except Exception as e:
-                logger.error(f"   failed to price {model}")
-                continue
-            else:
-                repriced = (id_, fresh_build["net_price"] * 100)
-                new_pricing_by_id.append(repriced)
 
-        new_pricing_params = [
-            {"id": id_, "price": price} for id_, price in new_pricing_by_id
-        ]
-        logger.info("Finished calculations")
+        def save_chunk(
+            worker_session: Session, customer_id: int, chunk: list[tuple[int, float]]
+        ) -> None:
+            params = [
+                dict(id=id_, price=price, customer_id=customer_id) | ed_param
+                for id_, price in chunk
+            ]
+            DB_V2.execute(
+                worker_session, SQL.queries.adp_customer_pricing_progress_pop, params
+            )
+
+        repriced = await asyncio.to_thread(
+            reprice_customer_models,
+            remaining,
+            ParsingModes.CUSTOMER_PRICING_FUTURE,
+            save_chunk,
+        )
+        logger.info(f"Finished calculations. {repriced.summary()}")
+        if repriced.failed_units:
+            # establishing now would leave these customers without future pricing
+            # and clear the progress a rerun would resume from
+            logger.critical(
+                f"Customers {sorted(repriced.failed_units)} failed to reprice. "
+                "Future pricing was not established, run the update again "
+                "with the same effective date to resume."
+            )
+            return
         update_setup = SQL.queries.adp_customer_pricing_temp_setup
-        populate_update = SQL.queries.adp_customer_pricing_pop_temp
+        populate_update = SQL.queries.adp_customer_pricing_pop_temp_from_progress
         establish_future_pricing = SQL.queries.adp_customer_pricing_establish_future
         try:
             DB_V2.execute(session, update_setup)
-            DB_V2.execute(session, populate_update, new_pricing_params)
+            DB_V2.execute(session, populate_update, ed_param)
             logger.info("temp table setup")
-            DB_V2.execute(session, establish_future_pricing, dict(ed=effective_date))
+            DB_V2.execute(session, establish_future_pricing, ed_param)
             logger.info("tearing down")
             DB_V2.execute(session, SQL.queries.adp_customer_pricing_teardown)
+            DB_V2.execute(
+                session, SQL.queries.adp_customer_pricing_progress_clear, ed_param
+            )
         except Exception as e:
             session.rollback()
             import traceback as tb
@@ -359,6 +382,7 @@ async def _adp_update_customer_prices(
             logger.critical(tb.format_exc())
         else:
             session.commit()
+            CACHE.invalidate_vendor(VendorId.ADP)
             logger.info("Update Successful")
     finally:
         session.close()
@@ -422,6 +446,8 @@ def _adp_price_sheet_parsing_and_key_price_establishment(
         session.rollback()
         raise HTTPException(status_code=500, detail=e)
     else:
+        session.commit()
+        CACHE.invalidate_vendor(VendorId.ADP)
         bg.add_task(
             _adp_update_zero_disc_prices,
             session=session,
@@ -492,6 +518,7 @@ def _adp_master_parsing_and_customer_price_updates(
                 else:
                     logger.info(f"update succesful")
                     session.commit()
+                    CACHE.invalidate_vendor(VendorId.ADP)
 
             case ADPCustomerRefSheet.SPECIAL_NET:
                 df = df[["Customer Name", "Material", "Material Description", "Price"]]
@@ -534,6 +561,7 @@ def _adp_master_parsing_and_customer_price_updates(
                 else:
                     logger.info(f"update succesful")
                     session.commit()
+                    CACHE.invalidate_vendor(VendorId.ADP)
 
             case ADPCustomerRefSheet.ZERO_DISCOUNT:
                 logger.info(f"skipped")
@@ -697,5 +725,6 @@ def friedrich_price_update(
         session.rollback()
     else:
         session.commit()
+        CACHE.invalidate_vendor(VendorId.FRIEDRICH)
     finally:
         session.close()
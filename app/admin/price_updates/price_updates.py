@@ -12,7 +12,7 @@ from fastapi import (
 from fastapi.routing import APIRouter
 from sqlalchemy.orm import Session
 from app import auth
-from app.db import DB_V2
+from app.db import DB_V2, CACHE
 from numpy import nan
 from pandas import read_csv, ExcelFile
 from app.admin.models import VendorId
@@ -72,6 +72,7 @@ async def establish_current_pricing_using_future(session: NewSession, token: Tok
     else:
         logger.info("Prices and discounts updated")
         session.commit()
+        CACHE.invalidate_all()
         return Response(
             status_code=status.HTTP_200_OK, content="Prices and discounts updated"
         )
@@ -230,6 +231,7 @@ async def rollback_an_implemented_update(
             f"Prices and discounts increase set to {new_effective_date.date()}."
         )
         session.commit()
+        CACHE.invalidate_vendor(vendor_id)
         return Response(
             status_code=status.HTTP_200_OK,
             content=f"Prices and discounts rolled back for {vendor_id}",
@@ -320,6 +322,7 @@ async def delay_effective_date_on_future_pricing_not_yet_implemented(
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR)
     else:
         session.commit()
+        CACHE.invalidate_vendor(vendor_id)
         return update_status
     finally:
         session.close()
@@ -3,6 +3,8 @@ from app.adp.adp_models.model_series import ModelSeries, Fields, PriceByCategory
 from app.db import DB_V2, Session, Database, CACHE
 from app.db.sql import queries
 
+SPECS = CACHE.register_namespace("adp_b_specs", vendors=("adp",))
+
 
 class B(ModelSeries):
     text_len = (13, 14)
@@ -39,8 +41,8 @@ class B(ModelSeries):
         super().__init__(session, re_match, db, *args, **kwargs)
         self.top_level_category = "Air Handlers"  # NOTE matches DB class rank 1
         self.min_qty = 4
-        cache_key = f'adp_b_specs_{self.attributes["ton"]}'
-        specs = CACHE.get(cache_key)
+        cache_key = self.attributes["ton"]
+        specs = CACHE.get(SPECS, cache_key)
         if not specs:
             dims_sql = """
                 SELECT weight, height, depth, width
@@ -48,7 +50,7 @@ class B(ModelSeries):
                 WHERE tonnage = :tonnage;
             """
             specs = (
-                DB_V2.execute(
+                self.db.execute(
                     session=session,
                     sql=dims_sql,
                     params={"tonnage": int(self.attributes["ton"])},
@@ -56,7 +58,8 @@ class B(ModelSeries):
                 .mappings()
                 .one_or_none()
             )
-            CACHE.add_or_update(cache_key, specs)
+            specs = dict(specs)
+            CACHE.set(SPECS, cache_key, specs)
         self.width = specs["width"]
         self.depth = specs["depth"]
         self.height = specs["height"]
@@ -146,9 +149,7 @@ class B(ModelSeries):
             customer_id=self.customer_id,
         )
         pricing_records: tuple[dict[str, str | int]] = (
-            self.db.execute(session=self.session, sql=self.pricing_sql, params=params)
-            .mappings()
-            .fetchall()
+            self.load_key_prices(params).mappings().fetchall()
         )
         pricing = dict()
         for r in pricing_records:
@@ -158,7 +159,6 @@ class B(ModelSeries):
             elif r.get("key")[-1] in ("2", "3", "4"):
                 pricing[r.get("key")[-1]] = r.get("effective_price")
                 pricing["effective_date"] = r.get("effective_date")
-        # CACHE.add_or_update(key_first_part, (pricing, self.get_adders()))
         return pricing, self.get_adders()
 
     def calc_zero_disc_price(self) -> int:
@@ -36,7 +36,9 @@ class CE(ModelSeries):
         """
         params = dict(model=str(self))
         specs = (
-            DB_V2.execute(session=session, sql=dims_sql, params=params).mappings().one()
+            self.db.execute(session=session, sql=dims_sql, params=params)
+            .mappings()
+            .one()
         )
         specs = {k: v for k, v in specs.items() if v}
         self.configuration = self.ce_configurations[self.attributes["config"]]
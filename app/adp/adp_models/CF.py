@@ -34,7 +34,7 @@ class CF(ModelSeries):
             WHERE model_alias = :alias;
         """
         params = dict(alias=model_alias)
-        actual_model = DB_V2.execute(
+        actual_model = self.db.execute(
             session=session, sql=model_mapping_sql, params=params
         ).scalar_one()
         strat = (
@@ -50,6 +50,7 @@ class CF(ModelSeries):
                     db_session=session,
                     raw_text=actual_model,
                     model_series=F,
+                    db=self.db,
                 ).is_model(strat)
                 self._record = self.model_obj.record()
             case "P":
@@ -59,6 +60,7 @@ class CF(ModelSeries):
                     db_session=session,
                     raw_text=actual_model,
                     model_series=B,
+                    db=self.db,
                 ).is_model(strat)
                 self._record = self.model_obj.record()
             case "W":
@@ -68,6 +70,7 @@ class CF(ModelSeries):
                     db_session=session,
                     raw_text=actual_model,
                     model_series=S,
+                    db=self.db,
                 ).is_model(strat)
                 self._record = self.model_obj.record()
         self.ratings_ac_txv = (
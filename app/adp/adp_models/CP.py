@@ -62,7 +62,9 @@ class CP(ModelSeries):
             cased=self.cased,
         )
         specs = (
-            DB_V2.execute(session=session, sql=dims_sql, params=params).mappings().one()
+            self.db.execute(session=session, sql=dims_sql, params=params)
+            .mappings()
+            .one()
         )
         self.width = specs["width"]
         self.depth = specs["depth"]
@@ -132,9 +134,7 @@ class CP(ModelSeries):
             vendor_id="adp",
             customer_id=self.customer_id,
         )
-        result = self.db.execute(
-            session=self.session, sql=self.pricing_sql, params=params
-        ).one_or_none()
+        result = self.load_key_prices(params).one_or_none()
         if not result:
             raise NoBasePrice(
                 "No record found in the price table with this model number."
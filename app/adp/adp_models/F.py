@@ -37,7 +37,7 @@ class F(ModelSeries):
         """
         params = dict(tonnage=self.tonnage)
         specs = (
-            DB_V2.execute(session=session, sql=specs_sql, params=params)
+            self.db.execute(session=session, sql=specs_sql, params=params)
             .mappings()
             .one()
         )
@@ -108,11 +108,7 @@ class F(ModelSeries):
             vendor_id="adp",
             customer_id=self.customer_id,
         )
-        pricing = (
-            self.db.execute(session=self.session, sql=self.pricing_sql, params=params)
-            .mappings()
-            .fetchall()
-        )
+        pricing = self.load_key_prices(params).mappings().fetchall()
         pricing_reorganized = dict()
         for row in pricing:
             option = row["key"].split("_")[-1]
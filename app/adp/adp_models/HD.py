@@ -37,7 +37,7 @@ class HD(ModelSeries):
             WHERE "SC_1" = :scode;
         """
         specs = (
-            DB_V2.execute(
+            self.db.execute(
                 session=session,
                 sql=specs_sql,
                 params=dict(scode=int(self.attributes["scode"])),
@@ -178,9 +178,7 @@ class HD(ModelSeries):
             vendor_id="adp",
             customer_id=self.customer_id,
         )
-        _, pricing, self.eff_date = self.db.execute(
-            session=self.session, sql=self.pricing_sql, params=params
-        ).one()
+        _, pricing, self.eff_date = self.load_key_prices(params).one()
         return pricing, self.get_adders()
 
     def calc_zero_disc_price(self) -> int:
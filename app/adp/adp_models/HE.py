@@ -80,7 +80,7 @@ class HE(ModelSeries):
         """
         pallet_params = dict(width=self.width)
         try:
-            self.pallet_qty = DB_V2.execute(
+            self.pallet_qty = self.db.execute(
                 session=session, sql=pallet_sql, params=pallet_params
             ).scalar_one()
         except:
@@ -98,7 +98,7 @@ class HE(ModelSeries):
             mat=f"%{self.attributes['mat']}%", scode=self.attributes["scode"]
         )
         try:
-            self.weight = DB_V2.execute(
+            self.weight = self.db.execute(
                 session=session, sql=weights_sql, params=weight_params
             ).scalar_one()
         except:
@@ -273,9 +273,7 @@ class HE(ModelSeries):
             customer_id=self.customer_id,
         )
         try:
-            _, pricing, self.eff_date = self.db.execute(
-                session=self.session, sql=self.pricing_sql, params=params
-            ).one()
+            _, pricing, self.eff_date = self.load_key_prices(params).one()
         except Exception as e:
             raise NoBasePrice(str(e))
 
@@ -291,7 +289,7 @@ class HE(ModelSeries):
         """
         core_configs_params = dict(series=paint)
         core_configs = (
-            DB_V2.execute(
+            self.db.execute(
                 session=self.session, sql=core_configs_sql, params=core_configs_params
             )
             .mappings()
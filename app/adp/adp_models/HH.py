@@ -36,7 +36,7 @@ class HH(ModelSeries):
         """
         params = dict(scode=int(self.attributes["scode"]))
         specs = (
-            DB_V2.execute(session=self.session, sql=specs_sql, params=params)
+            self.db.execute(session=self.session, sql=specs_sql, params=params)
             .mappings()
             .one()
         )
@@ -107,9 +107,7 @@ class HH(ModelSeries):
             vendor_id="adp",
             customer_id=self.customer_id,
         )
-        _, pricing, self.eff_date = self.db.execute(
-            session=self.session, sql=self.pricing_sql, params=params
-        ).one()
+        _, pricing, self.eff_date = self.load_key_prices(params).one()
         return pricing, self.get_adders()
 
     def calc_zero_disc_price(self) -> int:
@@ -30,7 +30,7 @@ class MH(ModelSeries):
             WHERE "SC_1" = :slab;
         """
         specs = (
-            DB_V2.execute(
+            self.db.execute(
                 session=self.session,
                 sql=spec_sql,
                 params=dict(slab=self.attributes["scode"]),
@@ -128,9 +128,7 @@ class MH(ModelSeries):
             vendor_id="adp",
             customer_id=self.customer_id,
         )
-        _, pricing, self.eff_date = self.db.execute(
-            session=self.session, sql=self.pricing_sql, params=params
-        ).one()
+        _, pricing, self.eff_date = self.load_key_prices(params).one()
         return pricing, self.get_adders()
 
     def calc_zero_disc_price(self) -> int:
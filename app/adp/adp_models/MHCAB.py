@@ -69,8 +69,7 @@ class MHCAB(ModelSeries):
             vendor_id="adp",
             customer_id=self.customer_id,
         )
-        sql = self.pricing_sql
-        price = self.db.execute(self.session, sql, params).one_or_none()
+        price = self.load_key_prices(params).one_or_none()
         if not price:
             raise NoBasePrice(
                 "No record found in the price table with this model number."
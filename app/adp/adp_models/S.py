@@ -32,7 +32,7 @@ class S(ModelSeries):
         """
         params = dict(ton=self.tonnage)
         specs = (
-            DB_V2.execute(session=session, sql=specs_sql, params=params)
+            self.db.execute(session=session, sql=specs_sql, params=params)
             .mappings()
             .one()
         )
@@ -114,9 +114,7 @@ class S(ModelSeries):
             vendor_id="adp",
             customer_id=self.customer_id,
         )
-        _, pricing, self.eff_date = self.db.execute(
-            session=self.session, sql=self.pricing_sql, params=params
-        ).one()
+        _, pricing, self.eff_date = self.load_key_prices(params).one()
         return int(pricing), self.get_adders()
 
     def calc_zero_disc_price(self) -> int:
@@ -33,7 +33,7 @@ class SC(ModelSeries):
         """
         params = dict(ton=self.tonnage / 12, model=str(self))
         specs = (
-            DB_V2.execute(session=session, sql=specs_sql, params=params)
+            self.db.execute(session=session, sql=specs_sql, params=params)
             .mappings()
             .one()
         )
@@ -90,9 +90,7 @@ class SC(ModelSeries):
             vendor_id="adp",
             customer_id=self.customer_id,
         )
-        _, price, self.eff_date = self.db.execute(
-            session=self.session, sql=self.pricing_sql, params=params
-        ).one()
+        _, price, self.eff_date = self.load_key_prices(params).one()
         return int(price)
 
     def calc_zero_disc_price(self) -> int:
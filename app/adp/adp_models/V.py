@@ -36,7 +36,7 @@ class V(ModelSeries):
         """
         params = dict(scode=self.attributes["scode"])
         specs = (
-            DB_V2.execute(session=session, sql=specs_sql, params=params)
+            self.db.execute(session=session, sql=specs_sql, params=params)
             .mappings()
             .one()
         )
@@ -191,11 +191,7 @@ class V(ModelSeries):
             vendor_id="adp",
             customer_id=self.customer_id,
         )
-        _, pricing, self.eff_date = self.db.execute(
-            session=self.session,
-            sql=self.pricing_sql,
-            params=params,
-        ).one()
+        _, pricing, self.eff_date = self.load_key_prices(params).one()
 
         return int(pricing), self.get_adders()
 
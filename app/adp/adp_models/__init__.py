@@ -15,5 +15,7 @@ from app.adp.adp_models.AMH import AMH
 from app.adp.adp_models.MHCAB import MHCAB
 from app.adp.adp_models.part_or_accessory import PartOrAccessory
 from app.adp.adp_models.model_series import Cabinet, Fields, ModelSeries
+from app.adp.utils.validator import SERIES_REGISTRY
 
 MODELS = (HE, HD, HH, V, MH, SC, F, B, S, CP, CE, CF, LS, AMH, PartOrAccessory, MHCAB)
+SERIES_REGISTRY.register(*MODELS)
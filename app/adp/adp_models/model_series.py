@@ -1,10 +1,16 @@
 import re
+from datetime import date
+from sqlalchemy import Result
+from sqlalchemy.engine.result import IteratorResult, SimpleResultMetaData
 from app.db import DB_V2, Session, Database, CACHE
 from app.db.sql import queries
 from pandas import DataFrame
 from enum import StrEnum, auto
 from typing import TypeAlias, Literal, Any
 
+MATERIAL_GROUPS = CACHE.register_namespace("adp_material_groups", vendors=("adp",))
+KEY_PRICES = CACHE.register_namespace("adp_key_prices", vendors=("adp",))
+
 
 class NoBasePrice(Exception):
     def __init__(self, reason: str) -> None:
@@ -191,18 +197,16 @@ class ModelSeries:
         customer_id: int,
     ):
         key_ = "adp_material_groups"
-        cached = CACHE.get(key_)
+        cached = CACHE.get(MATERIAL_GROUPS, key_)
         match cached:
             case DataFrame() if not cached.empty:
                 self.mat_grps = cached
-            case _ if cached:
-                self.mat_grps = cached
             case _:
                 self.mat_grps = DB_V2.load_df(session=session, table_name=key_)
                 self.mat_grps.rename(
                     columns={"id": "mat_grp"}, inplace=True
                 )  # HOT FIX FOR COLUMN NAME CHANGE IN DB
-                CACHE.add_or_update(key=key_, new_data=self.mat_grps)
+                CACHE.set(MATERIAL_GROUPS, key_, self.mat_grps)
 
         self.attributes = re_match.groupdict()
         self.session = session
@@ -253,19 +257,47 @@ class ModelSeries:
         except re.error:
             return False
 
+    def load_key_prices(self, params: dict) -> Result:
+        """Run the series pricing query, memoized in CACHE per series, customer,
+        current or future pricing, and the day the pricing is taken as of.
+
+        Anything other than a plain Database (i.e. a repricing snapshot) answers
+        from its own session, which may hold pricing that isn't committed yet,
+        so it's never served from or written to the cache.
+        """
+        if not isinstance(self.db, Database):
+            return self.db.execute(
+                session=self.session, sql=self.pricing_sql, params=params
+            )
+        cache_key = ":".join(
+            (
+                params["series"],
+                str(params["customer_id"]),
+                "future" if self.use_future else "current",
+                date.today().isoformat(),
+                params["key_mode"],
+                ",".join(params["key_param"]),
+            )
+        )
+        if not (cached := CACHE.get(KEY_PRICES, cache_key)):
+            result = self.db.execute(
+                session=self.session, sql=self.pricing_sql, params=params
+            )
+            cached = tuple(result.keys()), [tuple(row) for row in result]
+            CACHE.set(KEY_PRICES, cache_key, cached)
+        columns, rows = cached
+        return IteratorResult(SimpleResultMetaData(columns), iter(rows))
+
     def get_adders(self) -> PriceByCategoryAndKey:
-        key_ = f"adp_series_{self.__series_name__()}"
         params = dict(
             series=self.__series_name__(),
             vendor_id="adp",
-            key_mode="adders",
+            key_mode=self.KeyMode.ADDERS.value,
             key_param=[""],
             customer_id=self.customer_id,
         )
         adders_: list[dict[str, str | int]] = (
-            self.db.execute(session=self.session, sql=self.pricing_sql, params=params)
-            .mappings()
-            .all()
+            self.load_key_prices(params).mappings().all()
         )
         adders = dict()
         for adder in adders_:
@@ -274,5 +306,4 @@ class ModelSeries:
             adder_type = "_".join(adder_type)
             adders.setdefault(adder_type, {})
             adders[adder_type] |= {adder_key: adder["effective_price"]}
-        # CACHE.add_or_update(key_, adders)
         return adders
@@ -7,9 +7,9 @@ from fastapi import HTTPException
 from datetime import datetime
 from openpyxl.worksheet.worksheet import Worksheet
 from app.auth import SecOp
-from app.adp.adp_models import MODELS, S, Fields, ModelSeries
+from app.adp.adp_models import S, Fields, ModelSeries
 from app.adp.utils.validator import Validator
-from app.db import Stage, Session, DB_V2
+from app.db import Stage, Session, DB_V2, Database
 from app.db.sql import queries
 from app.adp.utils.models import ParsingModes
 import warnings
@@ -36,13 +36,17 @@ def build_model_attributes(
 
 
 def parse_model_string(
-    session: Session, adp_customer_id: int, model: str, mode: ParsingModes
+    session: Session,
+    adp_customer_id: int,
+    model: str,
+    mode: ParsingModes,
+    db: Database = DB_V2,
 ) -> pd.Series:
 
     model_obj: ModelSeries = None
-    for m in MODELS:
+    for m in Validator.candidates(model):
         # NOTE supplying customer price to allow special zero-discount-price calculation
-        if matched_model := Validator(session, model, m).is_model(
+        if matched_model := Validator(session, model, m, db).is_model(
             mode, customer_id=adp_customer_id
         ):
             model_obj = matched_model
@@ -60,6 +64,7 @@ def parse_model_string(
                 model=record_series,
                 adp_customer_id=adp_customer_id,
                 price_mode=mode,
+                db=db,
             )
             priced_model.pop("customer_id")
             return priced_model
@@ -103,7 +108,7 @@ def extract_models_from_sheet(session: Session, sheet: Worksheet) -> list[ModelS
                 val = row[col].value
             except IndexError:
                 break
-            for m in MODELS:
+            for m in Validator.candidates(val):
                 if model_clean := Validator(session, val, m).is_model():
                     if isinstance(model_clean, S):
                         if model_clean.get("heat") == "XX":
@@ -131,6 +136,7 @@ def price_models_by_customer_discounts(
     model: pd.Series,
     adp_customer_id: int,
     price_mode: ParsingModes = ParsingModes.CUSTOMER_PRICING,
+    db: Database = DB_V2,
 ) -> pd.Series:
     match price_mode:
         case ParsingModes.CUSTOMER_PRICING:
@@ -140,7 +146,7 @@ def price_models_by_customer_discounts(
             mat_grp_disc_sql = queries.get_class_discount_future
             snps_sql = queries.get_product_discount_future
     mat_grp_discounts = pd.DataFrame(
-        DB_V2.execute(
+        db.execute(
             session=session,
             sql=mat_grp_disc_sql,
             params=dict(customer_id=adp_customer_id),
@@ -149,7 +155,7 @@ def price_models_by_customer_discounts(
         .fetchall()
     )
     snps = pd.DataFrame(
-        DB_V2.execute(
+        db.execute(
             session=session,
             sql=snps_sql,
             params=dict(customer_id=adp_customer_id),
@@ -172,7 +178,7 @@ def price_models_by_customer_discounts(
             )
             SELECT COALESCE((SELECT value FROM preferred), false) as value;
         """
-        is_preferred: bool = DB_V2.execute(
+        is_preferred: bool = db.execute(
             session, sql_, dict(customer_id=adp_customer_id)
         ).scalar_one()
         no_disc_price = (
@@ -0,0 +1,389 @@
+"""Bulk repricing of ADP model numbers.
+
+`parse_model_string` is built for one model at a time, and every `ModelSeries`
+subclass it builds goes back to the database for its key price, its adders and
+whatever spec tables the series needs. That's fine for a single lookup, but a
+price update reprices thousands of models and pays for the same handful of
+queries over and over.
+
+`SeriesPricingSnapshot` stands in for the `Database` handed to the model
+classes. It loads every ADP key price and adder for the requested pricing mode
+up front and answers the product series pricing query from memory. Any other
+read-only query (specs, weights, core configs, ...) is run once and replayed
+for every model that asks for it again.
+
+`reprice_customer_models` splits customer repricing into one unit of work per
+customer and runs the units on a thread pool. Each worker has its own pooled
+session and pricing snapshot, and hands its results back in chunks so they can
+be committed as it goes.
+"""
+
+import os
+import re
+from time import time
+from logging import getLogger
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterable, Any, Callable
+from sqlalchemy import Result
+from sqlalchemy.engine import FrozenResult
+from sqlalchemy.engine.result import IteratorResult, SimpleResultMetaData
+
+from app.db import Session, DB_V2, Database
+from app.db.sql import queries
+from app.adp.adp_models import Fields, ModelSeries
+from app.adp.utils.models import ParsingModes
+from app.adp.extraction.models import parse_model_string
+
+logger = getLogger("uvicorn.info")
+
+KeyMode = ModelSeries.KeyMode
+PRICING_COLUMNS = ("key", "effective_price", "effective_date")
+FIRST_2_PARTS = re.compile(r"^[^_]*_[^_]*_")
+FUTURE_MODES = (ParsingModes.BASE_PRICE_FUTURE, ParsingModes.CUSTOMER_PRICING_FUTURE)
+REPRICING_WORKERS = int(os.getenv("ADP_REPRICING_WORKERS", 4))
+REPRICING_CHUNK_SIZE = int(os.getenv("ADP_REPRICING_CHUNK_SIZE", 500))
+
+PricedModel = tuple[int, float]
+ChunkWriter = Callable[[list[PricedModel]], None]
+
+
+class SeriesPricingSnapshot:
+    """Drop-in replacement for `Database` when pricing many models with the
+    same customer id and pricing mode.
+
+    Key prices are loaded per series with the same SQL the model classes use,
+    so effective prices and dates resolve exactly as they would one at a time.
+    The key modes of that SQL are then applied in memory.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        use_future: bool,
+        customer_id: int = 0,
+        db: Database = DB_V2,
+        replays: dict[tuple, FrozenResult] | None = None,
+    ) -> None:
+        self.db = db
+        self.use_future = use_future
+        self.customer_id = customer_id
+        if use_future:
+            self.pricing_sql = queries.product_series_pricing_reach_into_future
+        else:
+            self.pricing_sql = queries.product_series_pricing_with_override_dynamic
+        self.pricing: dict[str, list[tuple]] = {}
+        # may be shared between snapshots, since it's keyed on the full query
+        self._replays = replays if replays is not None else {}
+        self._patterns: dict[str, re.Pattern | None] = {}
+        self.queries_run = 0
+        self.queries_saved = 0
+        self.load(session)
+
+    def __getattr__(self, name: str) -> Any:
+        # anything not handled here (load_df, upload_df, ...) goes to the real db
+        return getattr(self.db, name)
+
+    def load(self, session: Session) -> None:
+        series_keys_sql = """
+            SELECT series, array_agg(key) AS keys
+            FROM vendor_product_series_pricing
+            WHERE vendor_id = 'adp'
+            AND deleted_at IS NULL
+            GROUP BY series;
+        """
+        series_keys = self.db.execute(session, series_keys_sql).fetchall()
+        self.queries_run += 1
+        for series, keys in series_keys:
+            params = dict(
+                key_mode=KeyMode.MEMBERSHIP.value,
+                key_param=list(keys),
+                series=series,
+                vendor_id="adp",
+                customer_id=self.customer_id,
+            )
+            rows = self.db.execute(session, self.pricing_sql, params).fetchall()
+            self.pricing[series] = [tuple(row) for row in rows]
+            self.queries_run += 1
+        logger.info(
+            f"Loaded {sum(len(r) for r in self.pricing.values())} key prices "
+            f"for {len(self.pricing)} ADP series"
+        )
+
+    def execute(
+        self,
+        session: Session,
+        sql: str,
+        params: Iterable[dict | str | int | None] = None,
+        **kwargs,
+    ) -> Result:
+        if self._is_snapshot_query(sql, params):
+            self.queries_saved += 1
+            return self._resolve_key_prices(params)
+        if not self._is_replayable(sql, params):
+            self.queries_run += 1
+            return self.db.execute(session, sql, params, **kwargs)
+        replay_key = (sql, self._hashable(params))
+        if replay_key not in self._replays:
+            result = self.db.execute(session, sql, params, **kwargs)
+            self._replays[replay_key] = result.freeze()
+            self.queries_run += 1
+        else:
+            self.queries_saved += 1
+        return self._replays[replay_key]()
+
+    def _is_snapshot_query(self, sql: str, params: Any) -> bool:
+        return (
+            sql == self.pricing_sql
+            and isinstance(params, dict)
+            and params.get("vendor_id") == "adp"
+            and params.get("customer_id") == self.customer_id
+        )
+
+    @staticmethod
+    def _is_replayable(sql: str, params: Any) -> bool:
+        read_only = sql.lstrip().upper().startswith(("SELECT", "WITH"))
+        return read_only and (params is None or isinstance(params, dict))
+
+    @staticmethod
+    def _hashable(params: dict | None) -> tuple:
+        if not params:
+            return tuple()
+        return tuple(
+            (k, tuple(v) if isinstance(v, list) else v)
+            for k, v in sorted(params.items())
+        )
+
+    def _pattern(self, pattern: str) -> re.Pattern | None:
+        if pattern not in self._patterns:
+            try:
+                self._patterns[pattern] = re.compile(pattern)
+            except re.error:
+                self._patterns[pattern] = None
+        return self._patterns[pattern]
+
+    def _key_matches(self, key: str, key_mode: str, key_param: list[str]) -> bool:
+        match key_mode:
+            case KeyMode.EXACT:
+                return len(key_param) == 1 and key == key_param[0]
+            case KeyMode.MEMBERSHIP:
+                return key in key_param
+            case KeyMode.FIRST_2_PARTS:
+                if len(key_param) != 1 or not (prefix := FIRST_2_PARTS.match(key)):
+                    return False
+                pattern = self._pattern(prefix.group(0))
+                return bool(pattern and pattern.search(key_param[0]))
+            case KeyMode.REGEX:
+                if len(key_param) != 1:
+                    return False
+                pattern = self._pattern(key)
+                return bool(pattern and pattern.search(key_param[0]))
+            case KeyMode.ADDERS:
+                # mirrors LIKE 'adder_%', in which the underscore is a wildcard
+                return key.startswith("adder") and len(key) > len("adder")
+            case _:
+                return False
+
+    def _resolve_key_prices(self, params: dict) -> Result:
+        key_mode = params.get("key_mode")
+        key_param = params.get("key_param") or []
+        rows = [
+            row
+            for row in self.pricing.get(params.get("series"), [])
+            if self._key_matches(row[0], key_mode, key_param)
+        ]
+        return IteratorResult(SimpleResultMetaData(PRICING_COLUMNS), iter(rows))
+
+
+@dataclass
+class RepricingResult:
+    prices: list[PricedModel] = field(default_factory=list)
+    failures: list[tuple[int, str, str]] = field(default_factory=list)
+    # customer ids whose whole unit of work failed
+    failed_units: list[int] = field(default_factory=list)
+    elapsed: float = 0.0
+    queries_run: int = 0
+    queries_saved: int = 0
+
+    @property
+    def attempted(self) -> int:
+        return len(self.prices) + len(self.failures)
+
+    @property
+    def throughput(self) -> float:
+        """models priced per second"""
+        return self.attempted / self.elapsed if self.elapsed else 0.0
+
+    def merge(self, other: "RepricingResult") -> None:
+        """fold in the result of another unit of work, elapsed time excluded"""
+        self.prices.extend(other.prices)
+        self.failures.extend(other.failures)
+        self.failed_units.extend(other.failed_units)
+        self.queries_run += other.queries_run
+        self.queries_saved += other.queries_saved
+
+    def params(self) -> list[dict[str, int | float]]:
+        """records formatted for the price update temp tables"""
+        return [{"id": id_, "price": price} for id_, price in self.prices]
+
+    def summary(self) -> str:
+        failed = f"{len(self.failures)} failed"
+        if self.failed_units:
+            failed += f", along with {len(self.failed_units)} whole customers"
+        return (
+            f"Repriced {len(self.prices)} of {self.attempted} models "
+            f"in {self.elapsed:,.2f}s ({self.throughput:,.1f} models/s), {failed}. "
+            f"Queries run: {self.queries_run}, avoided: {self.queries_saved}"
+        )
+
+
+def reprice_models(
+    session: Session,
+    models: Iterable[tuple[int, str]],
+    mode: ParsingModes,
+    customer_id: int = 0,
+    price_field: Fields = Fields.ZERO_DISCOUNT_PRICE,
+    snapshot: SeriesPricingSnapshot | None = None,
+    log_every: int = 500,
+    write_chunk: ChunkWriter | None = None,
+    chunk_size: int = REPRICING_CHUNK_SIZE,
+) -> RepricingResult:
+    """Price `(id, model_number)` pairs against one shared snapshot.
+
+    The price in `price_field` is returned in cents, keyed by the id, ready to
+    be written to the price update temp tables. If `write_chunk` is given, it
+    is called with every `chunk_size` prices as they're produced.
+    """
+    start_ = time()
+    if not snapshot:
+        snapshot = SeriesPricingSnapshot(
+            session, use_future=mode in FUTURE_MODES, customer_id=customer_id
+        )
+    result = RepricingResult()
+    pending: list[PricedModel] = []
+    models = list(models)
+    for i, (id_, model) in enumerate(models, start=1):
+        try:
+            fresh_build = parse_model_string(
+                session, customer_id, model, mode, db=snapshot
+            )
+            repriced = (id_, fresh_build[price_field.value] * 100)
+        except Exception as e:
+            result.failures.append((id_, model, str(e)))
+            logger.error(f"   failed to price {model}: {e}")
+        else:
+            result.prices.append(repriced)
+            pending.append(repriced)
+        if write_chunk and len(pending) >= chunk_size:
+            write_chunk(pending)
+            pending = []
+        if log_every and i % log_every == 0:
+            rate = i / (time() - start_)
+            logger.info(f"    {i} of {len(models)} ({rate:,.1f} models/s)")
+    if write_chunk and pending:
+        write_chunk(pending)
+    result.elapsed = time() - start_
+    result.queries_run = snapshot.queries_run
+    result.queries_saved = snapshot.queries_saved
+    return result
+
+
+def _reprice_customer(
+    customer_id: int,
+    models: list[tuple[int, str]],
+    mode: ParsingModes,
+    write_chunk: Callable[[Session, int, list[PricedModel]], None],
+    price_field: Fields,
+    chunk_size: int,
+    replays: dict[tuple, FrozenResult],
+) -> RepricingResult:
+    session = next(DB_V2.get_db())
+
+    def commit_chunk(chunk: list[PricedModel]) -> None:
+        write_chunk(session, customer_id, chunk)
+        session.commit()
+
+    try:
+        snapshot = SeriesPricingSnapshot(
+            session,
+            use_future=mode in FUTURE_MODES,
+            customer_id=customer_id,
+            replays=replays,
+        )
+        return reprice_models(
+            session,
+            models,
+            mode,
+            customer_id=customer_id,
+            price_field=price_field,
+            snapshot=snapshot,
+            log_every=0,
+            write_chunk=commit_chunk,
+            chunk_size=chunk_size,
+        )
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def reprice_customer_models(
+    models: Iterable[tuple[int, str, int]],
+    mode: ParsingModes,
+    write_chunk: Callable[[Session, int, list[PricedModel]], None],
+    price_field: Fields = Fields.NET_PRICE,
+    max_workers: int = REPRICING_WORKERS,
+    chunk_size: int = REPRICING_CHUNK_SIZE,
+) -> RepricingResult:
+    """Price `(id, model_number, customer_id)` records one customer per unit of
+    work, running the units on a thread pool.
+
+    `write_chunk` receives the worker's session, the customer id and a chunk of
+    `(id, price)` pairs, and the worker commits right after it returns. Chunks
+    already written stay written if a later unit fails, so the caller can
+    resume by leaving out the ids that were saved. The customer ids of units
+    that failed are returned in `failed_units`, and their remaining models
+    were not priced.
+    """
+    start_ = time()
+    by_customer: dict[int, list[tuple[int, str]]] = {}
+    for id_, model, customer_id in models:
+        by_customer.setdefault(customer_id, []).append((id_, model))
+    # biggest customers first so one large unit doesn't trail at the end
+    units = sorted(by_customer.items(), key=lambda unit: len(unit[1]), reverse=True)
+    replays: dict[tuple, FrozenResult] = {}
+    result = RepricingResult()
+    logger.info(
+        f"Repricing {sum(len(m) for m in by_customer.values())} models "
+        f"for {len(units)} customers on {max_workers} workers"
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(
+                _reprice_customer,
+                customer_id,
+                customer_models,
+                mode,
+                write_chunk,
+                price_field,
+                chunk_size,
+                replays,
+            ): customer_id
+            for customer_id, customer_models in units
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            customer_id = futures[future]
+            try:
+                unit_result = future.result()
+            except Exception as e:
+                logger.critical(f"customer {customer_id} failed to reprice: {e}")
+                result.failed_units.append(customer_id)
+                continue
+            result.merge(unit_result)
+            logger.info(
+                f"customer:{customer_id} ({done} of {len(units)}) - "
+                f"{unit_result.summary()}"
+            )
+    result.elapsed = time() - start_
+    return result
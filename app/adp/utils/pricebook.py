@@ -4,14 +4,17 @@ load_dotenv()
 import re
 import os
 from json import loads
+from array import array
 from pathlib import Path
 from copy import copy
+from itertools import count
 from io import BytesIO
 import pandas as pd
 import openpyxl as opxl
 from typing import Literal
 from logging import getLogger
 from openpyxl.cell.cell import Cell
+from openpyxl.styles.cell_style import StyleArray
 from openpyxl.worksheet.worksheet import Worksheet
 from openpyxl.drawing.image import Image
 from openpyxl.utils import range_boundaries
@@ -37,6 +40,35 @@ LenOption = Literal["long", "med", "short"]
 MinCoords = tuple[int | None, int | None]
 DataByCategory = dict[str, pd.DataFrame]
 
+PROPOSED_FONT = Font(italic=True, size=8.0, color="808080")
+PRICE_ID_FONT = Font(italic=True, size=8.0, color="FFFFFF")
+DISCLAIMER_FONT = Font(bold=True, italic=True)
+PENDING_FONT = Font(italic=True)
+# ratings columns in the order of the ratings template, for ratings submitted
+# to AHRI that don't have a reference number yet, and for those that do
+SUBMITTED_RATINGS_COLS = (
+    "AHRINumber",
+    "OEMName",
+    "OutdoorModel",
+    "IndoorModel",
+    "FurnaceModel",
+    "seer2_as_submitted",
+    "eer95f2_as_submitted",
+    "capacity2_as_submitted",
+    "hspf2_as_submitted",
+)
+REFERENCE_RATINGS_COLS = (
+    "AHRI Ref Number",
+    "OEM Name",
+    "Model Number",
+    "Coil Model Number",
+    "Furnace Model Number",
+    "SEER2",
+    "EER2",
+    "Capacity2",
+    "HSPF2",
+)
+
 
 class FileGenExecption(Exception): ...
 
@@ -186,6 +218,7 @@ class PriceBook:
         self,
         template: str,
         program: CustomerProgram,
+        logos: Logos | None = None,
     ) -> None:
         self.template_wb = opxl.load_workbook(template)
         self._9_col_template = self.template_wb["9-col"]
@@ -197,6 +230,10 @@ class PriceBook:
         self.active_wb = self.template_wb
         self.active = self._9_col_template
         self.cursor = Cursor()
+        self.logos = logos if logos is not None else self.default_logos(program)
+
+    @staticmethod
+    def default_logos(program: CustomerProgram) -> Logos:
         adp_logo = ADPLogo(
             price_pos=AnchorPosition("E2", offset_x=0, offset_y=0),
             parts_pos=AnchorPosition("C2", offset_x=50, offset_y=0),
@@ -222,7 +259,7 @@ class PriceBook:
             nomen_med_pos=AnchorPosition("A2", offset_x=10, offset_y=0),
             nomen_short_pos=AnchorPosition("A2", offset_x=10, offset_y=0),
         )
-        self.logos = Logos(adp_logo, sca_logo, customer_logo)
+        return Logos(adp_logo, sca_logo, customer_logo)
 
     def copy_cell_style(self, src_cell: Cell, new_cell: Cell):
         # Copy font, fill, border, and alignment
@@ -536,12 +573,12 @@ class PriceBook:
                     case "Stage":
                         if datum == Stage.PROPOSED.name:
                             cell = self.active_cell(value=datum.lower())
-                            cell.font = Font(italic=True, size=8.0, color="808080")
+                            cell.font = PROPOSED_FONT
                         elif datum == Stage.ACTIVE.name:
                             self.active_cell(value=None)
                     case "Price Id":
                         cell = self.active_cell(value=datum)
-                        cell.font = Font(italic=True, size=8.0, color="FFFFFF")
+                        cell.font = PRICE_ID_FONT
                     case _:
                         self.active_cell(value=datum)
                 self.cursor.move_by(cols=1)
@@ -551,12 +588,12 @@ class PriceBook:
                 disclaimer_txt = "* Must order in pallet quantities"
                 self.cursor.move_by(cols=1)
                 disclaimer = self.active_cell(disclaimer_txt)
-                disclaimer.font = Font(bold=True, italic=True)
+                disclaimer.font = DISCLAIMER_FONT
             elif Fields.MIN_QTY.formatted() in df.columns:
                 disclaimer_txt = "* Must order at least the minimum quantity per-SKU"
                 self.cursor.move_by(cols=1)
                 disclaimer = self.active_cell(disclaimer_txt)
-                disclaimer.font = Font(bold=True, italic=True)
+                disclaimer.font = DISCLAIMER_FONT
             self.cursor.slam_left()
         return self
 
@@ -733,51 +770,173 @@ class PriceBook:
                 ascending=True,
             )
 
-            for label, row in table.iterrows():
-                if not row["AHRI Ref Number"]:
-                    row_view = row[
-                        [
-                            "AHRINumber",
-                            "OEMName",
-                            "OutdoorModel",
-                            "IndoorModel",
-                            "FurnaceModel",
-                            "seer2_as_submitted",
-                            "eer95f2_as_submitted",
-                            "capacity2_as_submitted",
-                            "hspf2_as_submitted",
-                        ]
-                    ]
-                    if not include_furnace_col:
-                        row_view = row_view.drop(index=["FurnaceModel"])
-                    if not include_HSPF_col:
-                        row_view = row_view.drop(index=["hspf2_as_submitted"])
-                else:
-                    row_view = row[
-                        [
-                            "AHRI Ref Number",
-                            "OEM Name",
-                            "Model Number",
-                            "Coil Model Number",
-                            "Furnace Model Number",
-                            "SEER2",
-                            "EER2",
-                            "Capacity2",
-                            "HSPF2",
-                        ]
-                    ]
-                    if not include_furnace_col:
-                        row_view = row_view.drop(index=["Furnace Model Number"])
-                    if not include_HSPF_col:
-                        row_view = row_view.drop(index=["HSPF2"])
-                for datum in row_view:
-                    cell = self.active_cell(value=datum)
-                    if datum == "0":
-                        cell.value = "pending"
-                        cell.font = Font(italic=True)
-                    elif not datum:
-                        cell.value = ""
-                    self.cursor.move_by(cols=1)
-                self.cursor.slam_left()
-                self.cursor.move_by(rows=1)
+            self.insert_ratings_rows(table, include_furnace_col, include_HSPF_col)
+        return self
+
+    def insert_ratings_rows(
+        self, table: pd.DataFrame, include_furnace_col: bool, include_HSPF_col: bool
+    ) -> "PriceBook":
+        """write one row per rating from the cursor down"""
+        for label, row in table.iterrows():
+            if not row["AHRI Ref Number"]:
+                row_view = row[list(SUBMITTED_RATINGS_COLS)]
+                if not include_furnace_col:
+                    row_view = row_view.drop(index=["FurnaceModel"])
+                if not include_HSPF_col:
+                    row_view = row_view.drop(index=["hspf2_as_submitted"])
+            else:
+                row_view = row[list(REFERENCE_RATINGS_COLS)]
+                if not include_furnace_col:
+                    row_view = row_view.drop(index=["Furnace Model Number"])
+                if not include_HSPF_col:
+                    row_view = row_view.drop(index=["HSPF2"])
+            for datum in row_view:
+                cell = self.active_cell(value=datum)
+                if datum == "0":
+                    cell.value = "pending"
+                    cell.font = PENDING_FONT
+                elif not datum:
+                    cell.value = ""
+                self.cursor.move_by(cols=1)
+            self.cursor.slam_left()
+            self.cursor.move_by(rows=1)
+        return self
+
+
+class StyleMap:
+    """
+    The style ids a template cell's style takes in the workbook being built.
+
+    `PriceBook.copy_cell_style` re-registers six style objects for every copied
+    cell. Template cells share a handful of styles, so each distinct source style
+    is copied once, onto a scratch cell, and its ids are reused after that.
+    """
+
+    # fontId, fillId, borderId, numFmtId, protectionId, alignmentId
+    COPIED = slice(0, 6)
+
+    def __init__(self, book: PriceBook) -> None:
+        self.book = book
+        self.ids: dict[tuple[int, tuple[int, ...]], array] = {}
+
+    def apply(self, src_cell: Cell, new_cell: Cell) -> None:
+        key = id(src_cell.parent.parent), tuple(src_cell._style or ())
+        if (ids := self.ids.get(key)) is None:
+            scratch = Cell(self.book.active)
+            self.book.copy_cell_style(src_cell, scratch)
+            ids = self.ids[key] = scratch._style[self.COPIED]
+        if new_cell._style is None:
+            new_cell._style = StyleArray()
+        new_cell._style[self.COPIED] = ids
+
+
+class StampedPriceBook(PriceBook):
+    """
+    Builds the same workbook as `PriceBook` with less work per cell:
+        - fonts set on data cells are registered with the workbook once,
+            then set by id
+        - data is written row by row from the DataFrame's NumPy array
+            rather than from `iterrows`
+        - template blocks and nomenclature sheets are stamped through a
+            `StyleMap` rather than having each cell's style copied
+        - rows inserted to fit a block take their styles from one read of the
+            template row, instead of re-reading the row, and so measuring the
+            whole sheet, for every row inserted
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.styles = StyleMap(self)
+        self.font_ids: dict[int, int] = {}
+
+    def set_font(self, cell: Cell, font: Font) -> None:
+        """for the module's fonts, which are registered on first use"""
+        if (font_id := self.font_ids.get(id(font))) is None:
+            font_id = self.font_ids[id(font)] = self.active_wb._fonts.add(font)
+        if cell._style is None:
+            cell._style = StyleArray()
+        cell._style.fontId = font_id
+
+    def copy_cell(self, src_cell: Cell, dest_row: int, dest_col: int):
+        new_cell = self.active.cell(dest_row, dest_col, src_cell.value)
+        self.styles.apply(src_cell, new_cell)
+
+    def insert_rows(self, n_rows: int = 1) -> "PriceBook":
+        template_row = [cell._style for cell in self.active[self.cursor.row]]
+        self.active.insert_rows(self.cursor.row, amount=n_rows)
+        for row in range(self.cursor.row, self.cursor.row + n_rows):
+            for col, style in enumerate(template_row, start=1):
+                self.active.cell(row, col)._style = copy(style)
+        return self
+
+    def insert_data(
+        self, df: pd.DataFrame, headers: bool = True, offset: tuple = (0, 0)
+    ) -> "PriceBook":
+        self.cursor.move_by(*offset)
+        ws = self.active
+        if headers:
+            hidden = {Fields.STAGE.formatted(), Fields.PRICE_ID.formatted()}
+            for col in df:
+                if col not in hidden:
+                    self.active_cell(value=str(col))
+                self.cursor.move_by(cols=1)
+            self.cursor.slam_left().move_by(rows=1).move_by(*offset)
+
+        names = df.columns.tolist()
+        for values in df.to_numpy():
+            row, first_col = self.cursor.row, self.cursor.col
+            for col, name, datum in zip(count(first_col), names, values):
+                match name:
+                    case "Stage":
+                        if datum == Stage.PROPOSED.name:
+                            cell = ws.cell(row, col, datum.lower())
+                            self.set_font(cell, PROPOSED_FONT)
+                        elif datum == Stage.ACTIVE.name:
+                            ws.cell(row, col)
+                    case "Price Id":
+                        self.set_font(ws.cell(row, col, datum), PRICE_ID_FONT)
+                    case _:
+                        ws.cell(row, col, datum)
+            self.cursor.slam_left().move_by(rows=1).move_by(*offset)
+        if headers:
+            if Fields.PALLET_QTY.formatted() in df.columns:
+                disclaimer_txt = "* Must order in pallet quantities"
+            elif Fields.MIN_QTY.formatted() in df.columns:
+                disclaimer_txt = "* Must order at least the minimum quantity per-SKU"
+            else:
+                disclaimer_txt = None
+            if disclaimer_txt:
+                self.cursor.move_by(cols=1)
+                self.set_font(self.active_cell(disclaimer_txt), DISCLAIMER_FONT)
+            self.cursor.slam_left()
+        return self
+
+    def insert_ratings_rows(
+        self, table: pd.DataFrame, include_furnace_col: bool, include_HSPF_col: bool
+    ) -> "PriceBook":
+        def positions(cols: tuple[str, ...]) -> list[int]:
+            # both column sets put the furnace model 5th and HSPF 9th
+            dropped = set()
+            if not include_furnace_col:
+                dropped.add(cols[4])
+            if not include_HSPF_col:
+                dropped.add(cols[8])
+            return [table.columns.get_loc(col) for col in cols if col not in dropped]
+
+        submitted = positions(SUBMITTED_RATINGS_COLS)
+        referenced = positions(REFERENCE_RATINGS_COLS)
+        ref_number = table.columns.get_loc("AHRI Ref Number")
+        ws = self.active
+        for values in table.to_numpy():
+            row, col = self.cursor.row, self.cursor.col
+            for i, pos in enumerate(referenced if values[ref_number] else submitted):
+                datum = values[pos]
+                cell = ws.cell(row, col + i, datum)
+                if datum == "0":
+                    cell.value = "pending"
+                    self.set_font(cell, PENDING_FONT)
+                elif not datum:
+                    cell.value = ""
+            self.cursor.slam_left()
+            self.cursor.move_by(rows=1)
         return self
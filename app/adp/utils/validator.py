@@ -1,24 +1,167 @@
 import re
+from string import digits
 from logging import getLogger
-from app.db import Session, DB_V2
+from typing import Iterable
+from sqlalchemy.exc import SQLAlchemyError
+from app.db import Session, DB_V2, Database
 from app.adp.adp_models.model_series import ModelSeries, NoBasePrice
 from app.adp.utils.models import ParsingModes
 
+try:
+    # private to CPython and free to change, so leading characters are only an
+    # optimization: without the parser every series is tried for every string
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    sre_parse = sre_constants = None
+
 logger = getLogger("uvicorn.info")
 
 
+def leading_chars(pattern: re.Pattern) -> frozenset[str] | None:
+    """Characters a normalized model number must start with to match `pattern`,
+    or None if any character may."""
+    if sre_parse is None:
+        return None
+    try:
+        leading, nullable = _leading_chars(
+            sre_parse.parse(pattern.pattern, pattern.flags)
+        )
+    except Exception as e:
+        logger.warning(f"leading characters of {pattern.pattern!r} unknown: {e!r}")
+        return None
+    return frozenset(leading) if leading is not None and not nullable else None
+
+
+def _leading_chars(parsed: "sre_parse.SubPattern") -> tuple[set[str] | None, bool]:
+    """Characters a normalized model number can start with to match `parsed`,
+    and whether `parsed` can match an empty string.
+
+    None means the set couldn't be narrowed down and any character may match.
+    """
+    leading: set[str] = set()
+    for op, arg in parsed:
+        nullable = False
+        match op:
+            case sre_constants.LITERAL:
+                chars = {chr(arg)}
+            case sre_constants.IN:
+                chars = _chars_in_set(arg)
+            case sre_constants.SUBPATTERN:
+                chars, nullable = _leading_chars(arg[-1])
+            case sre_constants.MAX_REPEAT | sre_constants.MIN_REPEAT:
+                min_, _, item = arg
+                chars, nullable = _leading_chars(item)
+                nullable = nullable or min_ == 0
+            case sre_constants.BRANCH:
+                branches = [_leading_chars(branch) for branch in arg[1]]
+                if any(chars is None for chars, _ in branches):
+                    return None, False
+                chars = set().union(*(chars for chars, _ in branches))
+                nullable = any(nullable for _, nullable in branches)
+            case sre_constants.AT:
+                continue
+            case _:
+                return None, False
+        if chars is None:
+            return None, False
+        leading |= chars
+        if not nullable:
+            return leading, False
+    return leading, True
+
+
+def _chars_in_set(items: list) -> set[str] | None:
+    chars: set[str] = set()
+    for op, arg in items:
+        match op:
+            case sre_constants.LITERAL:
+                chars.add(chr(arg))
+            case sre_constants.RANGE:
+                chars |= {chr(c) for c in range(arg[0], arg[1] + 1)}
+            case sre_constants.CATEGORY if arg == sre_constants.CATEGORY_DIGIT:
+                chars |= set(digits)
+            case _:
+                return None
+    return chars
+
+
+class SeriesRegistry:
+    """Compiled regexes for every registered model series, indexed by the text
+    lengths and leading characters each series can match.
+
+    Looking up the candidates for a string narrows the full list of series down
+    to the few that could possibly match it, in registration order.
+    """
+
+    def __init__(self) -> None:
+        self.series: list[type[ModelSeries]] = []
+        self._patterns: dict[type[ModelSeries], re.Pattern] = {}
+        self._by_len: dict[int, list[type[ModelSeries]]] = {}
+        self._leading: dict[type[ModelSeries], frozenset[str] | None] = {}
+        self._candidates: dict[tuple[int, str], tuple[type[ModelSeries], ...]] = {}
+
+    def register(self, *series: type[ModelSeries]) -> None:
+        for model_series in series:
+            if model_series in self.series:
+                continue
+            pattern = self.pattern(model_series)
+            self.series.append(model_series)
+            for length in model_series.text_len:
+                self._by_len.setdefault(length, []).append(model_series)
+            # None lets any leading character through
+            self._leading[model_series] = leading_chars(pattern)
+        self._candidates.clear()
+
+    def pattern(self, model_series: type[ModelSeries]) -> re.Pattern:
+        if not (compiled := self._patterns.get(model_series)):
+            compiled = re.compile(model_series.regex, re.VERBOSE)
+            self._patterns[model_series] = compiled
+        return compiled
+
+    def candidates(self, normalized_text: str | None) -> Iterable[type[ModelSeries]]:
+        if not normalized_text:
+            return ()
+        index_key = (len(normalized_text), normalized_text[0])
+        if (candidates := self._candidates.get(index_key)) is None:
+            text_len, lead = index_key
+            candidates = tuple(
+                model_series
+                for model_series in self._by_len.get(text_len, ())
+                if (leading := self._leading[model_series]) is None or lead in leading
+            )
+            self._candidates[index_key] = candidates
+        return candidates
+
+
+SERIES_REGISTRY = SeriesRegistry()
+
+
 class Validator:
     def __init__(
-        self, db_session: Session, raw_text: str, model_series: ModelSeries
+        self,
+        db_session: Session,
+        raw_text: str,
+        model_series: ModelSeries,
+        db: Database = DB_V2,
     ) -> None:
-        self.raw_text = (
+        self.raw_text = self.normalize(raw_text)
+        self.text_len = len(self.raw_text) if self.raw_text else 0
+        self.model_series = model_series
+        self.session = db_session
+        self.db = db
+
+    @staticmethod
+    def normalize(raw_text: str) -> str | None:
+        return (
             (str(raw_text).strip().upper().replace(" ", "").replace("-", ""))
             if raw_text
             else None
         )
-        self.text_len = len(self.raw_text) if self.raw_text else 0
-        self.model_series = model_series
-        self.session = db_session
+
+    @staticmethod
+    def candidates(raw_text: str) -> Iterable[type[ModelSeries]]:
+        """registered series that could match the text, in `MODELS` order"""
+        return SERIES_REGISTRY.candidates(Validator.normalize(raw_text))
 
     def is_model(
         self,
@@ -27,7 +170,7 @@ class Validator:
     ) -> ModelSeries | bool:
         if self.text_len not in self.model_series.text_len or not self.raw_text:
             return False
-        model = re.compile(self.model_series.regex, re.VERBOSE)
+        model = SERIES_REGISTRY.pattern(self.model_series)
         model_parsed = model.match(self.raw_text)
         if model_parsed:
             try:
@@ -36,7 +179,7 @@ class Validator:
                         return self.model_series(
                             session=self.session,
                             re_match=model_parsed,
-                            db=DB_V2,
+                            db=self.db,
                             use_future=True,
                             customer_id=0,
                         )
@@ -44,7 +187,7 @@ class Validator:
                         return self.model_series(
                             session=self.session,
                             re_match=model_parsed,
-                            db=DB_V2,
+                            db=self.db,
                             use_future=True,
                             customer_id=customer_id,
                         )
@@ -52,7 +195,7 @@ class Validator:
                         return self.model_series(
                             session=self.session,
                             re_match=model_parsed,
-                            db=DB_V2,
+                            db=self.db,
                             use_future=False,
                             customer_id=0,
                         )
@@ -60,7 +203,7 @@ class Validator:
                         return self.model_series(
                             session=self.session,
                             re_match=model_parsed,
-                            db=DB_V2,
+                            db=self.db,
                             use_future=False,
                             customer_id=customer_id,
                         )
@@ -70,6 +213,10 @@ class Validator:
                     f"produced due to an error: {np.reason}"
                 )
                 return False
+            except SQLAlchemyError:
+                # the database failing says nothing about the model number,
+                # and the session can't be used for the next candidate either
+                raise
             except Exception as e:
                 e_type = e.__class__.__name__
                 e_val = str(e)
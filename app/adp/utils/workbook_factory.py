@@ -18,8 +18,8 @@ from app.adp.utils.programs import (
     CustomerProgram,
     EmptyProgram,
 )
-from app.adp.utils.pricebook import PriceBook
-from app.db import Session, DB_V2
+from app.adp.utils.pricebook import PriceBook, StampedPriceBook
+from app.db import Session, DB_V2, perf
 from app.db.sql import queries
 from app.downloads import XLSXFileResponse
 
@@ -27,6 +27,8 @@ from app.downloads import XLSXFileResponse
 logger = logging.getLogger("uvicorn.info")
 TODAY = str(datetime.today().date())
 TEMPLATES = os.getenv("TEMPLATES")
+# "cell" falls back to the original cell-by-cell builder
+PRICEBOOK_BUILDER = os.getenv("PRICEBOOK_BUILDER", "stamped")
 
 
 def fill_sort_order_field(df: pd.DataFrame) -> None:
@@ -521,8 +523,9 @@ def generate_program(
         logger.info(f"generating {full_program}")
         for prog in full_program:
             logger.info(f"{prog} program included")
+        builder = StampedPriceBook if PRICEBOOK_BUILDER == "stamped" else PriceBook
         price_book = (
-            PriceBook(TEMPLATES, full_program)
+            builder(TEMPLATES, full_program)
             .build_program(session=session)
             .add_footer(offset=(0, 1))
             .attach_nomenclature_tab()
@@ -542,7 +545,7 @@ def generate_program(
         logger.info(trace)
         raise HTTPException(status_code=404, detail="No program data to return")
     else:
-        logger.info(f"transform time: {time()-start}")
+        perf.record_span("generate_program", time() - start)
         return XLSXFileResponse(
             content=new_program_file.file_data, filename=new_program_file.file_name
         )
@@ -1,11 +1,14 @@
 import os
 import time
-import requests
+import heapq
+import asyncio
 import threading
+import aiohttp
 from datetime import datetime
 from abc import ABC
 from enum import Enum, IntEnum, StrEnum, auto
 from hashlib import sha256
+from collections import Counter
 from dotenv import load_dotenv
 from logging import getLogger
 
@@ -16,7 +19,7 @@ from fastapi.security import HTTPBearer
 from fastapi.security.http import HTTPAuthorizationCredentials
 from jose.jwt import get_unverified_header, decode
 
-from typing import Optional, Callable, Literal, TYPE_CHECKING
+from typing import Optional, Callable, Awaitable, Literal, TypeVar, TYPE_CHECKING
 import collections.abc as collections
 from functools import partial
 from sqlalchemy import text, Column
@@ -24,6 +27,8 @@ from sqlalchemy_jsonapi.errors import ResourceNotFoundError, BadRequestError
 from sqlalchemy_jsonapi.serializer import JSONAPIResponse
 from app.jsonapi.sqla_jsonapi_ext import SQLAlchemyModel
 from app.db.db import Session
+from app.db.cache import CACHE, Cache, FileBackend, shared_directory
+from app.db import perf
 from app.jsonapi.sqla_models import (
     serializer,
     serializer_partial,
@@ -53,6 +58,18 @@ token_auth_scheme = HTTPBearer()
 AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN")
 ALGORITHMS = os.getenv("ALGORITHMS")
 AUDIENCE = os.getenv("AUDIENCE")
+AUTH0_TIMEOUT = aiohttp.ClientTimeout(total=float(os.getenv("AUTH0_TIMEOUT", 10)))
+# ID sets a user is permitted to see are reused across requests for this many seconds
+PERMITTED_IDS = CACHE.register_namespace(
+    "permitted_ids", ttl=float(os.getenv("PERMITTED_IDS_TTL", 30))
+)
+# verified tokens held by each worker, and how they're shared between workers
+TOKEN_STORE_MAX = int(os.getenv("TOKEN_STORE_MAX", 10_000))
+TOKEN_STORE_SHARDS = 16
+TOKEN_STORE_SWEEP_INTERVAL = float(os.getenv("TOKEN_STORE_SWEEP_INTERVAL", 60))
+TOKEN_STORE = os.getenv("TOKEN_STORE", "memory").lower()
+
+T = TypeVar("T")
 
 
 class TUI(Enum):
@@ -148,42 +165,126 @@ class VerifiedToken(BaseModel):
             self.sim_permissions = perm
 
 
+class TokenShard:
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.tokens: dict[str, VerifiedToken] = dict()
+        self.expiry_heap: list[tuple[int, str]] = []
+        self.lock = threading.Lock()
+
+
+def _shared_token_cache() -> Cache | None:
+    if TOKEN_STORE != "file":
+        return
+    if directory := shared_directory("TOKEN_STORE_DIR"):
+        return Cache(FileBackend(directory, max_entries=TOKEN_STORE_MAX))
+
+
 class LocalTokenStore:
-    """Global in-memory storage system for access tokens"""
+    """Global in-memory storage system for access tokens
+
+    Tokens are spread over shards by their hash. Lookups don't take a lock,
+    only writes and evictions lock the shard they touch. Each shard holds
+    at most its share of `TOKEN_STORE_MAX` tokens, evicting the soonest to
+    expire first, and expired tokens are swept out of an expiry heap by a
+    background task rather than waiting to be presented again.
+
+    With `TOKEN_STORE=file`, verified tokens are also written to
+    `TOKEN_STORE_DIR`, so every worker on the host can use a token
+    verified by another. The directory has to be set, and owned by the app's
+    user with mode 0700, or tokens stay local to each worker.
+    """
 
-    tokens: dict[str, VerifiedToken] = dict()
-    lock = threading.Lock()
+    shards = [
+        TokenShard(max(1, TOKEN_STORE_MAX // TOKEN_STORE_SHARDS))
+        for _ in range(TOKEN_STORE_SHARDS)
+    ]
+    metrics: Counter = Counter()
+    shared = _shared_token_cache()
+    SHARED_NS = "auth_tokens"
+
+    @classmethod
+    def _shard(cls, token_hash: str) -> TokenShard:
+        return cls.shards[int(token_hash[:8], 16) % len(cls.shards)]
 
     @classmethod
-    def add_token(cls, new_token: VerifiedToken) -> None:
-        with cls.lock:
-            cls.tokens[new_token.token] = new_token
+    def add_token(cls, new_token: VerifiedToken, share: bool = True) -> None:
+        shard = cls._shard(new_token.token)
+        with shard.lock:
+            shard.tokens[new_token.token] = new_token
+            heapq.heappush(shard.expiry_heap, (new_token.exp, new_token.token))
+            while len(shard.tokens) > shard.max_entries:
+                _, token_hash = heapq.heappop(shard.expiry_heap)
+                if shard.tokens.pop(token_hash, None):
+                    cls.metrics["evictions"] += 1
+        if share and cls.shared:
+            ttl = new_token.exp - time.time()
+            cls.shared.set(cls.SHARED_NS, new_token.token, new_token, ttl)
 
     @classmethod
     def get(cls, other_token: str) -> VerifiedToken | None:
-        with cls.lock:
-            other_b = other_token.encode("utf-8")
-            other_sha_256 = sha256(other_b).hexdigest()
-            if verified_tok := cls.tokens.get(other_sha_256):
-                if not verified_tok.is_expired():
-                    return verified_tok
-                else:
-                    cls.tokens.pop(verified_tok.token)
-                    return
-            return
-
-
-def get_user_info(access_token: str) -> dict:
+        other_sha_256 = sha256(other_token.encode("utf-8")).hexdigest()
+        shard = cls._shard(other_sha_256)
+        if verified_tok := shard.tokens.get(other_sha_256):
+            if not verified_tok.is_expired():
+                cls.metrics["hits"] += 1
+                return verified_tok
+            with shard.lock:
+                shard.tokens.pop(other_sha_256, None)
+            cls.metrics["expirations"] += 1
+        elif cls.shared:
+            verified_tok = cls.shared.get(cls.SHARED_NS, other_sha_256)
+            if verified_tok and not verified_tok.is_expired():
+                cls.add_token(verified_tok, share=False)
+                cls.metrics["shared_hits"] += 1
+                return verified_tok
+        cls.metrics["misses"] += 1
+        return
+
+    @classmethod
+    def sweep(cls) -> int:
+        """drop every expired token"""
+        now = time.time()
+        expired = 0
+        for shard in cls.shards:
+            with shard.lock:
+                while shard.expiry_heap and shard.expiry_heap[0][0] < now:
+                    _, token_hash = heapq.heappop(shard.expiry_heap)
+                    token = shard.tokens.get(token_hash)
+                    if token and token.exp < now:
+                        del shard.tokens[token_hash]
+                        expired += 1
+        cls.metrics["expirations"] += expired
+        return expired
+
+    @classmethod
+    async def sweeper(cls, interval: float = TOKEN_STORE_SWEEP_INTERVAL) -> None:
+        """run for the life of the app, sweeping out expired tokens"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                cls.sweep()
+            except Exception as e:
+                logger.error(f"Token store sweep failed: {e}")
+
+    @classmethod
+    def stats(cls) -> dict[str, int]:
+        size = sum(len(shard.tokens) for shard in cls.shards)
+        return dict(cls.metrics) | {"size": size}
+
+
+async def get_user_info(access_token: str) -> dict:
     user_info_ep = AUTH0_DOMAIN + "/userinfo"
     auth_header = {"Authorization": f"Bearer {access_token}"}
-    user_info = requests.get(user_info_ep, headers=auth_header)
-    if 299 >= user_info.status_code >= 200:
-        user_info = user_info.json()
-    else:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="user could not be verified",
-        )
+    async with aiohttp.ClientSession(timeout=AUTH0_TIMEOUT) as req_session:
+        async with req_session.get(user_info_ep, headers=auth_header) as resp:
+            if 299 >= resp.status >= 200:
+                user_info = await resp.json()
+            else:
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="user could not be verified",
+                )
     match user_info:
         case {"nickname": a, "name": b, "email": c, "email_verified": d, **other}:
             return {"nickname": a, "name": b, "email": c, "email_verified": d}
@@ -194,6 +295,89 @@ def get_user_info(access_token: str) -> dict:
             )
 
 
+async def coalesce(
+    pending: dict[str, asyncio.Task], key: str, work: Callable[[], Awaitable[T]]
+) -> T:
+    """Run `work` once for every concurrent caller with the same key.
+
+    Callers arriving while the work is in flight await the same task,
+    which is shielded so that one caller disconnecting doesn't cancel it
+    for the others.
+    """
+    task = pending.get(key)
+    if task is None or task.get_loop() is not asyncio.get_running_loop():
+        task = asyncio.ensure_future(work())
+        pending[key] = task
+
+        def done(finished: asyncio.Task) -> None:
+            if pending.get(key) is finished:
+                pending.pop(key)
+
+        task.add_done_callback(done)
+    return await asyncio.shield(task)
+
+
+class JWKSCache:
+    """Signing keys published by Auth0, by key id.
+
+    Keys are refetched once they're older than `ttl`, or when a token arrives
+    signed with a key id that isn't known yet, which is how a key rotation
+    shows up. Unknown key ids trigger at most one refetch every
+    `min_refresh` seconds, so garbage tokens can't be used to hammer Auth0.
+    """
+
+    def __init__(self, url: str, ttl: float, min_refresh: float) -> None:
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh = min_refresh
+        self.keys: dict[str, dict] = {}
+        # monotonic time counts from an arbitrary point, such as boot,
+        # so "never fetched" has to be older than any time it can return
+        self.fetched_at = float("-inf")
+        self._pending: dict[str, asyncio.Task] = {}
+
+    async def fetch(self) -> list[dict]:
+        async with aiohttp.ClientSession(timeout=AUTH0_TIMEOUT) as req_session:
+            async with req_session.get(self.url) as resp:
+                resp.raise_for_status()
+                jwks = await resp.json()
+        return jwks["keys"]
+
+    async def refresh(self) -> None:
+        keys = await coalesce(self._pending, "jwks", self.fetch)
+        self.keys = {key["kid"]: key for key in keys}
+        self.fetched_at = time.monotonic()
+        logger.info(f"JWKS refreshed: {len(self.keys)} keys")
+
+    async def get_key(self, kid: str) -> dict | None:
+        age = time.monotonic() - self.fetched_at
+        if age > self.ttl or (kid not in self.keys and age > self.min_refresh):
+            try:
+                await self.refresh()
+            except Exception as e:
+                # keep verifying with the keys we have until Auth0 is reachable
+                if not self.keys:
+                    raise
+                logger.error(f"JWKS refresh failed: {e}")
+        if key := self.keys.get(kid):
+            return {
+                "kty": key["kty"],
+                "kid": key["kid"],
+                "use": key["use"],
+                "n": key["n"],
+                "e": key["e"],
+            }
+
+
+JWKS = JWKSCache(
+    url=f"{AUTH0_DOMAIN}/.well-known/jwks.json",
+    ttl=float(os.getenv("JWKS_TTL", 3600)),
+    min_refresh=float(os.getenv("JWKS_MIN_REFRESH", 30)),
+)
+# verifications in flight, by token hash
+PENDING_VERIFICATIONS: dict[str, asyncio.Task] = {}
+
+
 def set_permissions(permissions: list[str]) -> IntEnum:
     if not permissions:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
@@ -208,73 +392,74 @@ def set_permissions(permissions: list[str]) -> IntEnum:
         return Permissions[permissions[0].replace("-", "_")]
 
 
+async def verify_token(credentials: str) -> VerifiedToken:
+    """verify the token's signature and claims against Auth0, and store it"""
+    try:
+        unverified_header = get_unverified_header(credentials)
+    except Exception as err:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(err))
+    try:
+        rsa_key = await JWKS.get_key(unverified_header.get("kid"))
+    except Exception as err:
+        logger.error(f"JWKS unavailable: {err}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    if not rsa_key:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="No RSA key found in JWT Header",
+        )
+    try:
+        payload = decode(credentials, rsa_key, algorithms=ALGORITHMS, audience=AUDIENCE)
+    except Exception as err:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(err))
+    client_id: str = payload["azp"]
+    match client_id:
+        case TUI.SCA_CLOUD.value:
+            user_info = dict(
+                nickname="SCA Cloud TUI",
+                name="SCA Cloud TUI",
+                email="",
+                email_verified=True,
+            )
+        case TUI.MS_POWER_AUTOMATE.value:
+            user_info = dict(
+                nickname="MS Power Automate",
+                name="MS Power Automate",
+                email="",
+                email_verified=True,
+            )
+        case _:
+            user_info = await get_user_info(credentials)
+    verified_token = VerifiedToken(
+        token=credentials,
+        exp=payload["exp"],
+        permissions=set_permissions(payload["permissions"]),
+        **user_info,
+    )
+    LocalTokenStore.add_token(new_token=verified_token)
+    return verified_token
+
+
 async def authenticate_auth0_token(
     token: HTTPAuthorizationCredentials = Depends(token_auth_scheme),
     x_dev_permission_level: int = Header(20),
 ) -> VerifiedToken:
-    error = None
     start_ = time.time()
     if verified_token := LocalTokenStore.get(token.credentials):
-        if verified_token.permissions == Permissions.developer:
-            verified_token.set_simulated_permissions(x_dev_permission_level)
-        logger.info(f"Auth(cached): {time.time() - start_}s")
-        return verified_token
-    jwks = requests.get(AUTH0_DOMAIN + "/.well-known/jwks.json").json()
-    try:
-        unverified_header = get_unverified_header(token.credentials)
-    except Exception as err:
-        error = err
+        log_msg = "Auth(cached)"
     else:
-        rsa_key = {}
-        for key in jwks["keys"]:
-            if key["kid"] == unverified_header.get("kid"):
-                rsa_key = {
-                    "kty": key["kty"],
-                    "kid": key["kid"],
-                    "use": key["use"],
-                    "n": key["n"],
-                    "e": key["e"],
-                }
-        if rsa_key:
-            try:
-                payload = decode(
-                    token.credentials, rsa_key, algorithms=ALGORITHMS, audience=AUDIENCE
-                )
-            except Exception as err:
-                error = err
-            else:
-                client_id: str = payload["azp"]
-                match client_id:
-                    case TUI.SCA_CLOUD.value:
-                        user_info = dict(
-                            nickname="SCA Cloud TUI",
-                            name="SCA Cloud TUI",
-                            email="",
-                            email_verified=True,
-                        )
-                    case TUI.MS_POWER_AUTOMATE.value:
-                        user_info = dict(
-                            nickname="MS Power Automate",
-                            name="MS Power Automate",
-                            email="",
-                            email_verified=True,
-                        )
-                    case _:
-                        user_info = get_user_info(token.credentials)
-                verified_token = VerifiedToken(
-                    token=token.credentials,
-                    exp=payload["exp"],
-                    permissions=set_permissions(payload["permissions"]),
-                    **user_info,
-                )
-                if verified_token.permissions == Permissions.developer:
-                    verified_token.set_simulated_permissions(x_dev_permission_level)
-                LocalTokenStore.add_token(new_token=verified_token)
-                logger.info(f"Auth(verified): {time.time() - start_}s")
-                return verified_token
-        else:
-            error = "No RSA key found in JWT Header"
-    raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(error))
+        # concurrent first requests with the same token share one verification
+        token_hash = sha256(token.credentials.encode("utf-8")).hexdigest()
+        verified_token = await coalesce(
+            PENDING_VERIFICATIONS,
+            token_hash,
+            partial(verify_token, token.credentials),
+        )
+        log_msg = "Auth(verified)"
+    if verified_token.permissions == Permissions.developer:
+        verified_token.set_simulated_permissions(x_dev_permission_level)
+    logger.info(f"{log_msg}: {time.time() - start_}s")
+    return verified_token
 
 
 class UnverifiedEmail(Exception): ...
@@ -398,10 +583,12 @@ class SecOp(ABC):
         # other attributes
         self.filters: dict = kwargs
         self.version: int
+        # permitted ID sets already looked up in this request
+        self._permitted_ids: dict[str, frozenset[int]] = {}
 
     def permitted_primary_resource_ids(
         self, session: Session
-    ) -> tuple[Column, set[int]]:
+    ) -> tuple[Column, frozenset[int]]:
 
         primary_id_col, queries = self._resource.permitted_primary_resource_ids(
             self.token.email, **self.filters
@@ -409,18 +596,41 @@ class SecOp(ABC):
         get_result = partial(
             self.get_result_from_id_association_queries, session, **queries
         )
-        return primary_id_col, (
-            get_result(**self.filters) if self.filters else get_result()
+        return primary_id_col, self.memoized_ids(
+            "primary",
+            lambda: get_result(**self.filters) if self.filters else get_result(),
         )
 
-    def permitted_customer_location_ids(self, session: Session) -> set[int]:
-        queries = permitted_customer_location_ids(
-            email=self.token.email, version=self.version
-        )
-        get_result = partial(
-            self.get_result_from_id_association_queries, session, **queries
+    def permitted_customer_location_ids(self, session: Session) -> frozenset[int]:
+        def load() -> set[int]:
+            queries = permitted_customer_location_ids(
+                email=self.token.email, version=self.version
+            )
+            get_result = partial(
+                self.get_result_from_id_association_queries, session, **queries
+            )
+            return get_result(**self.filters) if self.filters else get_result()
+
+        return self.memoized_ids("customer_locations", load)
+
+    def user_type(self) -> UserTypes:
+        """the type of user whose permissions apply, simulated for developers"""
+        if self.token.permissions == Permissions.developer:
+            return UserTypes[self.token.sim_permissions.name]
+        return UserTypes[self.token.permissions.name]
+
+    def memoized_ids(self, kind: str, load: Callable[[], set[int]]) -> frozenset[int]:
+        """IDs from `load`, reused for the rest of the request and, for a short while,
+        by later requests from the same user. Writes through any SecOp drop them."""
+        filters = ",".join(f"{k}={v}" for k, v in sorted(self.filters.items()))
+        key = (
+            f"{kind}:{self._resource.__jsonapi_type_override__}:{self.token.email}:"
+            f"{self.user_type()}:v{getattr(self, 'version', '')}:{filters}"
         )
-        return get_result(**self.filters) if self.filters else get_result()
+        if (ids := self._permitted_ids.get(key)) is None:
+            ids = CACHE.get_or_set(PERMITTED_IDS, key, lambda: frozenset(load()))
+            self._permitted_ids[key] = ids
+        return ids
 
     def get_result_from_id_association_queries(
         self,
@@ -443,11 +653,7 @@ class SecOp(ABC):
             UserTypes.sca_admin: sql_sca_admin,
             # UserTypes.developer: sql_admin,
         }
-        if self.token.permissions == Permissions.developer:
-            user_type = UserTypes[self.token.sim_permissions.name]
-        else:
-            user_type = UserTypes[self.token.permissions.name]
-        query = queries_by_user[user_type]
+        query = queries_by_user[self.user_type()]
         filters_suffixed = {k + "_1": v for k, v in filters.items()}
         result = session.scalars(
             text(query), dict(email_1=self.token.email, **filters_suffixed)
@@ -580,7 +786,7 @@ class SecOp(ABC):
                 result = result.data
         if not result["data"]:
             raise HTTPException(status_code=status.HTTP_204_NO_CONTENT)
-        logger.info(f"Query Time: {time.time()-start_}s")
+        perf.record_span(f"get {resource}", time.time() - start_)
         return result
 
     @standard_error_handler
@@ -633,6 +839,7 @@ class SecOp(ABC):
                 )
 
         result: GenericData | JSONAPIResponse = operation()
+        CACHE.invalidate(PERMITTED_IDS)
 
         match result:
             case JSONAPIResponse():
@@ -674,6 +881,7 @@ class SecOp(ABC):
                 obj_id=obj_id,
             )
         result: GenericData | JSONAPIResponse = operation()
+        CACHE.invalidate(PERMITTED_IDS)
 
         match result:
             case JSONAPIResponse():
@@ -715,6 +923,7 @@ class SecOp(ABC):
                 api_type=api_type,
                 obj_id=obj_id,
             )
+        CACHE.invalidate(PERMITTED_IDS)
         return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
@@ -22,6 +22,7 @@ from app.customers.models import (
     CMMSSNSCustomerResp,
 )
 from app.db.db import DB_V2, S3, File
+from app.db.cache import CACHE
 from app.jsonapi.sqla_models import SCACustomer
 from app.jsonapi.core_models import convert_query
 from app.cmmssns import CMMSSNSToken, CMMSSNS_URL
@@ -255,6 +256,7 @@ async def del_customer(session: NewSession, token: Token, customer_id: int) -> N
             logger.warning("Delete unsuccessful due to an integrity error.")
             raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=e)
         else:
+            CACHE.invalidate(auth.PERMITTED_IDS)
             return Response(status_code=status.HTTP_204_NO_CONTENT)
         finally:
             session.commit()
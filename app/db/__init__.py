@@ -1,2 +1,13 @@
-from app.db.db import Stage, Session, File, S3, DB_V2, Database, CACHE
+from app.db.db import (
+    Stage,
+    Session,
+    AsyncSession,
+    File,
+    S3,
+    DB_V2,
+    DB_V2_ASYNC,
+    Database,
+    AsyncDatabase,
+)
+from app.db.cache import CACHE
 from app.db.sql import queries
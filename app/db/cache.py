@@ -0,0 +1,346 @@
+"""Namespaced, versioned cache for data that's expensive to load
+but changes only when an update comes through.
+
+Every key lives in a namespace. A namespace has a default TTL and is tagged
+with the vendors whose updates can make its entries stale. Instead of hunting
+down individual keys, invalidating a namespace bumps its version, so every entry
+written under the old version is simply never read again and ages out through
+TTL or LRU eviction.
+
+Two backends are available, chosen by `CACHE_BACKEND`:
+    memory  - (default) an LRU-bounded dict local to the process
+    file    - pickled entries in `CACHE_DIR` on local disk, shared by every
+                worker on the host, including the namespace versions, so an
+                invalidation in one worker is seen by all of them. `CACHE_DIR`
+                has to be set, and owned by the app's user with mode 0700
+"""
+
+import os
+import pickle
+import stat
+import tempfile
+import threading
+from time import time, time_ns
+from hashlib import sha1
+from pathlib import Path
+from logging import getLogger
+from collections import OrderedDict, Counter
+from dataclasses import dataclass, field
+from typing import Any, Callable, Protocol
+
+logger = getLogger("uvicorn.info")
+
+DEFAULT_TTL = float(os.getenv("CACHE_DEFAULT_TTL", 3600))
+MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 2048))
+# the file backend only scans its directory for LRU eviction every so many writes
+EVICTION_INTERVAL = 32
+_MISSING = object()
+
+
+class CacheBackend(Protocol):
+    def get(self, key: str) -> Any:
+        """the stored value, or `_MISSING` if absent or expired"""
+
+    def set(self, key: str, value: Any, expires_at: float) -> None: ...
+
+    def delete(self, key: str) -> None: ...
+
+    def clear(self) -> None: ...
+
+    def get_version(self, namespace: str) -> int: ...
+
+    def bump_version(self, namespace: str) -> int: ...
+
+
+class MemoryBackend:
+    """LRU-bounded, per-process backend"""
+
+    def __init__(
+        self, max_entries: int = MAX_ENTRIES, on_evict: Callable[[str], None] = None
+    ) -> None:
+        # on_evict is called with the namespace of each evicted entry
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+        self._data: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+        self._versions: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            value, expires_at = entry
+            if expires_at < time():
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, expires_at: float) -> None:
+        evicted = []
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                evicted_key, _ = self._data.popitem(last=False)
+                evicted.append(evicted_key)
+        if self.on_evict:
+            for evicted_key in evicted:
+                self.on_evict(evicted_key.split(":", 1)[0])
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def get_version(self, namespace: str) -> int:
+        return self._versions.get(namespace, 0)
+
+    def bump_version(self, namespace: str) -> int:
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            return self._versions[namespace]
+
+
+class UnsafeDirectory(Exception): ...
+
+
+def private_directory(directory: str | Path) -> Path:
+    """`directory`, created if it doesn't exist, once it's confirmed that only
+    this process's user can read or write it.
+
+    Whatever is shared through the directory gets unpickled, so a directory
+    anyone else can write to would let them plant objects in every worker.
+    """
+    directory = Path(directory)
+    directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+    info = directory.lstat()
+    if not stat.S_ISDIR(info.st_mode):
+        raise UnsafeDirectory(f"{directory} is not a directory")
+    if info.st_uid != os.getuid():
+        raise UnsafeDirectory(f"{directory} is not owned by this process's user")
+    if stat.S_IMODE(info.st_mode) != 0o700:
+        raise UnsafeDirectory(
+            f"{directory} has mode {stat.S_IMODE(info.st_mode):o}, it must be 700"
+        )
+    return directory
+
+
+def shared_directory(env_var: str) -> Path | None:
+    """the private directory named by `env_var`,
+    or None, with the reason logged, if it's unset or unsafe to use"""
+    if not (directory := os.getenv(env_var)):
+        logger.error(f"{env_var} is not set, nothing will be shared between workers")
+        return
+    try:
+        return private_directory(directory)
+    except (UnsafeDirectory, OSError) as e:
+        logger.error(f"{env_var} not used, nothing will be shared between workers: {e}")
+
+
+class FileBackend:
+    """Entries pickled to a local directory, shared between processes on the host.
+
+    Writes go through a temp file and an atomic rename, so a reader never sees
+    a partial entry. Reads touch the file's mtime, which is what LRU eviction
+    goes by when the directory grows past `max_entries`. The directory must be
+    private to the process's user, see `private_directory`.
+    """
+
+    def __init__(
+        self,
+        directory: str | Path,
+        max_entries: int = MAX_ENTRIES,
+        on_evict: Callable[[str], None] = None,
+    ) -> None:
+        self.directory = private_directory(directory)
+        self.versions = self.directory / "versions"
+        self.versions.mkdir(mode=0o700, exist_ok=True)
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+        self._sets_since_evict = 0
+
+    def _path(self, key: str) -> Path:
+        namespace = key.split(":", 1)[0]
+        return self.directory / f"{namespace}.{sha1(key.encode()).hexdigest()}.pkl"
+
+    def _write(self, path: Path, data: bytes) -> None:
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except Exception:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+    def get(self, key: str) -> Any:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                stored_key, value, expires_at = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return _MISSING
+        if stored_key != key:
+            return _MISSING
+        if expires_at < time():
+            path.unlink(missing_ok=True)
+            return _MISSING
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key: str, value: Any, expires_at: float) -> None:
+        data = pickle.dumps((key, value, expires_at), protocol=pickle.HIGHEST_PROTOCOL)
+        self._write(self._path(key), data)
+        self._sets_since_evict += 1
+        if self._sets_since_evict >= EVICTION_INTERVAL:
+            self._sets_since_evict = 0
+            self._evict()
+
+    def _evict(self) -> None:
+        entries = list(self.directory.glob("*.pkl"))
+        overflow = len(entries) - self.max_entries
+        if overflow <= 0:
+            return
+
+        def mtime(path: Path) -> float:
+            try:
+                return path.stat().st_mtime
+            except OSError:
+                return 0
+
+        for path in sorted(entries, key=mtime)[:overflow]:
+            path.unlink(missing_ok=True)
+            if self.on_evict:
+                self.on_evict(path.name.split(".", 1)[0])
+
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+    def clear(self) -> None:
+        for path in self.directory.glob("*.pkl"):
+            path.unlink(missing_ok=True)
+
+    def get_version(self, namespace: str) -> int:
+        try:
+            return int((self.versions / namespace).read_text())
+        except (OSError, ValueError):
+            return 0
+
+    def bump_version(self, namespace: str) -> int:
+        # a fresh timestamp rather than read-increment-write,
+        # so two workers bumping at once can't land on the same version
+        version = time_ns()
+        self._write(self.versions / namespace, str(version).encode())
+        return version
+
+
+@dataclass
+class Namespace:
+    name: str
+    ttl: float = DEFAULT_TTL
+    vendors: set[str] = field(default_factory=set)
+
+
+class Cache:
+    def __init__(self, backend: CacheBackend = None) -> None:
+        self.backend = backend if backend else MemoryBackend()
+        if hasattr(self.backend, "on_evict") and not self.backend.on_evict:
+            self.backend.on_evict = self._count_eviction
+        self.namespaces: dict[str, Namespace] = {}
+        self.metrics: dict[str, Counter] = {}
+        self._invalidation_hooks: list[Callable[[str], None]] = []
+
+    def register_namespace(
+        self, name: str, ttl: float = DEFAULT_TTL, vendors: tuple[str, ...] = ()
+    ) -> str:
+        """declare a namespace, its default TTL and the vendors
+        whose price updates make it stale"""
+        self.namespaces[name] = Namespace(name, ttl, set(vendors))
+        return name
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{namespace}:v{self.backend.get_version(namespace)}:{key}"
+
+    def _count(self, namespace: str, metric: str) -> None:
+        self.metrics.setdefault(namespace, Counter())[metric] += 1
+
+    def _count_eviction(self, namespace: str) -> None:
+        self._count(namespace, "evictions")
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        value = self.backend.get(self._key(namespace, key))
+        if value is _MISSING:
+            self._count(namespace, "misses")
+            return default
+        self._count(namespace, "hits")
+        return value
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float = None) -> None:
+        if ttl is None:
+            ns = self.namespaces.get(namespace)
+            ttl = ns.ttl if ns else DEFAULT_TTL
+        self.backend.set(self._key(namespace, key), value, time() + ttl)
+        self._count(namespace, "sets")
+
+    def get_or_set(
+        self, namespace: str, key: str, factory: Callable[[], Any], ttl: float = None
+    ) -> Any:
+        value = self.get(namespace, key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(namespace, key, value, ttl)
+        return value
+
+    def delete(self, namespace: str, key: str) -> None:
+        self.backend.delete(self._key(namespace, key))
+
+    def invalidate(self, *namespaces: str) -> None:
+        """make every entry currently in the namespaces unreachable"""
+        for namespace in namespaces:
+            self.backend.bump_version(namespace)
+            self._count(namespace, "invalidations")
+            for hook in self._invalidation_hooks:
+                hook(namespace)
+        if namespaces:
+            logger.info(f"Cache invalidated: {', '.join(namespaces)}")
+
+    def invalidate_vendor(self, vendor_id: str) -> None:
+        """to be called after a committed price update for the vendor"""
+        self.invalidate(
+            *(ns.name for ns in self.namespaces.values() if vendor_id in ns.vendors)
+        )
+
+    def invalidate_all(self) -> None:
+        self.invalidate(*self.namespaces)
+
+    def on_invalidate(self, hook: Callable[[str], None]) -> None:
+        """run `hook(namespace)` whenever a namespace is invalidated"""
+        self._invalidation_hooks.append(hook)
+
+    def stats(self) -> dict[str, dict[str, int | float]]:
+        stats = {}
+        for namespace, counts in self.metrics.items():
+            lookups = counts["hits"] + counts["misses"]
+            stats[namespace] = dict(counts) | {
+                "hit_rate": counts["hits"] / lookups if lookups else 0.0
+            }
+        return stats
+
+
+def _default_backend() -> CacheBackend:
+    match os.getenv("CACHE_BACKEND", "memory").lower():
+        case "file" if directory := shared_directory("CACHE_DIR"):
+            return FileBackend(directory)
+        case _:
+            return MemoryBackend()
+
+
+CACHE = Cache(_default_backend())
@@ -3,34 +3,41 @@ from dotenv import load_dotenv
 load_dotenv()
 import re
 import os
-from time import time
-import boto3
+from time import perf_counter
 import asyncio
+import threading
 from logging import getLogger
 from dataclasses import dataclass
 from io import BytesIO
 from enum import StrEnum, auto
-from typing import Iterable, Any
+from typing import Iterable
 from fastapi import HTTPException
-from sqlalchemy import create_engine, text, URL, Result
+from sqlalchemy import create_engine, text, bindparam, make_url, URL, Result
 from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.pool import NullPool
+from app.db import perf
+from app.db.sql import SQL
+from app.db.pool import (
+    pool_options,
+    instrument,
+    PoolMetrics,
+    TimedQueuePool,
+    TimedAsyncQueuePool,
+    STATEMENT_TIMEOUT_MS,
+)
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 from pandas import DataFrame, read_sql
 
 logger = getLogger("uvicorn.info")
 TEST_DB = os.getenv("TEST_DATABASE")
-
-
-class CACHE:
-    _data: dict[str, Any] = {}
-
-    @classmethod
-    def add_or_update(cls, key: str, new_data: dict) -> None:
-        cls._data[key] = new_data
-
-    @classmethod
-    def get(cls, key: str) -> Any | None:
-        ret = cls._data.get(key)
-        return ret
+# driver for the asyncio engine
+ASYNC_DRIVER = os.getenv("DB_ASYNC_DRIVER", "asyncpg")
 
 
 @dataclass
@@ -78,16 +85,28 @@ class FriedrichMarketType(StrEnum):
 
 class S3:
     bucket = os.getenv("S3_BUCKET")
-    client = boto3.client(
-        "s3",
-        aws_access_key_id=os.getenv("AWS_ACCESS_ID"),
-        aws_secret_access_key=os.getenv("AWS_SECRET_KEY"),
-    )
+    _client = None
+    _client_lock = threading.Lock()
+
+    @classmethod
+    def client(cls):
+        """the S3 client, created on first use to keep boto3 out of startup"""
+        if cls._client is None:
+            with cls._client_lock:
+                if cls._client is None:
+                    import boto3
+
+                    cls._client = boto3.client(
+                        "s3",
+                        aws_access_key_id=os.getenv("AWS_ACCESS_ID"),
+                        aws_secret_access_key=os.getenv("AWS_SECRET_KEY"),
+                    )
+        return cls._client
 
     @classmethod
     def _sync_upload_file(cls, file: File, destination: str) -> None:
         try:
-            cls.client.put_object(
+            cls.client().put_object(
                 Body=file.file_content,
                 Bucket=cls.bucket,
                 Key=destination,
@@ -103,7 +122,7 @@ class S3:
     @classmethod
     def get_file(cls, key: str) -> File:
         try:
-            response: dict = cls.client.get_object(Bucket=cls.bucket, Key=key)
+            response: dict = cls.client().get_object(Bucket=cls.bucket, Key=key)
         except Exception as e:
             raise HTTPException(status_code=404, detail=f"File Not Found: {e}")
         else:
@@ -123,6 +142,11 @@ class S3:
                 )
 
 
+def statement(sql: str) -> TextClause:
+    """named queries come with their clause parsed once, ad hoc SQL is parsed here"""
+    return sql.clause if isinstance(sql, SQL) else text(sql)
+
+
 class Database:
 
     conn_params = (
@@ -145,8 +169,18 @@ class Database:
         if _connection_url
         else TEST_DB
     )
-    _ENGINE = create_engine(_connection_str)
+    _ENGINE = create_engine(
+        _connection_str,
+        poolclass=TimedQueuePool,
+        connect_args=(
+            {"options": f"-c statement_timeout={STATEMENT_TIMEOUT_MS}"}
+            if STATEMENT_TIMEOUT_MS
+            else {}
+        ),
+        **pool_options(),
+    )
     _SESSIONLOCAL = sessionmaker(bind=_ENGINE, autoflush=False, autocommit=False)
+    pool_metrics: PoolMetrics = instrument(_ENGINE.pool)
 
     def __init__(self, database_name: str = "") -> None:
         self.PREFIX = database_name + "_" if database_name else None
@@ -174,6 +208,18 @@ class Database:
         finally:
             session.close()
 
+    @staticmethod
+    def set_statement_timeout(session: Session, milliseconds: int) -> None:
+        """limit statements for the rest of the session's current transaction,
+        overriding DB_STATEMENT_TIMEOUT_MS. 0 lifts the limit."""
+        session.execute(
+            text("SELECT set_config('statement_timeout', :ms, true)"),
+            dict(ms=str(int(milliseconds))),
+        )
+
+    def pool_stats(self) -> dict[str, int | float]:
+        return self.pool_metrics.stats()
+
     def upload_df(
         self,
         session: Session,
@@ -203,12 +249,15 @@ class Database:
         params: Iterable[dict | str | int | None] = None,
         **kwargs,
     ) -> Result:
+        start = perf_counter()
+        rows = None
         try:
-            # start_ = time()
-            return session.execute(text(sql), params=params, **kwargs)
+            result = session.execute(statement(sql), params=params, **kwargs)
+            rows = result.rowcount
+            return result
         finally:
-            pass
-            # logger.info(f"Query Time: {time()-start_}s")
+            # failures, statement timeouts included, are timed with no row count
+            perf.record_query(sql, perf_counter() - start, rows)
 
     def load_df(
         self,
@@ -237,4 +286,115 @@ class Database:
             return session.execute(text("SELECT version();")).fetchone()[0]
 
 
+class AsyncDatabase:
+    """The asyncio counterpart of `Database`, on the same connection settings.
+
+    Queries awaited through an AsyncSession don't block the event loop.
+    Synchronous code that needs a session, like the ORM serializer and the
+    permission checks, can be run against the same connection with
+    `session.run_sync(fn, *args)`, which awaits its I/O the same way.
+
+    The engine is created on first use, so the async driver is only
+    imported by the processes that use it.
+    """
+
+    def __init__(self, database: Database) -> None:
+        self.database = database
+        self._engine: AsyncEngine = None
+        self._sessionmaker: async_sessionmaker[AsyncSession] = None
+        self.pool_metrics: PoolMetrics = None
+
+    @property
+    def engine(self) -> AsyncEngine:
+        if self._engine is None:
+            url = make_url(self.database._connection_str).set(
+                drivername=f"postgresql+{ASYNC_DRIVER}"
+            )
+            # connections are tied to the event loop that opened them,
+            # and the test client runs a loop per request
+            if TEST_DB:
+                pool = dict(poolclass=NullPool)
+            else:
+                pool = dict(poolclass=TimedAsyncQueuePool, **pool_options())
+            connect_args = (
+                {"server_settings": {"statement_timeout": str(STATEMENT_TIMEOUT_MS)}}
+                if STATEMENT_TIMEOUT_MS
+                else {}
+            )
+            self._engine = create_async_engine(url, connect_args=connect_args, **pool)
+            self.pool_metrics = instrument(self._engine.sync_engine.pool)
+        return self._engine
+
+    @property
+    def sessionmaker(self) -> async_sessionmaker[AsyncSession]:
+        if self._sessionmaker is None:
+            self._sessionmaker = async_sessionmaker(
+                bind=self.engine, autoflush=False, expire_on_commit=False
+            )
+        return self._sessionmaker
+
+    async def get_db(self):
+        async with self.sessionmaker() as session:
+            yield session
+
+    async def execute(
+        self,
+        session: AsyncSession,
+        sql: str,
+        params: Iterable[dict | str | int | None] = None,
+        **kwargs,
+    ) -> Result:
+        start = perf_counter()
+        rows = None
+        try:
+            result = await session.execute(statement(sql), params=params, **kwargs)
+            rows = result.rowcount
+            return result
+        finally:
+            # failures, statement timeouts included, are timed with no row count
+            perf.record_query(sql, perf_counter() - start, rows)
+
+    async def load_df(
+        self,
+        session: AsyncSession,
+        table_name: str,
+        customer_id: int = None,
+        is_null: str = None,
+        id_only: bool = False,
+    ) -> DataFrame:
+        if id_only:
+            select = "id"
+        else:
+            select = "*"
+        sql = f"""SELECT {select} FROM {self.database.full_table_name(table_name)}"""
+        params = None
+        if customer_id:
+            sql += """ WHERE customer_id IN :customer_id"""
+            params = dict(customer_id=[customer_id])
+        elif is_null:
+            sql += f""" WHERE {is_null} IS NULL"""
+        sql += ";"
+        query = text(sql)
+        if params:
+            query = query.bindparams(bindparam("customer_id", expanding=True))
+
+        def read(sync_session: Session) -> DataFrame:
+            return read_sql(query, con=sync_session.connection(), params=params)
+
+        return await session.run_sync(read)
+
+    async def test(self, session: AsyncSession) -> str:
+        async with session.begin():
+            result = await session.execute(text("SELECT version();"))
+            return result.fetchone()[0]
+
+    def pool_stats(self) -> dict[str, int | float]:
+        return self.pool_metrics.stats() if self.pool_metrics else {}
+
+    async def dispose(self) -> None:
+        if self._engine is not None:
+            await self._engine.dispose()
+
+
 DB_V2 = Database()
+DB_V2_ASYNC = AsyncDatabase(DB_V2)
@@ -0,0 +1,176 @@
+"""Query and span timing for finding hot paths without a profiler.
+
+Every statement run through `Database.execute` (and its async counterpart) is
+timed and tagged with the name of its SQL file in `app.db.sql`, or as `adhoc`
+with a short digest of inline SQL. Timings and row counts build up per name for
+the life of the process, and statements slower than `SLOW_QUERY_MS` are logged.
+
+Other expensive stretches of code are recorded the same way, as spans, with
+`record_span(label, seconds)`.
+
+Within a request, opened with `request_scope`, every timing is also added to a
+per-request tally held in a context variable. Once the request finishes,
+`record_request` times it by route template and method, counts its status class
+and logs the request with its tally as one line of key=value pairs.
+"""
+
+import os
+import threading
+from time import time
+from hashlib import sha1
+from logging import getLogger
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Iterator
+
+logger = getLogger("uvicorn.info")
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 500))
+# timings kept per name for percentiles
+SAMPLES_PER_NAME = 512
+# names tracked before the rest are lumped together
+MAX_NAMES = 1024
+OVERFLOW_NAME = "other"
+STARTED_AT = time()
+
+
+@dataclass
+class Timings:
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    rows: int = 0
+    samples: deque[float] = field(
+        default_factory=lambda: deque(maxlen=SAMPLES_PER_NAME)
+    )
+
+    def add(self, seconds: float, rows: int | None = None) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+        if rows is not None and rows >= 0:
+            self.rows += rows
+
+    def p95(self) -> float:
+        samples = sorted(self.samples)
+        return samples[int(0.95 * (len(samples) - 1))] if samples else 0.0
+
+    def summary(self, name: str) -> dict[str, str | int | float]:
+        return dict(
+            name=name,
+            count=self.count,
+            total_ms=self.total * 1000,
+            mean_ms=self.total / self.count * 1000 if self.count else 0.0,
+            p95_ms=self.p95() * 1000,
+            max_ms=self.max * 1000,
+            rows=self.rows,
+        )
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.timings: dict[str, Timings] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float, rows: int | None = None) -> None:
+        with self._lock:
+            if name not in self.timings and len(self.timings) >= MAX_NAMES:
+                name = OVERFLOW_NAME
+            self.timings.setdefault(name, Timings()).add(seconds, rows)
+
+    def top(self, by: str = "total", limit: int = 20) -> list[dict]:
+        with self._lock:
+            summaries = [t.summary(name) for name, t in self.timings.items()]
+        key = "p95_ms" if by == "p95" else "total_ms"
+        return sorted(summaries, key=lambda s: s[key], reverse=True)[:limit]
+
+    def clear(self) -> None:
+        with self._lock:
+            self.timings.clear()
+
+
+QUERIES = Registry()
+SPANS = Registry()
+REQUESTS = Registry()
+# responses by status class ("2xx", ...), and requests sent to the tarpit
+STATUSES: Counter[str] = Counter()
+
+
+@dataclass
+class RequestTally:
+    queries: int = 0
+    query_time: float = 0.0
+    rows: int = 0
+    spans: dict[str, float] = field(default_factory=dict)
+
+
+CURRENT_REQUEST: ContextVar[RequestTally | None] = ContextVar(
+    "CURRENT_REQUEST", default=None
+)
+
+
+def query_name(sql: str) -> str:
+    """the name of the SQL file the statement came from, if any"""
+    if name := getattr(sql, "name", None):
+        return name
+    return f"adhoc:{sha1(sql.encode()).hexdigest()[:8]}"
+
+
+def record_query(sql: str, seconds: float, rows: int | None = None) -> None:
+    name = query_name(sql)
+    QUERIES.add(name, seconds, rows)
+    if tally := CURRENT_REQUEST.get():
+        tally.queries += 1
+        tally.query_time += seconds
+        if rows is not None and rows >= 0:
+            tally.rows += rows
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        outcome = "failed" if rows is None else f"{rows} rows"
+        logger.warning(f"Slow query {name}: {seconds * 1000:.0f}ms, {outcome}")
+
+
+def record_span(label: str, seconds: float) -> None:
+    SPANS.add(label, seconds)
+    if tally := CURRENT_REQUEST.get():
+        tally.spans[label] = tally.spans.get(label, 0.0) + seconds
+    logger.info(f"{label}: {seconds:.3f}s")
+
+
+@contextmanager
+def request_scope() -> Iterator[RequestTally]:
+    tally = RequestTally()
+    token = CURRENT_REQUEST.set(tally)
+    try:
+        yield tally
+    finally:
+        CURRENT_REQUEST.reset(token)
+
+
+def record_request(
+    method: str, route: str, status: int, seconds: float, tally: RequestTally
+) -> None:
+    """
+    :param route: the path template of the matched route, so that
+        requests for different resources are timed together
+    """
+    REQUESTS.add(f"{method} {route}", seconds, tally.rows)
+    STATUSES[f"{status // 100}xx"] += 1
+    logger.info(
+        f"request method={method} route={route} status={status} "
+        f"ms={seconds * 1000:.1f} queries={tally.queries} "
+        f"query_ms={tally.query_time * 1000:.1f} rows={tally.rows}"
+    )
+
+
+def report(by: str = "total", limit: int = 20) -> dict:
+    return dict(
+        since=STARTED_AT,
+        uptime_s=time() - STARTED_AT,
+        statuses=dict(STATUSES),
+        requests=REQUESTS.top(by, limit),
+        queries=QUERIES.top(by, limit),
+        spans=SPANS.top(by, limit),
+    )
@@ -0,0 +1,145 @@
+"""Connection pool settings and telemetry for the database engines.
+
+Every setting comes from the environment:
+    DB_POOL_SIZE            - connections kept open (default 5)
+    DB_MAX_OVERFLOW         - connections opened beyond that under load (default 10)
+    DB_POOL_TIMEOUT         - seconds to wait for a connection before failing (30)
+    DB_POOL_RECYCLE         - seconds after which a connection is replaced, so
+                                RDS-side idle timeouts never hand out a dead one (1800)
+    DB_POOL_PRE_PING        - test each connection as it's checked out (true)
+    DB_STATEMENT_TIMEOUT_MS - server-side limit on any one statement, 0 for none (0)
+
+`PoolMetrics` hooks into a pool's events to count checkouts, check-ins, new and
+invalidated connections, and to follow how many connections are in use. The
+time spent waiting for a connection is measured by `TimedQueuePool` and its
+async counterpart, since no pool event fires before the wait.
+"""
+
+import os
+import threading
+from time import perf_counter
+from collections import Counter, deque
+from statistics import quantiles
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import Pool, QueuePool, AsyncAdaptedQueuePool
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true")
+STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))
+# checkout waits kept for the latency percentiles
+WAIT_SAMPLES = 1000
+
+
+def pool_options() -> dict:
+    return dict(
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+        pool_recycle=POOL_RECYCLE,
+        pool_pre_ping=POOL_PRE_PING,
+    )
+
+
+class PoolMetrics:
+    def __init__(self) -> None:
+        self.counts = Counter()
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.waits: deque[float] = deque(maxlen=WAIT_SAMPLES)
+        self._lock = threading.Lock()
+        self.pool: Pool = None
+
+    def attach(self, pool: Pool) -> None:
+        self.pool = pool
+        event.listen(pool, "connect", self._on_connect)
+        event.listen(pool, "checkout", self._on_checkout)
+        event.listen(pool, "checkin", self._on_checkin)
+        event.listen(pool, "invalidate", self._on_invalidate)
+
+    def _on_connect(self, dbapi_connection, connection_record) -> None:
+        self.counts["connects"] += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, proxy) -> None:
+        with self._lock:
+            self.counts["checkouts"] += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def _on_checkin(self, dbapi_connection, connection_record) -> None:
+        with self._lock:
+            self.counts["checkins"] += 1
+            self.in_use = max(self.in_use - 1, 0)
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception) -> None:
+        self.counts["invalidations"] += 1
+
+    def record_wait(self, seconds: float, timed_out: bool = False) -> None:
+        self.waits.append(seconds)
+        if timed_out:
+            self.counts["timeouts"] += 1
+
+    def stats(self) -> dict[str, int | float]:
+        stats = dict(self.counts) | {
+            "in_use": self.in_use,
+            "peak_in_use": self.peak_in_use,
+        }
+        if isinstance(self.pool, QueuePool):
+            stats |= {
+                "size": self.pool.size(),
+                "idle": self.pool.checkedin(),
+                # negative until the pool has opened all of its pool_size connections
+                "overflow": self.pool.overflow(),
+            }
+        if waits := list(self.waits):
+            stats |= {"checkout_wait_max_ms": max(waits) * 1000}
+            if len(waits) > 1:
+                cuts = quantiles(waits, n=100, method="inclusive")
+                stats |= {
+                    "checkout_wait_p50_ms": cuts[49] * 1000,
+                    "checkout_wait_p99_ms": cuts[98] * 1000,
+                }
+        return stats
+
+
+class _TimedCheckout:
+    metrics: PoolMetrics = None
+
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeout:
+            if self.metrics:
+                self.metrics.record_wait(perf_counter() - start, timed_out=True)
+            raise
+        if self.metrics:
+            self.metrics.record_wait(perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        # a disposed engine replaces its pool; the metrics carry over
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        if self.metrics:
+            self.metrics.pool = pool
+        return pool
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    """QueuePool that reports how long each checkout waited"""
+
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that reports how long each checkout waited"""
+
+
+def instrument(pool: Pool) -> PoolMetrics:
+    metrics = PoolMetrics()
+    metrics.attach(pool)
+    if isinstance(pool, _TimedCheckout):
+        pool.metrics = metrics
+    return metrics
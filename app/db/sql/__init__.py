@@ -1,34 +1,107 @@
 """Makes all `.sql` contents under `app.db.sql` available
-as variables with names that match the filenames.
+as attributes of `queries` with names that match the filenames.
+
+Nothing is read at import. The directory is indexed on the first lookup and
+each file is read the first time its query is used. A query is a `SQL` string,
+so it can go anywhere SQL text does, and it carries a cached `text()` clause
+with its bind parameters already parsed, which `Database.execute` runs as is.
+
+`__init__.pyi`, the stub that lets editors see the query names, is written by
+an explicit build step rather than on import:
+
+    python -m app.db.sql
 """
 
 import os
-from types import SimpleNamespace
+import threading
+from functools import cached_property
 from logging import getLogger
+from sqlalchemy import text
+from sqlalchemy.sql.elements import TextClause
 
 logger = getLogger("uvicorn.info")
 
+SQL_DIR = os.path.dirname(__file__)
+STUB_PATH = os.path.join(SQL_DIR, "__init__.pyi")
+
+
+class SQL(str):
+    """the text of a named query"""
+
+    name: str
+
+    def __new__(cls, sql: str, name: str) -> "SQL":
+        obj = super().__new__(cls, sql)
+        obj.name = name
+        return obj
+
+    def __reduce__(self):
+        return SQL, (str(self), self.name)
+
+    @cached_property
+    def clause(self) -> TextClause:
+        return text(self)
+
+
+class Queries:
+    def __init__(self, directory: str = SQL_DIR) -> None:
+        self._directory = directory
+        self._paths: dict[str, str] = None
+        self._loaded: dict[str, SQL] = {}
+        self._lock = threading.Lock()
+
+    def _index(self) -> dict[str, str]:
+        if self._paths is None:
+            paths = {}
+            for root, _, files in os.walk(self._directory):
+                for file in files:
+                    file_name, ext = os.path.splitext(file)
+                    if ext == ".sql":
+                        if file_name in paths:
+                            logger.warning(
+                                f"Possible duplicate sql filename: {file} in {root}"
+                            )
+                        paths[file_name] = os.path.join(root, file)
+            self._paths = paths
+        return self._paths
+
+    def __getattr__(self, name: str) -> SQL:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if (sql := self._loaded.get(name)) is not None:
+            return sql
+        with self._lock:
+            if (sql := self._loaded.get(name)) is not None:
+                return sql
+            try:
+                path = self._index()[name]
+            except KeyError:
+                raise AttributeError(f"no query named {name!r} in {self._directory}")
+            with open(path, "r") as f:
+                sql = SQL(f.read(), name)
+            self._loaded[name] = sql
+            return sql
+
+    def __dir__(self) -> list[str]:
+        return sorted(self._index())
+
 
-class Queries(SimpleNamespace):
-    pass
+def build_stub(path: str = STUB_PATH) -> None:
+    stub_content = (
+        "from sqlalchemy.sql.elements import TextClause\n"
+        "class SQL(str):\n"
+        "    name: str\n"
+        "    @property\n"
+        "    def clause(self) -> TextClause: ...\n"
+        "class Queries:\n"
+        + "".join(f"    {name}: SQL\n" for name in dir(queries))
+        + "queries: Queries\n"
+        "def build_stub(path: str = ...) -> None: ...\n"
+    )
+    with open(path, "w") as f:
+        f.write(stub_content)
 
 
 queries = Queries()
 
-stub_content = "from types import SimpleNamespace\nclass Queries(SimpleNamespace):\n"
-dir_ = os.path.dirname(__file__)
-for root, _, files in os.walk(dir_):
-    for file in files:
-        file_name, ext = os.path.splitext(file)
-        if ext == ".sql":
-            with open(os.path.join(root, file), "r") as f:
-                if hasattr(queries, file_name):
-                    logger.warning(f"Possible duplicate sql filename: {file} in {root}")
-                setattr(queries, file_name, f.read())
-                stub_content += f"    {file_name}: str\n"
-stub_content += "queries: Queries"
-
-with open(os.path.join(dir_, "__init__.pyi"), "w") as f:
-    f.write(stub_content)
-
-__all__ = ["queries"]
+__all__ = ["queries", "SQL"]
@@ -1,94 +1,105 @@
-from types import SimpleNamespace
-class Queries(SimpleNamespace):
-    insert_vendor_customer_attrs: str
-    insert_vendor_product_attrs: str
-    atco_price_updates: str
-    atco_pricing_pop_temp: str
-    atco_mults_temp_setup: str
-    atco_mults_pop_temp: str
-    atco_teardown: str
-    atco_pricing_temp_setup: str
-    friedrich_price_update_est_fut_cust: str
-    friedrich_price_update_pop_class: str
-    friedrich_price_update_est_fut_class: str
-    friedrich_price_update_pop_cust: str
-    friedrich_price_update_temp_tables: str
-    friedrich_price_update_teardown: str
-    product_series_update: str
-    customer_product_class_discount_update: str
-    customer_pricing_update: str
-    apply_percentage_on_customer_price: str
-    signal_updatable_futures: str
-    product_series_overrides_expired: str
-    apply_percentage_on_class_price: str
-    class_pricing_update: str
-    customer_product_discount_update: str
-    rollback_price_increase: str
-    product_series_pricing_with_override_dynamic: str
-    product_series_pricing_reach_into_future: str
-    glasfloss_standard_filter: str
-    glasfloss_customer_product_multiplier: str
-    glasfloss_filter_features: str
-    glasfloss_mto_lookup: str
-    glasfloss_customer_product_class_multiplier: str
-    delay_product_discounts: str
-    delay_product_series_pricing: str
-    delay_signal_eligible_tables: str
-    delay_pricing_by_class: str
-    delay_pricing_by_customer: str
-    delay_product_class_discounts: str
-    pricing_by_class_json: str
-    pricing_by_customer_json: str
-    vendor_customer_pricing_class_preflight: str
-    vendor_customer_pricing_class_patch_followup: str
-    get_class_discount_future: str
-    get_product_discount_current: str
-    get_product_discount_future: str
-    get_class_discount_current: str
-    update_customer_pricing_future: str
-    new_customer_pricing_current: str
-    new_customer_pricing_future: str
-    update_customer_pricing_current: str
-    adp_parts_model_lookup_price: str
-    adp_parts_establish_future: str
-    adp_parts_insert_new_product: str
-    adp_parts_new_product_pricing: str
-    adp_parts_insert_setup_attrs_new_product: str
-    adp_parts_populate_temp: str
-    adp_parts_temp_table: str
-    adp_zero_disc_establish_future: str
-    adp_zero_disc_pop_temp: str
-    adp_zero_disc_get_all_models: str
-    adp_zero_disc_setup: str
-    adp_zero_disc_teardown: str
-    adp_customers_temp_teardown: str
-    adp_customers_insert_new: str
-    adp_customers_tamp_table: str
-    adp_customers_pop_temp: str
-    adp_discounts_establish_future: str
-    adp_discounts_populate_temp: str
-    adp_discounts_temp_table: str
-    adp_discounts_temp_teardown: str
-    adp_discounts_insert_new: str
-    adp_customer_pricing_pop_temp: str
-    adp_customer_pricing_teardown: str
-    adp_customer_pricing_temp_setup: str
-    adp_customer_pricing_establish_future: str
-    adp_customer_pricing_all_models: str
-    adp_snps_insert_new: str
-    adp_snps_teardown: str
-    adp_snps_pop_temp: str
-    adp_snps_temp_table: str
-    adp_snps_establish_future: str
-    adp_customer_aliases: str
-    adp_customer_parts: str
-    adp_strategy_custom_descriptions: str
-    adp_strategy_product_attributes: str
-    adp_customer_strategy_data: str
-    adp_customer_attributes: str
-    adp_strategy_custom_features: str
-    adp_product_series_pop_temp: str
-    adp_product_series_temp_table: str
-    adp_product_series_teardown: str
-    adp_product_series_establish_future: str
-queries: Queries
\ No newline at end of file
+from sqlalchemy.sql.elements import TextClause
+class SQL(str):
+    name: str
+    @property
+    def clause(self) -> TextClause: ...
+class Queries:
+    adp_customer_aliases: SQL
+    adp_customer_attributes: SQL
+    adp_customer_parts: SQL
+    adp_customer_pricing_all_models: SQL
+    adp_customer_pricing_establish_future: SQL
+    adp_customer_pricing_pop_temp: SQL
+    adp_customer_pricing_pop_temp_from_progress: SQL
+    adp_customer_pricing_progress_clear: SQL
+    adp_customer_pricing_progress_completed: SQL
+    adp_customer_pricing_progress_pop: SQL
+    adp_customer_pricing_progress_setup: SQL
+    adp_customer_pricing_teardown: SQL
+    adp_customer_pricing_temp_setup: SQL
+    adp_customer_strategy_data: SQL
+    adp_customers_insert_new: SQL
+    adp_customers_pop_temp: SQL
+    adp_customers_tamp_table: SQL
+    adp_customers_temp_teardown: SQL
+    adp_discounts_establish_future: SQL
+    adp_discounts_insert_new: SQL
+    adp_discounts_populate_temp: SQL
+    adp_discounts_temp_table: SQL
+    adp_discounts_temp_teardown: SQL
+    adp_parts_establish_future: SQL
+    adp_parts_insert_new_product: SQL
+    adp_parts_insert_setup_attrs_new_product: SQL
+    adp_parts_model_lookup_price: SQL
+    adp_parts_new_product_pricing: SQL
+    adp_parts_populate_temp: SQL
+    adp_parts_temp_table: SQL
+    adp_product_series_establish_future: SQL
+    adp_product_series_pop_temp: SQL
+    adp_product_series_teardown: SQL
+    adp_product_series_temp_table: SQL
+    adp_snps_establish_future: SQL
+    adp_snps_insert_new: SQL
+    adp_snps_pop_temp: SQL
+    adp_snps_teardown: SQL
+    adp_snps_temp_table: SQL
+    adp_strategy_custom_descriptions: SQL
+    adp_strategy_custom_features: SQL
+    adp_strategy_product_attributes: SQL
+    adp_zero_disc_establish_future: SQL
+    adp_zero_disc_get_all_models: SQL
+    adp_zero_disc_pop_temp: SQL
+    adp_zero_disc_setup: SQL
+    adp_zero_disc_teardown: SQL
+    apply_percentage_on_class_price: SQL
+    apply_percentage_on_customer_price: SQL
+    atco_mults_pop_temp: SQL
+    atco_mults_temp_setup: SQL
+    atco_price_updates: SQL
+    atco_pricing_pop_temp: SQL
+    atco_pricing_temp_setup: SQL
+    atco_teardown: SQL
+    class_pricing_update: SQL
+    customer_pricing_update: SQL
+    customer_product_class_discount_update: SQL
+    customer_product_discount_update: SQL
+    delay_pricing_by_class: SQL
+    delay_pricing_by_customer: SQL
+    delay_product_class_discounts: SQL
+    delay_product_discounts: SQL
+    delay_product_series_pricing: SQL
+    delay_signal_eligible_tables: SQL
+    friedrich_price_update_est_fut_class: SQL
+    friedrich_price_update_est_fut_cust: SQL
+    friedrich_price_update_pop_class: SQL
+    friedrich_price_update_pop_cust: SQL
+    friedrich_price_update_teardown: SQL
+    friedrich_price_update_temp_tables: SQL
+    get_class_discount_current: SQL
+    get_class_discount_future: SQL
+    get_product_discount_current: SQL
+    get_product_discount_future: SQL
+    glasfloss_customer_product_class_multiplier: SQL
+    glasfloss_customer_product_multiplier: SQL
+    glasfloss_filter_features: SQL
+    glasfloss_mto_lookup: SQL
+    glasfloss_standard_filter: SQL
+    insert_vendor_customer_attrs: SQL
+    insert_vendor_product_attrs: SQL
+    new_customer_pricing_current: SQL
+    new_customer_pricing_future: SQL
+    pricing_both_json: SQL
+    pricing_by_class_json: SQL
+    pricing_by_customer_json: SQL
+    product_series_overrides_expired: SQL
+    product_series_pricing_reach_into_future: SQL
+    product_series_pricing_with_override_dynamic: SQL
+    product_series_update: SQL
+    rollback_price_increase: SQL
+    signal_updatable_futures: SQL
+    update_customer_pricing_current: SQL
+    update_customer_pricing_future: SQL
+    vendor_customer_pricing_class_patch_followup: SQL
+    vendor_customer_pricing_class_preflight: SQL
+queries: Queries
+def build_stub(path: str = ...) -> None: ...
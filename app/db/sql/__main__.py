@@ -0,0 +1,6 @@
+"""write the `queries` stub: python -m app.db.sql"""
+
+from app.db.sql import build_stub, STUB_PATH
+
+build_stub()
+print(f"wrote {STUB_PATH}")
@@ -0,0 +1,4 @@
+INSERT INTO adp_customer_nets (id, price)
+SELECT id, price
+FROM adp_customer_nets_progress
+WHERE effective_date = :ed;
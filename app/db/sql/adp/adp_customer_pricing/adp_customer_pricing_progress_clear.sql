@@ -0,0 +1,2 @@
+DELETE FROM adp_customer_nets_progress
+WHERE effective_date = :ed;
@@ -0,0 +1,3 @@
+SELECT id
+FROM adp_customer_nets_progress
+WHERE effective_date = :ed;
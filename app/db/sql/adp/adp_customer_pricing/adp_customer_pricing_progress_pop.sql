@@ -0,0 +1,4 @@
+INSERT INTO adp_customer_nets_progress (id, effective_date, vendor_customer_id, price)
+VALUES (:id, :ed, :customer_id, :price)
+ON CONFLICT (id, effective_date)
+DO UPDATE SET price = EXCLUDED.price;
@@ -0,0 +1,8 @@
+-- survives a crashed worker so an interrupted repricing run can pick up where it left off
+CREATE TABLE IF NOT EXISTS adp_customer_nets_progress (
+    id int NOT NULL,
+    effective_date timestamp NOT NULL,
+    vendor_customer_id int NOT NULL,
+    price int NOT NULL,
+    PRIMARY KEY (id, effective_date)
+);
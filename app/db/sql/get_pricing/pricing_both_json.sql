@@ -0,0 +1,222 @@
+-- get class-based and customer-specific pricing as nested JSON in one result
+-- class pricing is left out wherever the customer has an override on the product,
+-- limited to the class pricing categories in :categories_to_override, if any
+-- dates are cast to timestamps so they serialize the same way the Pricing model does
+WITH notes_agg AS (
+    SELECT
+        pricing_by_customer_id,
+        COALESCE(
+            json_agg(
+                json_build_object(
+                    'id', id,
+                    'attr', attr,
+                    'type', type,
+                    'value', value
+                )
+            )::jsonb,
+            '[]'::jsonb
+        ) AS notes
+    FROM vendor_pricing_by_customer_attrs
+    WHERE deleted_at IS NULL
+    GROUP BY pricing_by_customer_id
+), product_attrs_agg AS (
+    SELECT
+        vendor_product_id as product_id,
+        COALESCE(
+            json_agg(
+                json_build_object(
+                    'id', id,
+                    'attr', attr,
+                    'type', type,
+                    'value', value
+                )
+            )::jsonb,
+            '[]'::jsonb
+        ) as attrs
+        FROM vendor_product_attrs
+        WHERE deleted_at IS NULL
+        GROUP BY vendor_product_id
+), product_details as (
+    SELECT
+        vp.id AS product_id,
+        json_build_object(
+            'id', vp.id,
+            'part_id', vp.vendor_product_identifier,
+            'description', vp.vendor_product_description,
+            'categories', COALESCE(
+                json_agg (
+                    json_build_object(
+                        'id', product_class.id,
+                        'name', product_class.name,
+                        'rank', product_class.rank
+                    )
+                ) FILTER (WHERE product_class.id IS NOT NULL)::jsonb,
+                '[]'::jsonb
+            ),
+            'attrs', COALESCE(pa.attrs, '[]'::jsonb)
+        )::jsonb AS product
+    FROM vendor_products vp
+    LEFT JOIN vendor_product_to_class_mapping vp_class_map
+        ON vp_class_map.product_id = vp.id
+    LEFT JOIN vendor_product_classes product_class
+        ON product_class.id = vp_class_map.product_class_id
+        AND product_class.vendor_id = :vendor_id
+    LEFT JOIN product_attrs_agg as pa
+        ON pa.product_id = vp.id
+    WHERE vp.vendor_id = :vendor_id
+        AND vp.deleted_at IS NULL
+    GROUP BY vp.id, vp.vendor_product_identifier, vp.vendor_product_description, pa.attrs
+), customer_pricing AS (
+    SELECT
+        vpc.id,
+        vpc.use_as_override as override,
+        json_build_object(
+            'id', vendor_pricing_classes.id,
+            'name', vendor_pricing_classes.name
+        )::jsonb as category,
+        vpc.product_id,
+        vpc.price,
+        vpc.effective_date
+    FROM vendor_pricing_by_customer vpc
+    JOIN vendor_pricing_classes
+        ON vendor_pricing_classes.id = vpc.pricing_class_id
+        AND vendor_pricing_classes.vendor_id = :vendor_id
+    WHERE EXISTS (
+        SELECT 1
+        FROM vendor_customers a
+        WHERE a.id = :customer_id
+            AND a.id = vpc.vendor_customer_id
+            AND a.vendor_id = :vendor_id
+            AND a.deleted_at IS NULL
+    )
+    AND vpc.deleted_at IS NULL
+), class_pricing AS (
+    SELECT
+        vpc.id,
+        json_build_object(
+            'id', vendor_pricing_classes.id,
+            'name', vendor_pricing_classes.name
+        )::jsonb as category,
+        vendor_pricing_classes.name as category_name,
+        vpc.product_id,
+        -- allow optional masking/override behavior when multiple price classes are
+        -- assigned to a customer
+        -- if priority values match, both records return
+        DENSE_RANK() OVER (
+            PARTITION BY vpc.product_id
+            ORDER BY vendor_pricing_classes.priority DESC
+        ) as price_rank,
+        vpc.price,
+        vpc.effective_date
+    FROM vendor_pricing_by_class vpc
+    JOIN vendor_pricing_classes
+        ON vendor_pricing_classes.id = vpc.pricing_class_id
+    JOIN product_details
+        ON product_details.product_id = vpc.product_id
+    WHERE EXISTS (
+        SELECT 1
+        FROM vendor_customers a
+        JOIN vendor_customer_pricing_classes b
+            ON b.vendor_customer_id = a.id
+        WHERE b.pricing_class_id = vpc.pricing_class_id
+            AND a.id = :customer_id
+            AND a.vendor_id = :vendor_id
+            AND b.deleted_at IS NULL
+    )
+    AND vendor_pricing_classes.vendor_id = :vendor_id
+    AND vpc.deleted_at IS NULL
+), all_pricing AS (
+    SELECT
+        'class' as source,
+        class_pricing.id,
+        NULL::boolean as override,
+        class_pricing.category,
+        class_pricing.product_id,
+        class_pricing.price,
+        class_pricing.effective_date
+    FROM class_pricing
+    WHERE class_pricing.price_rank = 1
+    AND NOT (
+        EXISTS (
+            SELECT 1
+            FROM customer_pricing
+            WHERE customer_pricing.product_id = class_pricing.product_id
+                AND customer_pricing.override
+        )
+        AND (
+            CARDINALITY(CAST(:categories_to_override AS text[])) = 0
+            OR class_pricing.category_name = ANY(
+                CAST(:categories_to_override AS text[])
+            )
+        )
+    )
+    UNION ALL
+    SELECT
+        'customer' as source,
+        customer_pricing.id,
+        customer_pricing.override,
+        customer_pricing.category,
+        customer_pricing.product_id,
+        customer_pricing.price,
+        customer_pricing.effective_date
+    FROM customer_pricing
+)
+SELECT
+    all_pricing.id,
+    all_pricing.override,
+    all_pricing.category,
+    jsonb_strip_nulls(product_details.product) as product,
+    all_pricing.price,
+    all_pricing.effective_date::timestamp as effective_date,
+    COALESCE(history.history, '[]'::jsonb) as history,
+    CASE
+        WHEN future.price IS NULL
+        THEN NULL
+        ELSE json_build_object(
+            'price', future.price,
+            'effective_date', future.effective_date::timestamp
+        )::jsonb
+        END as future,
+    CASE
+        WHEN all_pricing.source = 'customer'
+        THEN jsonb_strip_nulls(COALESCE(na.notes, '[]'::jsonb))
+        END as notes
+FROM all_pricing
+JOIN product_details
+    ON product_details.product_id = all_pricing.product_id
+LEFT JOIN LATERAL (
+    SELECT price, effective_date
+    FROM vendor_pricing_by_class_future
+    WHERE all_pricing.source = 'class'
+        AND price_id = all_pricing.id
+    UNION ALL
+    SELECT price, effective_date
+    FROM vendor_pricing_by_customer_future
+    WHERE all_pricing.source = 'customer'
+        AND price_id = all_pricing.id
+) AS future ON true
+LEFT JOIN LATERAL (
+    SELECT json_agg(
+        json_build_object(
+            'id', h.id,
+            'price', h.price,
+            'effective_date', h.effective_date::timestamp,
+            'timestamp', h.timestamp
+        )
+    )::jsonb as history
+    FROM (
+        SELECT id, price, effective_date, timestamp
+        FROM vendor_pricing_by_class_changelog
+        WHERE all_pricing.source = 'class'
+            AND vendor_pricing_by_class_id = all_pricing.id
+        UNION ALL
+        SELECT id, price, effective_date, timestamp
+        FROM vendor_pricing_by_customer_changelog
+        WHERE all_pricing.source = 'customer'
+            AND vendor_pricing_by_customer_id = all_pricing.id
+    ) AS h
+) AS history ON true
+LEFT JOIN notes_agg AS na
+    ON all_pricing.source = 'customer'
+    AND na.pricing_by_customer_id = all_pricing.id
+ORDER BY all_pricing.source;
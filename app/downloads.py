@@ -1,7 +1,17 @@
 from dotenv import load_dotenv
 
 load_dotenv()
+import os
+import heapq
+import pickle
+import asyncio
+import tempfile
+import threading
 from io import BytesIO
+from pathlib import Path
+from logging import getLogger
+from functools import partial
+from collections import Counter
 from dataclasses import dataclass
 from os import getenv
 from datetime import datetime, timedelta
@@ -12,7 +22,10 @@ from starlette.background import BackgroundTask
 from fastapi.responses import StreamingResponse
 from fastapi import HTTPException, status
 
-from app.db import Stage
+from app.db import Stage, Session, DB_V2
+from app.db.cache import shared_directory
+
+logger = getLogger("uvicorn.info")
 
 BytesLike = bytes | BytesIO
 
@@ -84,6 +97,55 @@ class DownloadLink(BaseModel):
     downloadLink: str
 
 
+# minutes a download link stays redeemable
+DL_LINK_DURATION = timedelta(minutes=float(getenv("DL_LINK_DURATION", 5)))
+DL_LINK_MAX_ACTIVE = int(getenv("DL_LINK_MAX_ACTIVE", 1000))
+# seconds between sweeps for expired links
+DL_LINK_SWEEP_INTERVAL = float(getenv("DL_LINK_SWEEP_INTERVAL", 60))
+# "memory" keeps links in the worker that issued them,
+# "file" shares them with every worker on the host through DL_LINK_DIR,
+# which has to be owned by the app's user with mode 0700
+DL_LINK_STORE = getenv("DL_LINK_STORE", "memory").lower()
+
+
+class DetachedSession:
+    """Stands in for a database session captured by a download callback
+    while the request is stored. A fresh session takes its place when the
+    link is redeemed and is closed once the callback returns."""
+
+
+def map_callback(callback: Any, replace: Callable[[Any], Any]) -> Any:
+    """`replace` applied to everything bound into a (possibly nested) partial"""
+    if isinstance(callback, partial):
+        return partial(
+            map_callback(callback.func, replace),
+            *(map_callback(arg, replace) for arg in callback.args),
+            **{k: map_callback(v, replace) for k, v in callback.keywords.items()},
+        )
+    return replace(callback)
+
+
+def _detach(value: Any) -> Any:
+    return DetachedSession() if isinstance(value, Session) else value
+
+
+def _run_attached(callback: Callable) -> Any:
+    sessions = []
+
+    def attach(value: Any) -> Any:
+        if isinstance(value, DetachedSession):
+            db = DB_V2.get_db()
+            sessions.append(db)
+            return next(db)
+        return value
+
+    try:
+        return map_callback(callback, attach)()
+    finally:
+        for db in sessions:
+            db.close()
+
+
 @dataclass
 class DownloadRequest:
     resource: str
@@ -95,9 +157,11 @@ class DownloadRequest:
         return self.download_id.__hash__()
 
     def __post_init__(self) -> None:
-        duration = timedelta(float(getenv("DL_LINK_DURATION")) * 60)
-        self.expires_at = datetime.now() + duration
+        self.expires_at = datetime.now() + DL_LINK_DURATION
         self.download_id = uuid4()
+        if self.callback:
+            # don't hold on to the issuing request's session
+            self.callback = map_callback(self.callback, _detach)
 
     def __bool__(self) -> bool:
         return datetime.now() <= self.expires_at
@@ -105,9 +169,35 @@ class DownloadRequest:
     def __eq__(self, other) -> bool:
         return self.download_id == other
 
+    def attach(self) -> None:
+        """bind fresh sessions to the callback for redemption"""
+        if self.callback:
+            self.callback = partial(_run_attached, self.callback)
+
+    def release(self) -> None:
+        """drop the callback and whatever payload it captured"""
+        self.callback = None
+
 
 class DownloadIDs:
+    """Download links waiting to be redeemed, each good for one use.
+
+    Links are held in memory, up to `DL_LINK_MAX_ACTIVE` of them, soonest to
+    expire evicted first, with an expiry heap the sweeper task works through.
+    With `DL_LINK_STORE=file`, links are pickled into `DL_LINK_DIR` instead,
+    with the file's mtime set to the link's expiration, so a link can be redeemed
+    by any worker on the host. A link whose callback can't be pickled stays in
+    memory in the worker that issued it, as do all links if `DL_LINK_DIR` is
+    unset or not private to the app's user.
+    """
+
     active_requests: dict[int, DownloadRequest] = dict()
+    expiry_heap: list[tuple[datetime, int]] = []
+    metrics: Counter = Counter()
+    shared_dir: Optional[Path] = (
+        shared_directory("DL_LINK_DIR") if DL_LINK_STORE == "file" else None
+    )
+    _lock = threading.Lock()
 
     @classmethod
     def add_request(
@@ -120,20 +210,134 @@ class DownloadIDs:
         request = DownloadRequest(
             resource=resource, stage=stage, s3_path=s3_path, callback=callback
         )
-        cls.active_requests.update({hash(request): request})
+        cls.metrics["issued"] += 1
+        if cls.shared_dir and cls._write_shared(request):
+            return str(request.download_id)
+        key = hash(request)
+        with cls._lock:
+            cls.active_requests[key] = request
+            heapq.heappush(cls.expiry_heap, (request.expires_at, key))
+            while len(cls.active_requests) > DL_LINK_MAX_ACTIVE:
+                _, evicted_key = heapq.heappop(cls.expiry_heap)
+                evicted = cls.active_requests.pop(evicted_key, None)
+                if evicted is not None:
+                    evicted.release()
+                    cls.metrics["evicted"] += 1
         return str(request.download_id)
 
     @classmethod
     def use_download(cls, resource: str, id_value: str) -> DownloadRequest:
-        incoming_uuid: int = hash(UUID(id_value))
-        try:
-            stored_request = cls.active_requests.pop(incoming_uuid)
-        except KeyError:
+        incoming_uuid = UUID(id_value)
+        stored_request = cls._pop(incoming_uuid)
+        if stored_request is None:
+            cls.metrics["not_found"] += 1
             raise NonExistant
-        else:
-            if stored_request and stored_request.resource == resource:
-                return stored_request
-            elif not stored_request:
-                raise Expired
-            else:
-                raise ResourceIDNotMatch
+        elif not stored_request:
+            stored_request.release()
+            cls.metrics["expired"] += 1
+            raise Expired
+        elif stored_request.resource != resource:
+            stored_request.release()
+            cls.metrics["resource_mismatch"] += 1
+            raise ResourceIDNotMatch
+        cls.metrics["redeemed"] += 1
+        stored_request.attach()
+        return stored_request
+
+    @classmethod
+    def _pop(cls, download_id: UUID) -> Optional[DownloadRequest]:
+        with cls._lock:
+            request = cls.active_requests.pop(hash(download_id), None)
+            if request is not None:
+                return request
+        if not cls.shared_dir:
+            return None
+        path = cls.shared_dir / f"{download_id}.pkl"
+        # claiming the file by renaming it makes sure only one worker redeems it
+        claimed = path.with_suffix(f".{os.getpid()}.claimed")
+        try:
+            os.rename(path, claimed)
+        except OSError:
+            return None
+        try:
+            with open(claimed, "rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            logger.error(f"Unreadable download link {download_id}: {e}")
+            return None
+        finally:
+            claimed.unlink(missing_ok=True)
+
+    @classmethod
+    def _write_shared(cls, request: DownloadRequest) -> bool:
+        try:
+            data = pickle.dumps(request, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.warning(
+                f"Download link for {request.resource} kept local to this worker, "
+                f"it can't be shared: {e}"
+            )
+            return False
+        path = cls.shared_dir / f"{request.download_id}.pkl"
+        fd, tmp = tempfile.mkstemp(dir=cls.shared_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            expires_at = request.expires_at.timestamp()
+            os.utime(tmp, (expires_at, expires_at))
+            os.replace(tmp, path)
+        except Exception:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        return True
+
+    @classmethod
+    def sweep(cls) -> int:
+        """drop every expired link, and shared links over the cap,
+        soonest to expire first"""
+        now = datetime.now()
+        expired = 0
+        with cls._lock:
+            while cls.expiry_heap and cls.expiry_heap[0][0] < now:
+                _, key = heapq.heappop(cls.expiry_heap)
+                request = cls.active_requests.pop(key, None)
+                if request is not None:
+                    request.release()
+                    expired += 1
+        if cls.shared_dir and cls.shared_dir.exists():
+            links = []
+            for path in cls.shared_dir.glob("*.pkl"):
+                try:
+                    expires_at = path.stat().st_mtime
+                except OSError:
+                    continue
+                if expires_at < now.timestamp():
+                    path.unlink(missing_ok=True)
+                    expired += 1
+                else:
+                    links.append((expires_at, path))
+            overflow = len(links) - DL_LINK_MAX_ACTIVE
+            if overflow > 0:
+                for _, path in sorted(links)[:overflow]:
+                    path.unlink(missing_ok=True)
+                cls.metrics["evicted"] += overflow
+        cls.metrics["expired"] += expired
+        return expired
+
+    @classmethod
+    async def sweeper(cls, interval: float = DL_LINK_SWEEP_INTERVAL) -> None:
+        """run for the life of the app, sweeping out expired links"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if expired := await asyncio.to_thread(cls.sweep):
+                    logger.info(f"{expired} expired download links swept")
+            except Exception as e:
+                logger.error(f"Download link sweep failed: {e}")
+
+    @classmethod
+    def stats(cls) -> dict[str, int]:
+        active = len(cls.active_requests)
+        if cls.shared_dir and cls.shared_dir.exists():
+            active += sum(1 for _ in cls.shared_dir.glob("*.pkl"))
+        return dict(cls.metrics) | {"active": active}
@@ -62,7 +62,7 @@ class Action:
                 raise Exception(
                     "Login Request may have failed. Login attempt returned 302."
                 )
-            await Login().make_request()
+            await Login(self.req_session).make_request()
             return await self.make_request()
         Action._cookies(new_cookies=resp.cookies)
         resp_text = await resp.text()
@@ -25,8 +25,17 @@ Token = Annotated[auth.VerifiedToken, Depends(auth.authenticate_auth0_token)]
 
 
 async def initialize_cookies() -> None:
-    async with aiohttp.ClientSession() as req_session:
-        await Login(req_session).make_request()
+    """
+    Log in to the portal to share its session cookies with later requests.
+    Run in the background at startup: a request made before it finishes
+    logs in on its own when the portal redirects it.
+    """
+    try:
+        async with aiohttp.ClientSession() as req_session:
+            await Login(req_session).make_request()
+    except Exception:
+        logger.exception("Friedrich portal login failed")
+    else:
         logger.info("Retrieved Friedrich Session Cookies")
 
 
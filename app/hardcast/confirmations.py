@@ -3,7 +3,6 @@ import itertools
 import requests
 from app.db import DB_V2
 from io import BytesIO
-from pypdf import PdfReader
 from dataclasses import dataclass, asdict
 from sqlalchemy.orm import Session
 from app.cmmssns import CMMSSNS_URL
@@ -370,6 +369,9 @@ class NoContent(Exception): ...
 
 
 def extract_from_file(file: str | BytesLike) -> Confirmation:
+    # pypdf is only needed here and is slow to import
+    from pypdf import PdfReader
+
     match file:
         case bytes():
             file = BytesIO(file)
@@ -78,8 +78,9 @@ class Pagination(BaseModel):
     # self: str
     first: str
     # prev: str
-    next: NullableStr
-    last: str
+    next: NullableStr = None
+    # cursor pagination has no last page link
+    last: NullableStr = None
 
 
 OptionalPagination = Annotated[Pagination, WrapValidator(set_none_default)]
@@ -147,6 +148,11 @@ class Query(BaseModel):
     # filter: implemented at runtime
     page_number: Optional[StringToNum] = None
     page_size: Optional[StringToNum] = None
+    # keyset pagination: the cursor from the previous page's "next" link,
+    # empty for the first page
+    page_after: Optional[str] = Field(default=None, serialization_alias="page[after]")
+    # exact, cached or none
+    page_count: Optional[str] = Field(default=None, serialization_alias="page[count]")
 
 
 def convert_query(model_type: type[BaseModel]) -> Callable[[BaseModel], dict[str, Any]]:
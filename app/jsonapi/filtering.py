@@ -0,0 +1,116 @@
+"""
+Filter strategies for JSON:API collection filtering.
+
+Models declare how each filterable field is matched with `__filter_strategies__`,
+a mapping of column name to FilterStrategy. Fields left out match by trigram
+if they hold text and exactly otherwise, without an index to back them.
+
+    exact       field = value
+    prefix      field ILIKE 'value%'
+    trigram     field ILIKE '%value%' OR field % 'value' (similarity)
+    fulltext    to_tsvector(field) @@ plainto_tsquery(value)
+
+Prefix and trigram matches are only fast with a GIN trigram index on the column,
+and full-text matches with a GIN index on its tsvector. `index_ddl` writes those
+indexes for every declared field. Run this module to print them:
+
+    python -m app.jsonapi.filtering > filter_indexes.sql
+"""
+
+from enum import StrEnum
+from typing import Iterable
+from sqlalchemy import Column, String, Text, func, or_
+from sqlalchemy.orm import Session, Query as sqlQuery
+from sqlalchemy.sql.elements import ColumnElement
+
+TEXT_SEARCH_CONFIG = "english"
+
+
+class FilterStrategy(StrEnum):
+    EXACT = "exact"
+    PREFIX = "prefix"
+    TRIGRAM = "trigram"
+    FULLTEXT = "fulltext"
+
+
+def strategy_for(model, field: str) -> FilterStrategy:
+    if strategy := getattr(model, "__filter_strategies__", {}).get(field):
+        return FilterStrategy(strategy)
+    column: Column = getattr(model, field)
+    if isinstance(column.type, (String, Text)):
+        return FilterStrategy.TRIGRAM
+    return FilterStrategy.EXACT
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def filter_clause(
+    column: Column, strategy: FilterStrategy, values: Iterable[str]
+) -> ColumnElement[bool]:
+    """match any of the values"""
+    match strategy:
+        case FilterStrategy.EXACT:
+            return column.in_(list(values))
+        case FilterStrategy.PREFIX:
+            return or_(
+                *(column.ilike(_escape_like(v) + "%", escape="\\") for v in values)
+            )
+        case FilterStrategy.TRIGRAM:
+            return or_(
+                *(
+                    or_(
+                        column.ilike("%" + _escape_like(v) + "%", escape="\\"),
+                        column.op("%")(v),
+                    )
+                    for v in values
+                )
+            )
+        case FilterStrategy.FULLTEXT:
+            document = func.to_tsvector(TEXT_SEARCH_CONFIG, column)
+            return or_(
+                *(
+                    document.op("@@")(func.plainto_tsquery(TEXT_SEARCH_CONFIG, v))
+                    for v in values
+                )
+            )
+
+
+def index_ddl(models: Iterable) -> list[str]:
+    """CREATE INDEX statements backing the prefix, trigram and full-text
+    strategies declared on the models"""
+    statements = ["CREATE EXTENSION IF NOT EXISTS pg_trgm;"]
+    for model in models:
+        table = model.__tablename__
+        for field in getattr(model, "__filter_strategies__", {}):
+            column = model.__mapper__.columns[field].name
+            match strategy_for(model, field):
+                case FilterStrategy.PREFIX | FilterStrategy.TRIGRAM:
+                    statements.append(
+                        f"CREATE INDEX IF NOT EXISTS ix_{table}_{column}_trgm "
+                        f"ON {table} USING gin ({column} gin_trgm_ops);"
+                    )
+                case FilterStrategy.FULLTEXT:
+                    statements.append(
+                        f"CREATE INDEX IF NOT EXISTS ix_{table}_{column}_fts "
+                        f"ON {table} USING gin "
+                        f"(to_tsvector('{TEXT_SEARCH_CONFIG}', {column}));"
+                    )
+    return statements
+
+
+def explain(session: Session, query: sqlQuery) -> list[str]:
+    """the planner's EXPLAIN output for the query, without running it"""
+    connection = session.connection()
+    compiled = query.statement.compile(
+        dialect=connection.dialect, compile_kwargs={"render_postcompile": True}
+    )
+    plan = connection.exec_driver_sql(f"EXPLAIN {compiled}", compiled.params)
+    return plan.scalars().all()
+
+
+if __name__ == "__main__":
+    from app.jsonapi.sqla_models import Base
+
+    print("\n".join(index_ddl(mapper.class_ for mapper in Base.registry.mappers)))
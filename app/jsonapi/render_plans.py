@@ -0,0 +1,135 @@
+"""
+Compiled render plans for serializing full JSON:API resources.
+
+Everything `_render_full_resource` needs to know about a model, apart from the
+instance values themselves, depends only on the shape of the request: the model,
+its sparse fieldset and the includes below it. A RenderPlan captures that once per
+shape, with the attribute getters, relationship handlers and permission tests
+already looked up, so rendering an instance is a loop over the plan.
+
+Plans are immutable and cached with `render_plan`, keyed by the shape.
+"""
+
+from operator import attrgetter
+from functools import lru_cache
+from dataclasses import dataclass
+from itertools import chain
+from typing import Any, Callable
+from sqlalchemy_jsonapi.serializer import (
+    AttributeActions,
+    MANYTOONE,
+    Permissions,
+    RelationshipActions,
+)
+
+MAX_RENDER_PLANS = 1024
+
+Include = tuple[tuple[str, tuple[str, ...]], ...]
+PermissionTest = Callable[[Any], bool] | None
+
+
+@dataclass(frozen=True, slots=True)
+class AttributePlan:
+    api_key: str
+    get: Callable[[Any], Any]
+    permitted: PermissionTest
+
+
+@dataclass(frozen=True, slots=True)
+class RelationshipPlan:
+    api_key: str
+    to_one: bool
+    in_fields: bool
+    included: bool
+    get: Callable[[Any], Any]
+    permitted: PermissionTest
+    # the includes to render below each related item
+    include: dict[str, list[str]]
+
+
+@dataclass(frozen=True, slots=True)
+class RenderPlan:
+    api_type: str
+    attributes: tuple[AttributePlan, ...]
+    relationships: tuple[RelationshipPlan, ...]
+    # every resource named anywhere in the includes below this one
+    downstream: frozenset[str]
+
+
+def freeze_include(include: dict[str, list[str]]) -> Include:
+    return tuple(sorted((key, tuple(nested)) for key, nested in include.items()))
+
+
+def permission_test(model, field: str | None) -> PermissionTest:
+    """the model's VIEW test for the field, or None if it declares none"""
+    return model.__jsonapi_permissions__.get(field, {}).get(Permissions.VIEW)
+
+
+def _parse_include(include: tuple[str, ...]) -> dict[str, list[str]]:
+    parsed = {}
+    for item in include:
+        local, _, remote = item.partition(".")
+        parsed.setdefault(local, [])
+        if remote:
+            parsed[local].append(remote)
+    return parsed
+
+
+@lru_cache(maxsize=MAX_RENDER_PLANS)
+def render_plan(model, fields: tuple[str, ...] | None, include: Include) -> RenderPlan:
+    """
+    :param model: The model class being rendered
+    :param fields: The sparse fieldset (API keys) for the model's type, if any
+    :param include: The model's includes, frozen with `freeze_include`
+    """
+    mapper = model.__mapper__
+    orm_desc_keys = mapper.all_orm_descriptors.keys()
+    to_api = model.__jsonapi_map_to_api__
+    if fields is not None:
+        local_fields = {model.__jsonapi_map_to_py__[field] for field in fields}
+    else:
+        local_fields = set(orm_desc_keys)
+    includes = dict(include)
+
+    attrs_to_ignore = {"__mapper__", "id"}
+    relationships = []
+    for key, relationship in mapper.relationships.items():
+        attrs_to_ignore |= {c.name for c in relationship.local_columns} | {key}
+        api_key = to_api[key]
+        relationships.append(
+            RelationshipPlan(
+                api_key=api_key,
+                to_one=relationship.direction == MANYTOONE,
+                in_fields=key in local_fields,
+                included=api_key in includes,
+                get=model.__jsonapi_rel_desc__.get(key, {}).get(
+                    RelationshipActions.GET, attrgetter(key)
+                ),
+                permitted=permission_test(model, key),
+                include=_parse_include(includes.get(api_key, ())),
+            )
+        )
+
+    attributes = []
+    # attributes left out of the fieldset are never read
+    for key in (set(orm_desc_keys) - attrs_to_ignore) & local_fields:
+        attributes.append(
+            AttributePlan(
+                api_key=to_api[key],
+                get=model.__jsonapi_attribute_descriptors__.get(key, {}).get(
+                    AttributeActions.GET, attrgetter(key)
+                ),
+                permitted=permission_test(model, key),
+            )
+        )
+
+    return RenderPlan(
+        api_type=model.__jsonapi_type__,
+        attributes=tuple(attributes),
+        relationships=tuple(relationships),
+        downstream=frozenset(
+            chain.from_iterable(
+                nested.split(".") for nested in chain.from_iterable(includes.values())
+            )
+        ),
+    )
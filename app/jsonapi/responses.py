@@ -0,0 +1,198 @@
+"""
+Fast responses for trusted JSON:API payloads.
+
+Routes return the dicts built by `JSONAPI_`, which FastAPI validates against the
+route's response model and then serializes, building every payload twice.
+Routes decorated with `trusted_jsonapi` skip that and encode the serializer's
+output directly with orjson.
+
+The payload is first fitted to the response model the way validation and
+`response_model_exclude_none` would: keys the model doesn't declare are dropped,
+declared keys come out under their alias in declaration order, missing fields
+take their defaults and null fields are left out. The layout of each model's
+fields is worked out once and cached.
+
+Full validation is kept where it's wanted. `JSONAPI_VALIDATION_SAMPLE_RATE` is the
+share of requests validated against the response model:
+    1       - every response goes through FastAPI's usual validation (tests)
+    0 < x   - that share is also validated on the fast path, and any mismatch
+                is logged rather than failing the request
+    0       - never validated
+"""
+
+import os
+import random
+from dataclasses import dataclass
+from decimal import Decimal
+from functools import wraps, partial
+from inspect import iscoroutinefunction
+from logging import getLogger
+from types import UnionType
+from typing import Any, Callable, Annotated, Union, get_args, get_origin
+import orjson
+from fastapi import Response
+from pydantic import BaseModel, ValidationError
+
+logger = getLogger("uvicorn.info")
+
+VALIDATION_SAMPLE_RATE = float(os.getenv("JSONAPI_VALIDATION_SAMPLE_RATE", 0.01))
+
+
+@dataclass(frozen=True, slots=True)
+class _Field:
+    alias: str
+    # payload keys the field is read from, in order of precedence
+    keys: tuple[str, ...]
+    # the layout of the field's model, or None if its value is kept as is
+    layout: "_Layout | None"
+    default: Callable[[], Any] | None
+
+
+_Layout = tuple[_Field, ...]
+_LAYOUTS: dict[type[BaseModel], _Layout | None] = {}
+
+
+def _model_of(annotation: Any) -> type[BaseModel] | None:
+    """the model a field holds, alone or in a list, if there's exactly one"""
+    while get_origin(annotation) is Annotated:
+        annotation = get_args(annotation)[0]
+    origin = get_origin(annotation)
+    if origin in (Union, UnionType):
+        options = [arg for arg in get_args(annotation) if arg is not type(None)]
+        models = {_model_of(arg) for arg in options}
+        return models.pop() if len(models) == 1 else None
+    if origin is list:
+        args = get_args(annotation)
+        return _model_of(args[0]) if args else None
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+
+
+def layout(model: type[BaseModel]) -> _Layout | None:
+    """How `model` lays out its fields, or None if it can't be reproduced
+    without validating, as with models that allow extra keys.
+
+    Worked out when a route is decorated, before any request is served.
+    """
+    if model in _LAYOUTS:
+        return _LAYOUTS[model]
+    # a placeholder, so a model that refers to itself is kept as is
+    _LAYOUTS[model] = None
+    if model.model_config.get("extra") == "allow":
+        return
+    by_name = model.model_config.get("populate_by_name", False)
+    fields = []
+    for name, info in model.model_fields.items():
+        if info.exclude:
+            continue
+        alias = info.alias or name
+        nested = _model_of(info.annotation)
+        fields.append(
+            _Field(
+                alias=info.serialization_alias or alias,
+                keys=(alias, name) if by_name and alias != name else (alias,),
+                layout=layout(nested) if nested else None,
+                default=(
+                    None
+                    if info.is_required()
+                    else partial(info.get_default, call_default_factory=True)
+                ),
+            )
+        )
+    _LAYOUTS[model] = tuple(fields)
+    return _LAYOUTS[model]
+
+
+def fit(content: Any, fields: _Layout | None) -> Any:
+    """`content` as it would come out of validation against the model laid out
+    by `fields`, with nulls excluded"""
+    if fields is None:
+        return content
+    if isinstance(content, list):
+        return [fit(item, fields) for item in content]
+    if not isinstance(content, dict):
+        return content
+    fitted = {}
+    for field in fields:
+        for key in field.keys:
+            if key in content:
+                value = content[key]
+                break
+        else:
+            value = field.default() if field.default else None
+        if value is not None:
+            fitted[field.alias] = fit(value, field.layout)
+    return fitted
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json", by_alias=True, exclude_none=True)
+    raise TypeError
+
+
+class TrustedJSONAPIResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def response_model(endpoint: Callable) -> type[BaseModel] | None:
+    model = endpoint.__annotations__.get("return")
+    if isinstance(model, type) and issubclass(model, BaseModel):
+        return model
+
+
+def _sample_validation(
+    endpoint: Callable, model: type[BaseModel], payload: Any
+) -> None:
+    try:
+        model.model_validate(payload)
+    except ValidationError as e:
+        logger.warning(
+            f"{endpoint.__name__} returned a payload that doesn't match "
+            f"{model.__name__}: {e}"
+        )
+
+
+def _respond(
+    endpoint: Callable,
+    model: type[BaseModel] | None,
+    fields: _Layout | None,
+    payload: Any,
+) -> Any:
+    if isinstance(payload, Response) or VALIDATION_SAMPLE_RATE >= 1 or fields is None:
+        return payload
+    if VALIDATION_SAMPLE_RATE > 0 and random.random() < VALIDATION_SAMPLE_RATE:
+        _sample_validation(endpoint, model, payload)
+    return TrustedJSONAPIResponse(fit(payload, fields))
+
+
+def trusted_jsonapi(endpoint: Callable) -> Callable:
+    """
+    Serve the endpoint's JSON:API payload without validating it against
+    the route's response model, outside of sampling.
+
+    Apply beneath the route decorator. The endpoint's return annotation
+    is the model the payload is fitted to and sampled responses are validated
+    against. Without one, or if the model allows extra keys, the payload goes
+    through FastAPI's usual validation.
+    """
+    model = response_model(endpoint)
+    respond = partial(_respond, endpoint, model, layout(model) if model else None)
+    if iscoroutinefunction(endpoint):
+
+        @wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            return respond(await endpoint(*args, **kwargs))
+
+    else:
+
+        @wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            return respond(endpoint(*args, **kwargs))
+
+    return wrapper
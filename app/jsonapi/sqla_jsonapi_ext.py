@@ -2,14 +2,20 @@ from os import getenv
 from dotenv import load_dotenv
 
 load_dotenv()
+import json
+import base64
 import warnings
 from typing import Any
-from itertools import chain
+from logging import getLogger
+from hashlib import sha1
+from decimal import Decimal
+from datetime import date, datetime
 from sqlalchemy_jsonapi import JSONAPI
 from fastapi import HTTPException
-from sqlalchemy import or_, func, inspect, Column, select
+from sqlalchemy import or_, and_, func, inspect, Column, select
+from sqlalchemy.sql.elements import ColumnElement
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session, Query as sqlQuery
+from sqlalchemy.orm import Session, Query as sqlQuery, selectinload, joinedload
 
 from sqlalchemy_jsonapi.errors import (
     BadRequestError,
@@ -23,6 +29,9 @@ from sqlalchemy_jsonapi.errors import (
     ToManyExpectedError,
     ValidationError,
 )
+from app.db.cache import CACHE
+from app.jsonapi.filtering import strategy_for, filter_clause, explain
+from app.jsonapi.render_plans import render_plan, freeze_include, permission_test
 from sqlalchemy_jsonapi.serializer import (
     Permissions,
     JSONAPIResponse,
@@ -30,11 +39,12 @@ from sqlalchemy_jsonapi.serializer import (
     get_rel_desc,
     RelationshipActions,
     MANYTOONE,
-    get_permission_test,
     get_attr_desc,
     AttributeActions,
 )
 
+logger = getLogger("uvicorn.info")
+
 QuerySet = dict[str, str]
 GenericData = dict[str, dict[str, Any] | list[dict[str, Any]]]
 
@@ -70,6 +80,77 @@ DEFAULT_SORT: str = "id"
 MAX_PAGE_SIZE: int = 300
 MAX_RECORDS: int = 15000
 CONTACT_EMAIL: str = getenv("ADMIN_EMAIL")
+# debug mode: attach the query plan for each collection to its meta
+EXPLAIN_COLLECTIONS: bool = getenv("JSONAPI_EXPLAIN", "").lower() in ("1", "true")
+# page[count] options for the total row count behind pagination
+COUNT_EXACT, COUNT_CACHED, COUNT_NONE = "exact", "cached", "none"
+COLLECTION_COUNTS = CACHE.register_namespace(
+    "collection_counts", ttl=float(getenv("COLLECTION_COUNT_TTL", 60))
+)
+
+
+def encode_cursor(values: list[Any]) -> str:
+    """opaque cursor for a row's position in a sorted collection"""
+    values = [v.isoformat() if isinstance(v, (date, datetime)) else v for v in values]
+    data = json.dumps(values, default=str, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, columns: list[Column]) -> list[Any]:
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError
+        decoded = []
+        for column, value in zip(columns, values):
+            if value is not None:
+                python_type = column.type.python_type
+                if issubclass(python_type, datetime):
+                    value = datetime.fromisoformat(value)
+                elif issubclass(python_type, date):
+                    value = date.fromisoformat(value)
+                elif issubclass(python_type, Decimal):
+                    value = Decimal(value)
+            decoded.append(value)
+        return decoded
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid page[after] cursor")
+
+
+def cursor_page_size(size: str | int | None) -> int:
+    """rows per page when paging by cursor, between 1 and MAX_PAGE_SIZE"""
+    if size is None or size == "":
+        return MAX_PAGE_SIZE
+    try:
+        return min(max(int(size), 1), MAX_PAGE_SIZE)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid page[size]")
+
+
+def keyset_after(
+    sort_keys: list[tuple[Column, bool]], values: list[Any]
+) -> ColumnElement[bool]:
+    """
+    Rows that come after `values` in the ordering given by `sort_keys`,
+    (column, ascending) pairs, with NULLs sorted the way Postgres sorts them:
+    last when ascending and first when descending.
+    """
+    clauses = []
+    for i, ((column, is_asc), value) in enumerate(zip(sort_keys, values)):
+        ties = [
+            col == val if val is not None else col.is_(None)
+            for (col, _), val in zip(sort_keys[:i], values[:i])
+        ]
+        if value is None:
+            if is_asc:
+                # nothing sorts after NULL
+                continue
+            after = column.is_not(None)
+        else:
+            after = or_(column > value, column.is_(None)) if is_asc else column < value
+        clauses.append(and_(*ties, after))
+    return or_(*clauses)
 
 
 class JSONAPI_(JSONAPI):
@@ -114,10 +195,11 @@ class JSONAPI_(JSONAPI):
         model: SQLAlchemyModel, sqla_query_obj: sqlQuery, filters: dict[str, list[str]]
     ) -> sqlQuery:
         """
-        handler for filter parameters in the query string
-        for any value or list of values, this filter is permissive,
-        looking for a substring anywhere in the field value that
-        matches the arguement(s).
+        handler for filter parameters in the query string.
+        Each field is matched by the strategy its model declares for it in
+        `__filter_strategies__` (see app.jsonapi.filtering), by default
+        permissive for text, looking for a substring anywhere in the field value
+        that matches the arguement(s).
         Roughly equivalent to
             SELECT field
             FROM table
@@ -132,12 +214,8 @@ class JSONAPI_(JSONAPI):
             resource, attr = field
             if field_py := model.__jsonapi_map_to_py__.get(attr):
                 model_attr: Column = getattr(model, field_py)
-                for item in value:
-                    filter_query_args.append(
-                        or_(
-                            model_attr.ilike("%" + item + "%"), model_attr.op("%")(item)
-                        )
-                    )
+                strategy = strategy_for(model, field_py)
+                filter_query_args.append(filter_clause(model_attr, strategy, value))
             else:
                 warnings.warn(
                     f"Warning: filter field {field} with value {value} was ignored."
@@ -187,8 +265,24 @@ class JSONAPI_(JSONAPI):
 
         return filters
 
+    @staticmethod
+    def _count_rows(db: Session, sa_query: sqlQuery, count_mode: str) -> int:
+        """run the count query, or with `COUNT_CACHED`, reuse a recent count
+        for the same query and parameters"""
+        count = lambda: db.execute(sa_query.statement).fetchone()[0]
+        if count_mode != COUNT_CACHED:
+            return count()
+        compiled = sa_query.statement.compile()
+        key = sha1(f"{compiled}{sorted(compiled.params.items())}".encode()).hexdigest()
+        return CACHE.get_or_set(COLLECTION_COUNTS, key, count)
+
     def _add_pagination(
-        self, query: dict[str, str], db: Session, resource_name: str, sa_query: sqlQuery
+        self,
+        query: dict[str, str],
+        db: Session,
+        resource_name: str,
+        sa_query: sqlQuery,
+        count_mode: str = COUNT_EXACT,
     ) -> tuple[dict, dict]:
         size = MAX_PAGE_SIZE
         offset = 0
@@ -230,7 +324,7 @@ class JSONAPI_(JSONAPI):
                 }
                 return self.result
 
-        row_count: int = db.execute(sa_query.statement).fetchone()[0]
+        row_count: int = self._count_rows(db, sa_query, count_mode)
         if row_count == 0:
             return NoPagination(query, row_count).return_zero_page()
         passed_args = {
@@ -330,6 +424,75 @@ class JSONAPI_(JSONAPI):
         }
         return result_addition
 
+    def _plan_includes(
+        self,
+        model: SQLAlchemyModel,
+        include: dict[str, list[str]],
+        permitted_ids: set[int] = None,
+    ) -> list:
+        """
+        Turn the parsed include tree into eager-loading options, so that
+        rendering a page of resources costs one query per included relationship
+        instead of one per instance.
+
+        Related collections are loaded with selectinload, leaving out soft-deleted
+        rows and any rows outside of the permitted customer locations, the same
+        rows _render_full_resource would drop. Single related objects are joined
+        into the query that loads their parents.
+        """
+        options = []
+        relationships = model.__mapper__.relationships
+        for api_key, nested in include.items():
+            key = model.__jsonapi_map_to_py__.get(api_key)
+            if key not in relationships:
+                continue
+            relationship = relationships[key]
+            target: SQLAlchemyModel = relationship.mapper.class_
+            attr = getattr(model, key)
+            if relationship.direction == MANYTOONE:
+                loader = joinedload(attr)
+            else:
+                criteria = []
+                if (deleted_at := getattr(target, "deleted_at", None)) is not None:
+                    criteria.append(deleted_at == None)
+                if permitted_ids:
+                    permitted = select(target.id)
+                    filtered = target.apply_customer_location_filtering(
+                        permitted, permitted_ids
+                    )
+                    if filtered is not permitted:
+                        criteria.append(target.id.in_(filtered))
+                loader = selectinload(attr.and_(*criteria) if criteria else attr)
+            if nested:
+                loader = loader.options(
+                    *self._plan_includes(
+                        target, self._parse_include(nested), permitted_ids
+                    )
+                )
+            options.append(loader)
+        return options
+
+    def _includes_permitted_ids(
+        self,
+        session: Session,
+        includes_models: dict[str, SQLAlchemyModel],
+        permitted_ids: set[int] = None,
+    ) -> dict[str, set[int]]:
+        """permitted ids for each included resource type.
+        Without customer location filtering, everything is permitted."""
+        if not permitted_ids:
+            return dict()
+        return {
+            api_type: set(
+                session.scalars(
+                    inc_model.apply_customer_location_filtering(
+                        select(inc_model.id), permitted_ids
+                    )
+                ).all()
+            )
+            for api_type, inc_model in includes_models.items()
+        }
+
     def get_collection(
         self,
         session: Session,
@@ -394,9 +557,23 @@ class JSONAPI_(JSONAPI):
             collection_count = model.apply_customer_location_filtering(
                 collection_count, permitted_ids
             )
-        pagination_meta_and_links = self._add_pagination(
-            query, session, api_type, collection_count
-        )
+        after = query.pop("page[after]", None)
+        count_mode = query.pop("page[count]", None)
+        if count_mode not in (None, COUNT_EXACT, COUNT_CACHED, COUNT_NONE):
+            raise HTTPException(
+                status_code=400,
+                detail=f"page[count] must be one of {COUNT_EXACT}, {COUNT_CACHED} "
+                f"or {COUNT_NONE}",
+            )
+        if after is None:
+            pagination_meta_and_links = self._add_pagination(
+                query,
+                session,
+                api_type,
+                collection_count,
+                COUNT_EXACT if count_mode in (None, COUNT_NONE) else count_mode,
+            )
+        sort_keys: list[tuple[Column, bool]] = []
 
         for attr in sorts:
             if attr == "":
@@ -419,13 +596,31 @@ class JSONAPI_(JSONAPI):
             check_permission(model, attr_name, Permissions.VIEW)
 
             order_by.append(attr.asc() if is_asc else attr.desc())
+            sort_keys.append((attr, is_asc))
+
+        if after is not None:
+            # keyset pagination, with the id breaking ties in the sort
+            if not any(key is model.id for key, _ in sort_keys):
+                sort_keys.append((model.id, True))
+                order_by.append(model.id.asc())
+            if after:
+                columns = [key for key, _ in sort_keys]
+                collection = collection.filter(
+                    keyset_after(sort_keys, decode_cursor(after, columns))
+                )
 
         if len(order_by) > 0:
             collection = collection.order_by(*order_by)
 
         pos = -1
-        start, end = self._parse_page(query)
-        if end:
+        if after is not None:
+            size = cursor_page_size(query.get("page[size]"))
+            # one extra row tells whether there's a next page
+            collection = collection.limit(size + 1)
+            start, end = 0, size - 1
+        else:
+            start, end = self._parse_page(query)
+        if after is None and end:
             # instead of letting the query pull the entire dataset, use
             # query-level offset and limit if pagination is occuring
             # and from here the start and end will be relative
@@ -438,17 +633,13 @@ class JSONAPI_(JSONAPI):
         response.data["data"] = []
         num_records = 0
 
-        if includes_models:
-            includes_permitted_ids = {
-                api_type: session.scalars(
-                    inc_model.apply_customer_location_filtering(
-                        select(inc_model.id), permitted_ids
-                    )
-                ).all()
-                for api_type, inc_model in includes_models.items()
-            }
-        else:
-            includes_permitted_ids = dict()
+        if include:
+            collection = collection.options(
+                *self._plan_includes(model, include, permitted_ids)
+            )
+        includes_permitted_ids = self._includes_permitted_ids(
+            session, includes_models, permitted_ids
+        )
 
         for instance in collection:
             try:
@@ -466,11 +657,31 @@ class JSONAPI_(JSONAPI):
             included.update(built.pop("included"))
             response.data["data"].append(built)
             num_records += 1
+            last_instance = instance
 
         response.data["included"] = list(included.values())
-        if pagination_meta_and_links:
+        if EXPLAIN_COLLECTIONS:
+            plan = explain(session, collection)
+            logger.info(f"{api_type} query plan:\n" + "\n".join(plan))
+        if after is not None:
+            link = f"/{api_type}?page_size={size}&page_after="
+            links = {"first": link}
+            if pos > end:
+                cursor = encode_cursor(
+                    [getattr(last_instance, key.key) for key, _ in sort_keys]
+                )
+                links["next"] = link + cursor
+            meta = {"numRecords": num_records}
+            if count_mode in (COUNT_EXACT, COUNT_CACHED):
+                meta["totalRecords"] = self._count_rows(
+                    session, collection_count, count_mode
+                )
+            response.data.update({"meta": meta, "links": links})
+        elif pagination_meta_and_links:
             pagination_meta_and_links["meta"] |= {"numRecords": num_records}
             response.data.update(pagination_meta_and_links)
+        if EXPLAIN_COLLECTIONS:
+            response.data.setdefault("meta", {})["explain"] = plan
         return response.data
 
     def get_resource(
@@ -493,9 +704,6 @@ class JSONAPI_(JSONAPI):
         :param api_type: Type of the resource
         :param obj_id: ID of the resource
         """
-        resource = self._fetch_resource(
-            session, api_type, obj_id, Permissions.VIEW, permitted_ids
-        )
         includes_statements = query.get("include", "").split(",")
         includes_models: dict[str, SQLAlchemyModel] = {
             m: self._fetch_model(m)
@@ -504,22 +712,22 @@ class JSONAPI_(JSONAPI):
             if statement
         }
         include = self._parse_include(includes_statements)
+        resource = self._fetch_resource(
+            session,
+            api_type,
+            obj_id,
+            Permissions.VIEW,
+            permitted_ids,
+            options=self._plan_includes(
+                self._fetch_model(api_type), include, permitted_ids
+            ),
+        )
         fields = self._parse_fields(query)
         filters = self._parse_filters(query)
         response = JSONAPIResponse()
-        if includes_models:
-            includes_permitted_ids = {
-                api_type: set(
-                    session.scalars(
-                        inc_model.apply_customer_location_filtering(
-                            select(inc_model.id), permitted_ids
-                        )
-                    ).all()
-                )
-                for api_type, inc_model in includes_models.items()
-            }
-        else:
-            includes_permitted_ids = dict()
+        includes_permitted_ids = self._includes_permitted_ids(
+            session, includes_models, permitted_ids
+        )
 
         built, _ = self._render_full_resource(
             resource, include, fields, filters, includes_permitted_ids
@@ -677,6 +885,7 @@ class JSONAPI_(JSONAPI):
         obj_id: int,
         permission,
         permitted_ids: set[int] = None,
+        options: list = (),
     ) -> SQLAlchemyModel | None:
         """
         Fetch a resource by type and id, also doing a permission check.
@@ -690,6 +899,7 @@ class JSONAPI_(JSONAPI):
         :param api_type: The type
         :param obj_id: ID for the resource
         :param permission: Permission to check
+        :param options: loader options for the resource, such as planned includes
         """
         if api_type not in self.models.keys():
             raise ResourceTypeNotFoundError(api_type)
@@ -702,11 +912,11 @@ class JSONAPI_(JSONAPI):
             pk = inspect(model).primary_key[0].name
             permitted_object_ids = set([getattr(result, pk) for result in preflight])
             if obj_id in permitted_object_ids:
-                obj: SQLAlchemyModel = session.get(model, obj_id)
+                obj: SQLAlchemyModel = session.get(model, obj_id, options=options)
             else:
                 obj = None
         else:
-            obj = session.get(model, obj_id)
+            obj = session.get(model, obj_id, options=options)
 
         if obj is None:
             raise ResourceNotFoundError(model, obj_id)
@@ -733,19 +943,20 @@ class JSONAPI_(JSONAPI):
         Permitted ids are used to recursively filter the includes, preventing potential
         improper data exposure.
         """
-        api_type = instance.__jsonapi_type__
-        orm_desc_keys = instance.__mapper__.all_orm_descriptors.keys()
+        fields_for_type = fields.get(instance.__jsonapi_type__)
+        plan = render_plan(
+            type(instance),
+            tuple(fields_for_type) if fields_for_type is not None else None,
+            freeze_include(include),
+        )
+        api_type = plan.api_type
         attributes = {}
         relationships = {}
         included = {}
         rejected = False
-        all_keys_in_includes = set(
-            chain(*[e[-1].split(".") for e in include.values() if e])
-        )
-        filter_in_downstream = any(f[0] in all_keys_in_includes for f in filters)
-        attrs_to_ignore = {"__mapper__", "id"}
+        filter_in_downstream = any(f[0] in plan.downstream for f in filters)
 
-        def apply_filter(item: SQLAlchemyModel) -> bool:
+        def apply_filter(item: SQLAlchemyModel, api_key: str) -> bool:
             reject_instance = False
             for filter in filters:
                 resource, attr = filter
@@ -755,6 +966,10 @@ class JSONAPI_(JSONAPI):
                             reject_instance = True
             return reject_instance
 
+        def permitted(item: SQLAlchemyModel) -> bool:
+            test = permission_test(type(item), None)
+            return test is None or test(item)
+
         to_ret = dict(
             id=instance.id,
             type=api_type,
@@ -763,29 +978,21 @@ class JSONAPI_(JSONAPI):
             included=included,
         )
 
-        if api_type in fields.keys():
-            local_fields = [instance.__jsonapi_map_to_py__[x] for x in fields[api_type]]
-        else:
-            local_fields = orm_desc_keys
-
-        for key, relationship in instance.__mapper__.relationships.items():
-            attrs_to_ignore |= set([c.name for c in relationship.local_columns]) | {key}
-            api_key = instance.__jsonapi_map_to_api__[key]
-            try:
-                desc = get_rel_desc(instance, key, RelationshipActions.GET)
-            except PermissionDeniedError:
+        for rel in plan.relationships:
+            if rel.permitted and not rel.permitted(instance):
                 continue
+            api_key = rel.api_key
 
-            if relationship.direction == MANYTOONE:
-                if key in local_fields:
+            if rel.to_one:
+                if rel.in_fields:
                     relationships[api_key] = {
                         "links": self._lazy_relationship(api_type, instance.id, api_key)
                     }
 
-                if api_key in include.keys():
-                    related_item: SQLAlchemyModel = desc(instance)
+                if rel.included:
+                    related_item: SQLAlchemyModel = rel.get(instance)
 
-                    instance_rejected = apply_filter(related_item)
+                    instance_rejected = apply_filter(related_item, api_key)
                     if instance_rejected:
                         return {}, instance_rejected
 
@@ -800,20 +1007,18 @@ class JSONAPI_(JSONAPI):
                         relationships[api_key]["data"] = None
                         continue
 
-                    if related_item is not None:
-                        perm = get_permission_test(related_item, None, Permissions.VIEW)
-                    if key in local_fields and (
-                        related_item is None or not perm(related_item)
+                    if rel.in_fields and (
+                        related_item is None or not permitted(related_item)
                     ):
                         relationships[api_key]["data"] = None
                         continue
-                    if key in local_fields:
-                        relationships[api_key]["data"] = self._render_short_instance(
-                            related_item
-                        )  # NOQA
-                    new_include = self._parse_include(include[api_key])
+                    if rel.in_fields:
+                        relationships[api_key]["data"] = {
+                            "type": related_item.__jsonapi_type__,
+                            "id": related_item.id,
+                        }
                     built, rejected = self._render_full_resource(
-                        related_item, new_include, fields, filters, permitted_ids
+                        related_item, rel.include, fields, filters, permitted_ids
                     )
                     if not rejected:
                         built_included = built.pop("included")
@@ -824,50 +1029,49 @@ class JSONAPI_(JSONAPI):
                         )
                         included[built_incl_key] = built  # NOQA
             else:
-                if key in local_fields:
+                if rel.in_fields:
                     relationships[api_key] = {
                         "links": self._lazy_relationship(
                             api_type, instance.id, api_key
                         ),
                     }
 
-                if api_key not in include.keys():
+                if not rel.included:
                     continue
 
-                if key in local_fields:
+                if rel.in_fields:
                     relationships[api_key]["data"] = []
 
-                related: list[SQLAlchemyModel] = desc(instance)
+                related: list[SQLAlchemyModel] = rel.get(instance)
 
                 if not related and filter_in_downstream:
                     return {}, True
 
                 ## reapply filtering if filtering was used for the query on the
                 ## primary resource
-                if permitted_ids:
-                    related = [
-                        item
-                        for item in related
-                        if item.id in permitted_ids[item.__jsonapi_type__]
-                        and getattr(item, "deleted_at", None) is None
-                    ]
+                related = [
+                    item
+                    for item in related
+                    if getattr(item, "deleted_at", None) is None
+                    and (
+                        not permitted_ids
+                        or item.id in permitted_ids[item.__jsonapi_type__]
+                    )
+                ]
                 for item in related:
-                    try:
-                        check_permission(item, None, Permissions.VIEW)
-                    except PermissionDeniedError:
+                    if not permitted(item):
                         continue
 
-                    item_rejected = apply_filter(item)
+                    item_rejected = apply_filter(item, api_key)
                     if item_rejected:
                         continue
 
-                    if key in local_fields:
+                    if rel.in_fields:
                         relationships[api_key]["data"].append(
-                            self._render_short_instance(item)
+                            {"type": item.__jsonapi_type__, "id": item.id}
                         )
-                    new_include = self._parse_include(include[api_key])
                     built, rejected = self._render_full_resource(
-                        item, new_include, fields, filters, permitted_ids
+                        item, rel.include, fields, filters, permitted_ids
                     )
                     if not rejected:
                         built_included = built.pop("included")
@@ -875,14 +1079,10 @@ class JSONAPI_(JSONAPI):
                         included.update(built_included)
                         included[built_incl_key] = built  # NOQA
 
-        for key in set(orm_desc_keys) - attrs_to_ignore:
-            try:
-                desc = get_attr_desc(instance, key, AttributeActions.GET)
-                if key in local_fields:
-                    py_key = instance.__jsonapi_map_to_api__[key]
-                    attributes[py_key] = desc(instance)  # NOQA
-            except PermissionDeniedError:
+        for attr in plan.attributes:
+            if attr.permitted and not attr.permitted(instance):
                 continue
+            attributes[attr.api_key] = attr.get(instance)
 
         return to_ret, rejected
 
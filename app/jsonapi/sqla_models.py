@@ -24,6 +24,7 @@ from sqlalchemy.orm import (
     mapped_column,
 )
 from app.jsonapi.sqla_jsonapi_ext import JSONAPI_
+from app.jsonapi.filtering import FilterStrategy
 from app.db import Stage
 from functools import partial
 
@@ -448,6 +449,11 @@ class VendorProduct(Base):
     __tablename__ = "vendor_products"
     __jsonapi_type_override__ = __tablename__.replace("_", "-")
     __modifiable_fields__ = ["vendor_product_description", "deleted_at", "attr_order"]
+    __filter_strategies__ = {
+        "vendor_id": FilterStrategy.EXACT,
+        "vendor_product_identifier": FilterStrategy.TRIGRAM,
+        "vendor_product_description": FilterStrategy.TRIGRAM,
+    }
     __primary_ref__ = "vendors"
 
     id = Column(Integer, primary_key=True)
@@ -491,6 +497,10 @@ class VendorProductAttr(Base):
     __tablename__ = "vendor_product_attrs"
     __jsonapi_type_override__ = __tablename__.replace("_", "-")
     __modifiable_fields__ = ["value", "deleted_at"]
+    __filter_strategies__ = {
+        "attr": FilterStrategy.TRIGRAM,
+        "value": FilterStrategy.TRIGRAM,
+    }
     __primary_ref__ = "vendor_products"
 
     id = Column(Integer, primary_key=True)
@@ -715,6 +725,10 @@ class VendorCustomer(Base):
     __tablename__ = "vendor_customers"
     __jsonapi_type_override__ = __tablename__.replace("_", "-")
     __modifiable_fields__ = ["name", "deleted_at"]
+    __filter_strategies__ = {
+        "vendor_id": FilterStrategy.EXACT,
+        "name": FilterStrategy.TRIGRAM,
+    }
     __primary_ref__ = "vendors"
 
     id = Column(Integer, primary_key=True)
@@ -1113,6 +1127,10 @@ class VendorQuote(Base):
         "plans_doc",
         "deleted_at",
     ]
+    __filter_strategies__ = {
+        "vendor_quote_number": FilterStrategy.TRIGRAM,
+        "job_name": FilterStrategy.TRIGRAM,
+    }
     __primary_ref__ = "vendor_customers"
 
     id = Column(Integer, primary_key=True)
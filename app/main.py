@@ -1,18 +1,21 @@
+from time import perf_counter
+
+IMPORT_START = perf_counter()
 from app.version import VERSION as __version__
 from dotenv import load_dotenv
 
 load_dotenv()
 import os
 import logging
-from random import randint
-from time import time
-from asyncio import sleep
+from asyncio import create_task
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request, status, Response
+from fastapi import FastAPI, status, Response
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import RedirectResponse
-from starlette.routing import Match, Route
+from app.auth import LocalTokenStore
+from app.downloads import DownloadIDs
+from app.db import DB_V2_ASYNC, perf
+from app.tarpit import BotTarpit
 
 ## Routers ##
 from app.hardcast import hardcast
@@ -21,7 +24,7 @@ from app.friedrich.routes import initialize_cookies as friedrich_portal_cookies
 from app.customers import customers, customer_rel, customer_locations
 from app.places import places
 from app.adp import ratings_admin, ratings
-from app.admin import price_updates
+from app.admin import price_updates, metrics
 from app.model_lookup import model_lookup
 import app.v2 as v2
 
@@ -29,48 +32,23 @@ import app.v2 as v2
 logger = logging.getLogger("uvicorn.info")
 
 
-class BotTarpit(BaseHTTPMiddleware):
-    def __init__(self, app: FastAPI):
-        super().__init__(app)
-
-    async def dispatch(self, request: Request, call_next):
-        path = request.url.path
-        for route in app.routes:
-            route: Route
-            match_, scope = route.matches(request)
-            if match_ == Match.FULL or path == "/favicon.ico":
-                if route.path == "/" and any(request.query_params._dict.keys()):
-                    logging.info(
-                        'Allowed passthrough of request"\
-                                 " on the root endpoint'
-                    )
-                try:
-                    start_ = time()
-                    return await call_next(request)
-                finally:
-                    logger.info(f"Request time: {time()-start_}s")
-        host = request.client.host
-        await self.trigger_delay(host, path)
-        return Response(
-            status_code=status.HTTP_301_MOVED_PERMANENTLY,
-            content="Sorry, this resource has moved.",
-        )
-
-    @staticmethod
-    async def trigger_delay(host: str, path: str):
-        delay = randint(10, 20)
-        logger.info(f"{host} - {path} - Honeypot triggered. Delaying for {delay}s")
-        await sleep(delay)
-
-
 with open("README.md", "r") as read_me:
     description = read_me.read()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await friedrich_portal_cookies()
+    perf.record_span("startup", perf_counter() - IMPORT_START)
+    # the login doesn't hold up serving traffic
+    background = [
+        create_task(friedrich_portal_cookies()),
+        create_task(DownloadIDs.sweeper()),
+        create_task(LocalTokenStore.sweeper()),
+    ]
     yield
+    for task in background:
+        task.cancel()
+    await DB_V2_ASYNC.dispose()
 
 
 app = FastAPI(
@@ -84,7 +62,7 @@ app = FastAPI(
 ORIGINS = os.getenv("ORIGINS")
 ORIGINS_REGEX = os.getenv("ORIGINS_REGEX")
 
-app.add_middleware(BotTarpit)
+app.add_middleware(BotTarpit, router=app.router)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ORIGINS,
@@ -156,6 +134,7 @@ app_misc_routes = [
     (hardcast, "", app),
     (friedrich, "/vendors", app),
     (price_updates, "", app),
+    (metrics, "", app),
     (model_lookup, "/vendors", app),
 ]
 routes = (*adp_sub_routes, *customer_sub_routes, *app_misc_routes, *v2_routes)
@@ -17,8 +17,17 @@ from app.glasfloss.parsing import (
 )
 from app.v2.models import VendorCustomer
 from app.adp.extraction.models import parse_model_string
+from app.adp.adp_models.model_series import ModelSeries, NoBasePrice
+from app.adp.extraction.repricing import SeriesPricingSnapshot, FUTURE_MODES
 from app.adp.utils.models import ParsingModes
-from app.admin.models import VendorId, ModelLookupADP, ModelLookupGlasfloss
+from app.admin.models import (
+    VendorId,
+    ModelLookupADP,
+    ModelLookupADPBatch,
+    ModelLookupADPBatchResp,
+    ModelLookupError,
+    ModelLookupGlasfloss,
+)
 
 
 model_lookup = APIRouter(
@@ -38,6 +47,57 @@ def extract_query_params(model: BaseModel, request: Request) -> dict:
         return params
 
 
+@model_lookup.post("/adp/batch")
+def adp_batch_parse_model_and_pricing(
+    session: NewSession, token: Token, lookup: ModelLookupADPBatch
+) -> ModelLookupADPBatchResp:
+    """Parse and price many ADP model numbers in one request.
+
+    Permissions are checked once for the whole batch, and every model is priced
+    against one snapshot of key prices, adders and customer discounts. Models that
+    fail to parse or price are reported in `errors` without failing the others,
+    but an error from the database fails the request.
+    """
+    parse_mode = adp_parse_mode(session, token, lookup.customer_id, lookup.future)
+    match parse_mode:
+        case ParsingModes.CUSTOMER_PRICING | ParsingModes.CUSTOMER_PRICING_FUTURE:
+            snapshot_customer_id = lookup.customer_id
+        case _:
+            snapshot_customer_id = 0
+    db = SeriesPricingSnapshot(
+        session,
+        use_future=parse_mode in FUTURE_MODES,
+        customer_id=snapshot_customer_id,
+    )
+    data, errors = [], []
+    for model_number in dict.fromkeys(lookup.model_numbers):
+        try:
+            record = parse_model_string(
+                session, lookup.customer_id, model_number, parse_mode, db=db
+            )
+            prog_attrs = ProgAttrs(**record.dropna().to_dict())
+        except HTTPException as e:
+            error = ModelLookupError(
+                model_number=model_number, status=e.status_code, detail=str(e.detail)
+            )
+            errors.append(error)
+        except (NoBasePrice, ModelSeries.NoBasePrice, ValueError, KeyError) as e:
+            # anything else, database errors included, fails the whole batch
+            error = ModelLookupError(
+                model_number=model_number,
+                status=status.HTTP_400_BAD_REQUEST,
+                detail=str(e),
+            )
+            errors.append(error)
+        else:
+            data.append(prog_attrs.model_dump(exclude_none=True))
+    logger.info(
+        f"ADP batch lookup: {len(data)} priced, {len(errors)} errors, "
+        f"queries run: {db.queries_run}, avoided: {db.queries_saved}"
+    )
+    return ModelLookupADPBatchResp(data=data, errors=errors)
+
+
 @model_lookup.get("/{vendor_id}")
 def parse_model_and_pricing(
     session: NewSession, token: Token, vendor_id: VendorId, request: Request
@@ -93,6 +153,19 @@ def adp_parse_full_model_number(
     provided in the request.
 
     """
+    parse_mode = adp_parse_mode(session, token, customer_id, future)
+    return ProgAttrs(
+        **parse_model_string(session, customer_id, model_number, parse_mode)
+        .dropna()
+        .to_dict()
+    )
+
+
+def adp_parse_mode(
+    session: Session, token: Token, customer_id: int = 0, future: bool = False
+) -> ParsingModes:
+    """Resolve the parsing mode the requester is allowed to use, raising
+    401 if they aren't allowed to see the requested customer's pricing"""
     adp_perm = token.permissions
     if adp_perm >= auth.Permissions.sca_employee:
         if not customer_id and future:
@@ -130,11 +203,7 @@ def adp_parse_full_model_number(
                 raise HTTPException(status.HTTP_401_UNAUTHORIZED)
     else:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED)
-    return ProgAttrs(
-        **parse_model_string(session, customer_id, model_number, parse_mode)
-        .dropna()
-        .to_dict()
-    )
+    return parse_mode
 
 
 def glasfloss_parse_model(
@@ -0,0 +1,108 @@
+"""Import-time profile of the application's startup.
+
+Runs the import of `app.main` in a fresh interpreter with `-X importtime` and
+breaks the time down by module, so a slow cold start can be traced to what it
+imports before any request is served. The modules of the app are grouped at
+`app.<package>` and everything else by its top-level package:
+
+    python -m app.startup                   - the 25 slowest groups
+    python -m app.startup --modules         - the slowest individual modules
+    python -m app.startup --limit 50 --target app.v2
+
+Times are in milliseconds. `self` is the time spent in a module's own body and
+`cumulative` includes the modules it imported first.
+"""
+
+import os
+import re
+import sys
+import subprocess
+from argparse import ArgumentParser
+from dataclasses import dataclass
+
+TARGET = "app.main"
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+@dataclass(frozen=True, slots=True)
+class ImportTiming:
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(output: str) -> list[ImportTiming]:
+    """the timings in `-X importtime` output, ignoring any other lines"""
+    timings = []
+    for line in output.splitlines():
+        if match := LINE.match(line):
+            self_us, cumulative_us, indent, module = match.groups()
+            timings.append(
+                ImportTiming(
+                    module=module,
+                    self_us=int(self_us),
+                    cumulative_us=int(cumulative_us),
+                    depth=len(indent) // 2,
+                )
+            )
+    return timings
+
+
+def profile_imports(target: str = TARGET) -> list[ImportTiming]:
+    env = os.environ | {"PYTHONPROFILEIMPORTTIME": "1"}
+    result = subprocess.run(
+        [sys.executable, "-c", f"import {target}"],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {target} failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def group_of(module: str) -> str:
+    parts = module.split(".")
+    return ".".join(parts[:2]) if parts[0] == "app" else parts[0]
+
+
+def by_group(timings: list[ImportTiming]) -> list[tuple[str, int, int]]:
+    """(group, self µs, module count) for each group, slowest first"""
+    totals: dict[str, list[int]] = {}
+    for timing in timings:
+        total = totals.setdefault(group_of(timing.module), [0, 0])
+        total[0] += timing.self_us
+        total[1] += 1
+    return sorted(
+        ((group, self_us, count) for group, (self_us, count) in totals.items()),
+        key=lambda row: row[1],
+        reverse=True,
+    )
+
+
+def report(timings: list[ImportTiming], limit: int = 25, modules: bool = False) -> str:
+    total_us = sum(t.self_us for t in timings)
+    lines = [f"{len(timings)} modules imported in {total_us / 1000:.0f}ms"]
+    if modules:
+        lines.append(f"{'self':>9} {'cumulative':>11}  module")
+        slowest = sorted(timings, key=lambda t: t.self_us, reverse=True)[:limit]
+        for t in slowest:
+            lines.append(
+                f"{t.self_us / 1000:>9.1f} {t.cumulative_us / 1000:>11.1f}  {t.module}"
+            )
+    else:
+        lines.append(f"{'self':>9} {'share':>6} {'modules':>8}  group")
+        for group, self_us, count in by_group(timings)[:limit]:
+            share = self_us / total_us if total_us else 0
+            lines.append(f"{self_us / 1000:>9.1f} {share:>6.1%} {count:>8}  {group}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Import-time breakdown of the app's startup")
+    parser.add_argument("--target", default=TARGET)
+    parser.add_argument("--limit", type=int, default=25)
+    parser.add_argument("--modules", action="store_true")
+    args = parser.parse_args()
+    print(report(profile_imports(args.target), args.limit, args.modules))
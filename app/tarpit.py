@@ -0,0 +1,169 @@
+"""Slow down clients probing for paths the API doesn't serve.
+
+`BotTarpit` is plain ASGI middleware. Requests for a route the app serves, with
+a method it accepts, pass straight through and are timed. Anything else is held
+for 10-20 seconds before a 301 is returned.
+
+Routes are looked up in a `RouteIndex`, a trie of the literal segments of every
+route's path, with path parameters as wildcards. Only the few routes at the end
+of a request's walk are tested with `Route.matches`, instead of every route in
+the app. The index is built from the router on the first request, once every
+route has been registered. Paths that have been accepted are kept in a small
+LRU, so repeat requests skip the lookup.
+"""
+
+import logging
+from random import randint
+from time import perf_counter
+from asyncio import sleep
+from collections import OrderedDict
+from typing import Iterable
+from starlette import status
+from starlette.responses import Response
+from starlette.routing import BaseRoute, Match, Mount, Route, Router
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.db import perf
+
+logger = logging.getLogger("uvicorn.info")
+
+KNOWN_PATHS = 2048
+PASSTHROUGH = {"/favicon.ico"}
+
+
+class _Node:
+    __slots__ = ("literals", "param", "routes", "rest")
+
+    def __init__(self) -> None:
+        self.literals: dict[str, _Node] = {}
+        self.param: _Node | None = None
+        # routes that end at this node
+        self.routes: list[BaseRoute] = []
+        # routes that match anything below this node (mounts, `:path` params)
+        self.rest: list[BaseRoute] = []
+
+
+class RouteIndex:
+    def __init__(self, routes: Iterable[BaseRoute]) -> None:
+        self.root = _Node()
+        # routes the trie can't place, tested on every lookup
+        self.unindexed: list[BaseRoute] = []
+        # registration order, which decides between routes that both match
+        self.order: dict[int, int] = {}
+        for route in routes:
+            self.order[id(route)] = len(self.order)
+            self.add(route)
+
+    def add(self, route: BaseRoute) -> None:
+        match route:
+            case Mount():
+                path, rest = route.path, True
+            case Route():
+                path, rest = route.path, False
+            case _:
+                self.unindexed.append(route)
+                return
+        node = self.root
+        for segment in path.split("/")[1:]:
+            if ":path}" in segment:
+                rest = True
+                break
+            if "{" in segment:
+                node.param = node.param or _Node()
+                node = node.param
+            else:
+                node = node.literals.setdefault(segment, _Node())
+        (node.rest if rest else node.routes).append(route)
+
+    def candidates(self, path: str) -> list[BaseRoute]:
+        segments = path.split("/")[1:]
+        found = list(self.unindexed)
+        frontier = [self.root]
+        for segment in segments:
+            next_frontier = []
+            for node in frontier:
+                found.extend(node.rest)
+                if child := node.literals.get(segment):
+                    next_frontier.append(child)
+                if node.param and segment:
+                    next_frontier.append(node.param)
+            if not (frontier := next_frontier):
+                return found
+        for node in frontier:
+            found.extend(node.rest)
+            found.extend(node.routes)
+        return found
+
+    def match(self, scope: Scope) -> BaseRoute | None:
+        """the route that fully matches the request, as the router would find it"""
+        candidates = self.candidates(scope["path"])
+        for route in sorted(candidates, key=lambda r: self.order[id(r)]):
+            match_, _ = route.matches(scope)
+            if match_ == Match.FULL:
+                return route
+
+
+class BotTarpit:
+    def __init__(self, app: ASGIApp, router: Router) -> None:
+        self.app = app
+        self.router = router
+        self.index: RouteIndex | None = None
+        # (method, path) -> the path template of its route
+        self.known: OrderedDict[tuple[str, str], str] = OrderedDict()
+
+    def route_for(self, scope: Scope) -> str | None:
+        key = scope["method"], scope["path"]
+        if (route := self.known.get(key)) is not None:
+            self.known.move_to_end(key)
+            return route
+        if self.index is None:
+            self.index = RouteIndex(self.router.routes)
+        if matched := self.index.match(scope):
+            route = matched.path
+        elif scope["path"] in PASSTHROUGH:
+            route = scope["path"]
+        else:
+            return None
+        self.known[key] = route
+        if len(self.known) > KNOWN_PATHS:
+            self.known.popitem(last=False)
+        return route
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        route = self.route_for(scope)
+        if route is None:
+            client = scope.get("client")
+            host = client[0] if client else None
+            await self.trigger_delay(host, scope["path"])
+            perf.STATUSES["tarpit"] += 1
+            response = Response(
+                status_code=status.HTTP_301_MOVED_PERMANENTLY,
+                content="Sorry, this resource has moved.",
+            )
+            return await response(scope, receive, send)
+        if route == "/" and scope.get("query_string"):
+            logger.info("Allowed passthrough of request on the root endpoint")
+
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        with perf.request_scope() as tally:
+            start = perf_counter()
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                perf.record_request(
+                    scope["method"], route, status_code, perf_counter() - start, tally
+                )
+
+    @staticmethod
+    async def trigger_delay(host: str, path: str):
+        delay = randint(10, 20)
+        logger.info(f"{host} - {path} - Honeypot triggered. Delaying for {delay}s")
+        await sleep(delay)
@@ -1,22 +1,122 @@
-from io import StringIO, BytesIO
-from time import time
-from typing import Callable, TypeAlias, Literal, Sequence
-from datetime import datetime, timedelta
+import os
+import csv
+from io import StringIO
+from time import perf_counter
+from tempfile import SpooledTemporaryFile
+from typing import Callable, TypeAlias, Literal, Sequence, Iterable, Iterator, Any
+from datetime import datetime
 from logging import getLogger
-from pandas import DataFrame, concat
-from fastapi import HTTPException
+from numpy import zeros, flatnonzero
+from pandas import DataFrame, to_datetime
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+import orjson
+from fastapi import HTTPException, Response
 from app.admin.models import VendorId, Pricing
 from app.downloads import FileResponse, XLSXFileResponse
-from app.db import DB_V2, Session
+from app.db import DB_V2, DB_V2_ASYNC, Session, AsyncSession, perf
 from app.db.sql import queries
 
 logger = getLogger("uvicorn.info")
 
+# rows per CSV chunk sent to the client
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", 1000))
+EXPORT_CHUNK_BYTES = 64 * 1024
+# saved XLSX files larger than this spill from memory to disk
+EXPORT_SPOOL_SIZE = 8 * 1024 * 1024
 
-def flatten(pricing: dict, effective_date: datetime | None) -> DataFrame:
-    prices_formatted = []
-    for price in pricing["data"]:
-        price: dict
+
+def resolve_prices_as_of(
+    prices: list[dict], as_of: datetime | None = None
+) -> list[dict]:
+    """The price in effect on `as_of` (default now) for each price record,
+    resolved across all records at once.
+
+    On or after today, a future price takes over once it's effective. Otherwise the
+    current price stands as long as it was already in effect, or for past dates,
+    only if it took effect on that exact date. Anything else is looked up in the
+    record's history: the latest entry effective on or before `as_of`, with ties
+    going to the latest timestamp. Records without a price in effect on `as_of`
+    are dropped.
+
+    Records come back as new dicts with `price` and `effective_date` swapped out,
+    in their original order. `prices` is not modified.
+    """
+    today = datetime.today()
+    as_of = as_of if as_of else today
+    if not prices:
+        return []
+
+    dates = DataFrame(
+        {
+            "current": [price["effective_date"] for price in prices],
+            "future": [
+                future["effective_date"] if (future := price.get("future")) else None
+                for price in prices
+            ],
+        }
+    ).apply(to_datetime)
+    if as_of >= today:
+        use_future = (dates["future"] <= as_of).to_numpy()
+        in_effect = dates["current"].where(~use_future, dates["future"])
+        needs_history = (in_effect > as_of).to_numpy()
+    else:
+        use_future = zeros(len(prices), dtype=bool)
+        needs_history = (dates["current"] != as_of).to_numpy()
+
+    history = DataFrame.from_records(
+        (
+            (row, entry, record["effective_date"], record["timestamp"])
+            for row in flatnonzero(needs_history)
+            for entry, record in enumerate(prices[row].get("history") or [])
+            if record and record.get("effective_date")
+        ),
+        columns=["row", "entry", "effective_date", "timestamp"],
+    )
+    has_history = zeros(len(prices), dtype=bool)
+    has_history[history["row"].unique().astype(int)] = True
+    history["effective_date"] = to_datetime(history["effective_date"])
+    as_of_entries = (
+        history[history["effective_date"] <= as_of]
+        .sort_values(["row", "effective_date", "timestamp"])
+        .drop_duplicates("row", keep="last")
+    )
+    history_entry = dict(zip(as_of_entries["row"], as_of_entries["entry"]))
+
+    resolved = []
+    for row, price in enumerate(prices):
+        if (entry := history_entry.get(row)) is not None:
+            source = price["history"][entry]
+        elif has_history[row]:
+            # nothing in the history was in effect yet
+            continue
+        elif use_future[row]:
+            source = price["future"]
+        else:
+            source = price
+        if source["effective_date"] > as_of:
+            continue
+        resolved.append(
+            price
+            | {"price": source["price"], "effective_date": source["effective_date"]}
+        )
+    return resolved
+
+
+def pricing_as_of(pricing: Pricing, as_of: datetime | None) -> Pricing:
+    """`resolve_prices_as_of` for a JSON response, or the pricing as-is
+    if there's no date to resolve it to"""
+    if not as_of:
+        return pricing
+    prices = [price.model_dump(exclude_none=True) for price in pricing.data]
+    return Pricing(data=resolve_prices_as_of(prices, as_of))
+
+
+def flatten_rows(prices: Iterable[dict]) -> Iterator[dict]:
+    """Flatten each price record, already resolved to the date of the export,
+    into a plain dict, one row of the export."""
+    for price in prices:
         product_info = {
             "part_id": price["product"]["part_id"],
             "description": price["product"]["description"],
@@ -36,61 +136,95 @@ def flatten(pricing: dict, effective_date: datetime | None) -> DataFrame:
 
         notes = {"notes": "\n".join(notes["notes"])}
 
-        # swap out the price and date signifying the current state
-        # with either a historical or future date
-        # Additionally, filter out future dated data that's in place of current
-        def get_historical_price(price_: dict):
-            if history := price_.get("history"):
-                closest_ = history[0], effective_date - history[0]["effective_date"]
-                for rec in history:
-                    diff_ = effective_date - rec["effective_date"]
-                    if timedelta(0) < diff_ < closest_[1]:
-                        closest_ = rec, diff_
-
-                (historic_price, _) = closest_
-                price_["price"] = historic_price["price"]
-                price_["effective_date"] = historic_price["effective_date"]
-            return price_
-
-        if not effective_date:
-            effective_date = datetime.today()
-        if effective_date >= datetime.today():
-            if future := price.get("future"):
-                if effective_date >= future["effective_date"]:
-                    price["price"] = future["price"]
-                    price["effective_date"] = future["effective_date"]
-            if price["effective_date"] > effective_date:
-                price = get_historical_price(price)
-        elif effective_date == price["effective_date"]:
-            # don't replace if the current price matches the given date
-            pass
-        else:
-            price = get_historical_price(price)
+        price_category = {"Price Category": price["category"]["name"]}
+        yield {
+            **product_info,
+            **price_category,
+            **product_categories,
+            **product_attrs,
+            "effective_date": price["effective_date"],
+            "price": price["price"] / 100,
+            "price_override": price.get("override", False),
+            **notes,
+        }
 
-        if price["effective_date"] > effective_date:
-            # skip future pricing if not replaced by history
-            continue
 
-        price_category = {"Price Category": price["category"]["name"]}
-        df = DataFrame(
-            [
-                {
-                    **product_info,
-                    **price_category,
-                    **product_categories,
-                    **product_attrs,
-                    "effective_date": price["effective_date"],
-                    "price": price["price"],
-                    "price_override": price.get("override", False),
-                    **notes,
-                }
-            ]
+def _sort_key(cols: list[str]) -> Callable[[dict], tuple]:
+    """sort on `cols` in order, with missing values last, as pandas would"""
+
+    def key(row: dict) -> tuple:
+        return tuple(
+            (row.get(col) is None, row.get(col) if row.get(col) is not None else "")
+            for col in cols
         )
-        df["price"] /= 100
-        prices_formatted.append(df)
-    if not prices_formatted:
-        raise HTTPException(204)
-    return concat(prices_formatted, ignore_index=True)
+
+    return key
+
+
+def _pivot(rows: list[dict], cols: list[str]) -> tuple[list[dict], list[str]]:
+    """one row per distinct combination of `cols`,
+    with a column of prices for each price category"""
+    index_cols = [col for col in cols if col not in ("Price Category", "price")]
+    pivoted: dict[tuple, dict] = {}
+    new_cols: dict[str, None] = {}
+    for row in rows:
+        index = tuple(row.get(col) for col in index_cols)
+        category = row["Price Category"]
+        new_cols.setdefault(category)
+        pivoted.setdefault(index, {col: row.get(col) for col in index_cols})[
+            category
+        ] = row["price"]
+    pivoted_rows = sorted(pivoted.values(), key=_sort_key(index_cols))
+    return pivoted_rows, index_cols + list(new_cols)
+
+
+def _csv_value(value: Any) -> Any:
+    # match how pandas writes dates: without the time if it's midnight
+    if isinstance(value, datetime) and value == datetime.combine(
+        value.date(), datetime.min.time(), value.tzinfo
+    ):
+        return value.date()
+    return value
+
+
+def stream_csv(
+    rows: Iterable[dict], cols: list[str], header: list[str]
+) -> Iterator[bytes]:
+    """encode rows into CSV a chunk of rows at a time"""
+    buffer = StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(header)
+    for i, row in enumerate(rows, start=1):
+        writer.writerow([_csv_value(row.get(col)) for col in cols])
+        if i % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if tail := buffer.getvalue():
+        yield tail.encode("utf-8")
+
+
+def stream_xlsx(
+    rows: Iterable[dict], cols: list[str], header: list[str]
+) -> Iterator[bytes]:
+    """write rows through a write-only workbook, which flushes each row to disk
+    as it goes, and read the saved file back in chunks"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    bold = Font(bold=True)
+    header_cells = []
+    for title in header:
+        cell = WriteOnlyCell(ws, value=title)
+        cell.font = bold
+        header_cells.append(cell)
+    ws.append(header_cells)
+    for row in rows:
+        ws.append([row.get(col) for col in cols])
+    with SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE) as file:
+        wb.save(file)
+        file.seek(0)
+        while chunk := file.read(EXPORT_CHUNK_BYTES):
+            yield chunk
 
 
 def transform(
@@ -104,26 +238,23 @@ def transform(
 ) -> FileResponse:
     """
     Takes pricing and formats into a CSV for return as a file to the client.
+
+    Rows are kept as plain dicts and the file is streamed back in chunks as it's
+    written, rather than built up in memory in full.
     """
-    start = time()
+    start = perf_counter()
     if isinstance(data, Callable):
         data = data()
-    pricing_dict = data.model_dump(exclude_none=True)
-    pricing_df = flatten(pricing_dict, effective_date=effective_date).drop(
-        columns="price_override"
+    prices = [price.model_dump(exclude_none=True) for price in data.data]
+    rows = list(flatten_rows(resolve_prices_as_of(prices, effective_date)))
+    if not rows:
+        raise HTTPException(204)
+    # columns in order of first appearance
+    cols: list[str] = list(
+        {col: None for row in rows for col in row if col != "price_override"}
     )
-    cols: list[str] = list(pricing_df.columns)
     if pivot:
-        # remove the ones going away
-        cols.remove("Price Category")
-        cols.remove("price")
-        anticipated_new_cols: list = pricing_df["Price Category"].unique().tolist()
-        pricing_df = pricing_df.pivot(
-            index=cols,
-            columns="Price Category",
-            values="price",
-        ).reset_index()
-        result = pricing_df[cols + anticipated_new_cols]
+        rows, cols = _pivot(rows, cols)
     else:
         # assumption is made that products are connected to AT LEAST one category to
         # sort on.
@@ -136,16 +267,12 @@ def transform(
         other_cols = [
             col for col in cols if col not in set(guarantee_first + guarantee_last)
         ]
-        result = pricing_df[guarantee_first + other_cols + guarantee_last].sort_values(
-            by=(guarantee_first[-2:] + guarantee_first[:2])
-        )
+        cols = guarantee_first + other_cols + guarantee_last
+        rows.sort(key=_sort_key(guarantee_first[-2:] + guarantee_first[:2]))
 
     if remove_cols:
-        try:
-            result = result.drop(columns=remove_cols)
-        except:
-            pass
-    result.columns = list(result.columns.str.replace("_", " ").str.title())
+        cols = [col for col in cols if col not in remove_cols]
+    header = [col.replace("_", " ").title() for col in cols]
 
     customer_name = customer["data"]["attributes"]["name"]
     vendor_name = vendor_id.value.title()
@@ -155,108 +282,141 @@ def transform(
     filename = f"{customer_name} {vendor_name} Pricing {file_date}"
     try:
         if file_type == "csv":
-            buffer = StringIO()
-            result.to_csv(buffer, index=False)
-            buffer.seek(0)
             return FileResponse(
-                content=buffer,
+                content=stream_csv(rows, cols, header),
                 status_code=200,
                 media_type="text/csv",
                 filename=f"{filename}.csv",
             )
         elif file_type == "xlsx":
-            buffer = BytesIO()
-            result.to_excel(buffer, index=False)
-            buffer.seek(0)
-            return XLSXFileResponse(content=buffer, filename=filename)
+            return XLSXFileResponse(
+                content=stream_xlsx(rows, cols, header), filename=filename
+            )
         else:
             raise HTTPException(404, f"Invalid file type given for return: {file_type}")
     finally:
-        logger.info(f"transform: {time() - start}")
+        perf.record_span("transform", perf_counter() - start)
 
 
 FetchMode: TypeAlias = Literal["both", "customer", "class"]
 
 
-def fetch_pricing(
+def pricing_query(
+    vendor_id: VendorId,
+    customer_id: int,
+    mode: FetchMode,
+    categories_to_override: Sequence[str] = None,
+) -> tuple[str, dict]:
+    """the SQL and parameters behind `fetch_pricing_rows`"""
+    params = dict(vendor_id=vendor_id.value, customer_id=customer_id)
+    match mode:
+        case "both":
+            match categories_to_override:
+                case None:
+                    categories_to_override = []
+                case str():
+                    categories_to_override = [categories_to_override]
+                case _ if isinstance(categories_to_override, Sequence):
+                    # Sequence can't be used like "case Sequence(): ..."
+                    categories_to_override = list(categories_to_override)
+                case _:
+                    raise Exception(
+                        "invalid input for categories_to_override: "
+                        f"{categories_to_override}"
+                    )
+            params |= dict(categories_to_override=categories_to_override)
+            sql = queries.pricing_both_json
+        case "customer":
+            sql = queries.pricing_by_customer_json
+        case "class":
+            sql = queries.pricing_by_class_json
+    return sql, params
+
+
+def fetch_pricing_rows(
     session: Session,
     vendor_id: VendorId,
     customer_id: int,
     mode: FetchMode,
     categories_to_override: Sequence[str] = None,
-) -> Pricing:
+) -> list[dict]:
     """
-    Fetch either category-based pricing, customer-specific pricing, or both.
+    Fetch either category-based pricing, customer-specific pricing, or both,
+    as the rows of JSON the queries return.
     In the case 'both' are fetched, customer-specific pricing may replace
-    categorical price records. replace_on supplies a list of tuples containing key
-    names to apply the filter with jointly (an AND relationship)
+    categorical price records. The database drops the class pricing for any
+    product the customer has an override on, only in the categories_to_override,
+    if given.
     """
-    params = dict(vendor_id=vendor_id.value, customer_id=customer_id)
-    start = time()
     try:
-        match mode:
-            case "both":
-                customer_pricing = (
-                    DB_V2.execute(
-                        session, queries.pricing_by_customer_json, params=params
-                    )
-                    .mappings()
-                    .fetchall()
-                )
-                overrides = [e for e in customer_pricing if e["override"] == True]
-                override_product_ids = set([e["product"]["id"] for e in overrides])
-                customer_class_pricing = (
-                    DB_V2.execute(session, queries.pricing_by_class_json, params=params)
-                    .mappings()
-                    .fetchall()
-                )
-                if categories_to_override:
-                    match categories_to_override:
-                        case str():
-                            categories_to_override = set((categories_to_override,))
-                        case _ if isinstance(categories_to_override, Sequence):
-                            # Sequence can't be used like "case Sequence(): ..."
-                            categories_to_override = set(categories_to_override)
-                        case _:
-                            raise Exception(
-                                "invalid input for categories_to_override: "
-                                f"{categories_to_override}"
-                            )
-                pricing_list = []
-                for price in customer_class_pricing:
-                    prod_id = price["product"]["id"]
-                    category = price["category"]["name"]
-                    cond = prod_id in override_product_ids
-                    if categories_to_override:
-                        cond = cond and category in categories_to_override
-                    if not cond:
-                        pricing_list.append(price)
-
-                pricing_list.extend(customer_pricing)
-                pricing = Pricing(data=pricing_list)
-            case "customer":
-                customer_pricing = (
-                    DB_V2.execute(
-                        session, queries.pricing_by_customer_json, params=params
-                    )
-                    .mappings()
-                    .fetchall()
-                )
-                pricing = Pricing(data=customer_pricing)
-            case "class":
-                customer_class_pricing = (
-                    DB_V2.execute(session, queries.pricing_by_class_json, params=params)
-                    .mappings()
-                    .fetchall()
-                )
-                pricing = Pricing(data=customer_class_pricing)
+        sql, params = pricing_query(
+            vendor_id, customer_id, mode, categories_to_override
+        )
+        rows = [
+            dict(row) for row in DB_V2.execute(session, sql, params=params).mappings()
+        ]
     except Exception as e:
         logger.critical(f"Error occured during price fetch and dynamic overrides: {e}")
         session.rollback()
         raise e
     finally:
         session.close()
-    logger.info(f"query execution: {time() - start}")
-    if not pricing.data:
+    if not rows:
+        raise HTTPException(404)
+    return rows
+
+
+async def fetch_pricing_rows_async(
+    session: AsyncSession,
+    vendor_id: VendorId,
+    customer_id: int,
+    mode: FetchMode,
+    categories_to_override: Sequence[str] = None,
+) -> list[dict]:
+    """`fetch_pricing_rows` without blocking the event loop on the query"""
+    try:
+        sql, params = pricing_query(
+            vendor_id, customer_id, mode, categories_to_override
+        )
+        result = await DB_V2_ASYNC.execute(session, sql, params=params)
+        rows = [dict(row) for row in result.mappings()]
+    except Exception as e:
+        logger.critical(f"Error occured during price fetch and dynamic overrides: {e}")
+        await session.rollback()
+        raise e
+    if not rows:
         raise HTTPException(404)
-    return pricing
+    return rows
+
+
+def fetch_pricing(
+    session: Session,
+    vendor_id: VendorId,
+    customer_id: int,
+    mode: FetchMode,
+    categories_to_override: Sequence[str] = None,
+) -> Pricing:
+    rows = fetch_pricing_rows(
+        session, vendor_id, customer_id, mode, categories_to_override
+    )
+    return Pricing(data=rows)
+
+
+def pricing_json_response(rows: list[dict], download_link: str) -> Response:
+    """A `FullPricingWithLink` response serialized straight from the pricing rows
+    with orjson, skipping validation of every row through `Pricing`.
+
+    Nulls are dropped from the top level of each row, as `response_model_exclude_none`
+    would. The "both" query already strips them from the nested JSON.
+    """
+    content = {
+        "download_link": download_link,
+        "meta": {},
+        "pricing": {
+            "data": [
+                {key: value for key, value in row.items() if value is not None}
+                for row in rows
+            ]
+        },
+    }
+    return Response(content=orjson.dumps(content), media_type="application/json")
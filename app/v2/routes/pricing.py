@@ -3,7 +3,14 @@ from datetime import datetime, date, time
 from logging import getLogger
 from functools import partial
 from typing import Annotated, Callable, Union, TypeAlias
-from fastapi import Depends, HTTPException, status, UploadFile, BackgroundTasks
+from fastapi import (
+    Depends,
+    HTTPException,
+    status,
+    UploadFile,
+    BackgroundTasks,
+    Response,
+)
 from fastapi.routing import APIRouter
 from enum import StrEnum
 import openpyxl
@@ -11,9 +18,15 @@ from zipfile import BadZipFile
 
 from app import auth
 from app.admin.models import VendorId
-from app.db import DB_V2, Session
+from app.db import DB_V2, DB_V2_ASYNC, Session, AsyncSession
 from app.v2.models import *
-from app.v2.pricing import transform, fetch_pricing
+from app.v2.pricing import (
+    transform,
+    fetch_pricing,
+    fetch_pricing_rows_async,
+    pricing_as_of,
+    pricing_json_response,
+)
 from app.v2.routes.vendor_product_class_discounts import (
     new_vendor_product_class_discount,
     mod_vendor_product_class_discount,
@@ -29,6 +42,7 @@ from app.v2.routes.vendor_product_discounts import (
 
 from app.admin.models import (
     VendorId,
+    Pricing,
     FullPricingWithLink,
     PriceTemplateSheetColumns,
     PriceTemplateSheet,
@@ -41,6 +55,7 @@ from app.downloads import (
     XLSXFileResponse,
     FileResponse,
     DownloadIDs,
+    DetachedSession,
     StreamingResponse,
 )
 from app.jsonapi.sqla_models import Vendor
@@ -62,6 +77,7 @@ def date_to_datetime(d: date) -> Optional[datetime]:
 
 Token = Annotated[auth.VerifiedToken, Depends(auth.authenticate_auth0_token)]
 NewSession = Annotated[Session, Depends(DB_V2.get_db)]
+NewAsyncSession = Annotated[AsyncSession, Depends(DB_V2_ASYNC.get_db)]
 
 
 class ReturnType(StrEnum):
@@ -82,6 +98,18 @@ def generate_pricing_dl_link(
     return link
 
 
+def pricing_with_link(
+    download_link: str, rows: list[dict], effective_date: datetime | None
+) -> FullPricingWithLink | Response:
+    """JSON pricing along with its download link.
+    Without a date to resolve the prices to, the rows are serialized
+    just as they come back from the query."""
+    if effective_date:
+        pricing = pricing_as_of(Pricing(data=rows), effective_date)
+        return FullPricingWithLink(download_link=download_link, pricing=pricing)
+    return pricing_json_response(rows, download_link)
+
+
 @pricing.get(
     "/{vendor_id}/vendor-customers/{customer_id}/pricing",
     response_model=FullPricingWithLink,
@@ -90,7 +118,7 @@ def generate_pricing_dl_link(
 )
 async def vendor_customer_pricing(
     token: Token,
-    session: NewSession,
+    session: NewAsyncSession,
     vendor_id: VendorId,
     customer_id: int,
     effective_date: date = None,
@@ -104,24 +132,32 @@ async def vendor_customer_pricing(
     Non-default return_types set in the query will still return JSON but only
     the download_link (no JSON pricing object).
 
+    With an effective_date, JSON pricing is resolved to the prices in effect on
+    that date, the same way the file download is.
+
     Execution of pricing file generation in this case is deferred
-    to the return process in the route where the link is redeemed.
+    to the return process in the route where the link is redeemed,
+    with a session of its own.
+
+    Queries run on the async session, so a slow pricing query doesn't hold up
+    other requests on the worker.
     """
+    customer_ops = (
+        auth.VendorCustomerOperations(token, VendorCustomer, id=vendor_id)
+        .allow_admin()
+        .allow_sca()
+        .allow_dev()
+        .allow_customer("std")
+    )
     try:
-        customer = (
-            auth.VendorCustomerOperations(token, VendorCustomer, id=vendor_id)
-            .allow_admin()
-            .allow_sca()
-            .allow_dev()
-            .allow_customer("std")
-            .get(session, obj_id=customer_id)
-        )
+        customer = await session.run_sync(customer_ops.get, obj_id=customer_id)
     except HTTPException as e:
         raise e
 
     if effective_date:
         effective_date = date_to_datetime(effective_date)
-    price_fetch = partial(fetch_pricing, session, vendor_id, customer_id)
+    price_fetch = partial(fetch_pricing, DetachedSession(), vendor_id, customer_id)
+    price_rows = partial(fetch_pricing_rows_async, session, vendor_id, customer_id)
     transform_ = partial(transform, customer, vendor_id, effective_date=effective_date)
     match vendor_id, return_type:
         # ReturnType.JSON: return pricing along with a download link to a CSV file
@@ -129,10 +165,10 @@ async def vendor_customer_pricing(
         # ReturnType.XLSX: return a download link with deferred execution
         case VendorId.ATCO, ReturnType.JSON:
             remove_cols = ["fp_ean", "upc_code"]
-            pricing = price_fetch(mode="both")
-            cb = partial(transform_, pricing, remove_cols)
+            rows = await price_rows(mode="both")
+            cb = partial(transform_, partial(Pricing, data=rows), remove_cols)
             dl_link = generate_pricing_dl_link(vendor_id, customer_id, cb)
-            return FullPricingWithLink(download_link=dl_link, pricing=pricing)
+            return pricing_with_link(dl_link, rows, effective_date)
 
         case VendorId.ATCO, (ReturnType.CSV | ReturnType.XLSX):
             remove_cols = ["fp_ean", "upc_code"]
@@ -143,16 +179,18 @@ async def vendor_customer_pricing(
 
         case VendorId.ADP, ReturnType.JSON:
             remove_cols = None
-            pricing = price_fetch(mode="customer")
+            pricing = Pricing(data=await price_rows(mode="customer"))
             # ADP uses a special file generation method
             cb = partial(
                 generate_program,
-                session=session,
+                session=DetachedSession(),
                 customer_id=customer_id,
                 effective_date=effective_date,
             )
             dl_link = generate_pricing_dl_link(vendor_id, customer_id, cb)
-            return FullPricingWithLink(download_link=dl_link, pricing=pricing)
+            return FullPricingWithLink(
+                download_link=dl_link, pricing=pricing_as_of(pricing, effective_date)
+            )
 
         case VendorId.ADP, ReturnType.XLSX:
             remove_cols = None
@@ -160,7 +198,7 @@ async def vendor_customer_pricing(
             # ADP uses a special file generation method
             cb = partial(
                 generate_program,
-                session=session,
+                session=DetachedSession(),
                 customer_id=customer_id,
                 effective_date=effective_date,
             )
@@ -170,11 +208,13 @@ async def vendor_customer_pricing(
         case VendorId.VYBOND, ReturnType.JSON:
             keys_to_override = ["KEY", "STATE_CPD"]
             remove_cols = ["ucc", "upc"]
-            pricing = price_fetch(mode="both", categories_to_override=keys_to_override)
+            rows = await price_rows(
+                mode="both", categories_to_override=keys_to_override
+            )
             pivot = False
-            cb = partial(transform_, pricing, remove_cols, pivot)
+            cb = partial(transform_, partial(Pricing, data=rows), remove_cols, pivot)
             dl_link = generate_pricing_dl_link(vendor_id, customer_id, cb)
-            return FullPricingWithLink(download_link=dl_link, pricing=pricing)
+            return pricing_with_link(dl_link, rows, effective_date)
 
         case VendorId.VYBOND, (ReturnType.CSV | ReturnType.XLSX):
             keys_to_override = ["KEY", "STATE_CPD"]
@@ -189,11 +229,11 @@ async def vendor_customer_pricing(
 
         case VendorId.FRIEDRICH, ReturnType.JSON:
             remove_cols = None
-            pricing = price_fetch(mode="both")
+            rows = await price_rows(mode="both")
             pivot = False
-            cb = partial(transform_, pricing, remove_cols, pivot)
+            cb = partial(transform_, partial(Pricing, data=rows), remove_cols, pivot)
             dl_link = generate_pricing_dl_link(vendor_id, customer_id, cb)
-            return FullPricingWithLink(download_link=dl_link, pricing=pricing)
+            return pricing_with_link(dl_link, rows, effective_date)
 
         case VendorId.FRIEDRICH, (ReturnType.CSV | ReturnType.XLSX):
             remove_cols = None
@@ -205,11 +245,11 @@ async def vendor_customer_pricing(
 
         case VendorId.TEST, ReturnType.JSON:
             remove_cols = None
-            pricing = price_fetch(mode="both")
+            rows = await price_rows(mode="both")
             pivot = False
-            cb = partial(transform_, pricing, remove_cols, pivot)
+            cb = partial(transform_, partial(Pricing, data=rows), remove_cols, pivot)
             dl_link = generate_pricing_dl_link(vendor_id, customer_id, cb)
-            return FullPricingWithLink(download_link=dl_link, pricing=pricing)
+            return pricing_with_link(dl_link, rows, effective_date)
 
         case VendorId.TEST, (ReturnType.CSV | ReturnType.XLSX):
             remove_cols = None
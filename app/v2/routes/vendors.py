@@ -11,6 +11,7 @@ from app.db import DB_V2, Session, S3
 from app.v2.models import *
 from app.admin.models import VendorId
 from app.downloads import FileResponse
+from app.jsonapi.responses import trusted_jsonapi
 from app.jsonapi.sqla_models import Vendor
 
 PARENT_PREFIX = "/v2/vendors"
@@ -37,6 +38,7 @@ class GetType(StrEnum):
     response_model_exclude_none=True,
     tags=["jsonapi", GetType.Collection, "vendors"],
 )
+@trusted_jsonapi
 async def vendor_collection(
     token: Token, session: NewSession, query: VendorQuery = Depends()
 ) -> VendorCollectionResp:
@@ -122,6 +124,7 @@ async def vendor_relationships_vendors_attrs(
     response_model_exclude_none=True,
     tags=["jsonapi", GetType.Collection, "products"],
 )
+@trusted_jsonapi
 async def vendor_related_vendor_products(
     token: Token,
     session: NewSession,
@@ -272,6 +275,7 @@ async def vendor_relationships_vendor_pricing_classes(
     response_model_exclude_none=True,
     tags=["jsonapi", GetType.Collection, "vendor customers"],
 )
+@trusted_jsonapi
 async def vendor_related_vendor_customers(
     token: Token,
     session: NewSession,
@@ -324,6 +328,7 @@ async def vendor_relationships_vendor_customers(
     response_model_exclude_none=True,
     tags=["jsonapi", GetType.Collection, "vendors"],
 )
+@trusted_jsonapi
 async def vendors_attrs_changelog_collection(
     token: Token,
     session: NewSession,
@@ -352,6 +357,7 @@ async def vendors_attrs_changelog_collection(
     response_model_exclude_none=True,
     tags=["jsonapi", GetType.Collection, "products"],
 )
+@trusted_jsonapi
 async def vendors_products_attrs_collection(
     token: Token,
     session: NewSession,
@@ -380,6 +386,7 @@ async def vendors_products_attrs_collection(
     response_model_exclude_none=True,
     tags=["jsonapi", GetType.Collection, "pricing"],
 )
+@trusted_jsonapi
 async def vendors_pricing_by_customer_collection(
     token: Token,
     session: NewSession,
@@ -408,6 +415,7 @@ async def vendors_pricing_by_customer_collection(
     response_model_exclude_none=True,
     tags=["jsonapi", GetType.Collection, "pricing"],
 )
+@trusted_jsonapi
 async def customer_pricing_by_class_collection(
     token: Token,
     session: NewSession,
@@ -438,6 +446,7 @@ async def customer_pricing_by_class_collection(
     response_model_exclude_none=True,
     tags=["jsonapi", GetType.Collection, "pricing"],
 )
+@trusted_jsonapi
 async def customer_pricing_by_customer_collection(
     token: Token,
     session: NewSession,
@@ -468,6 +477,7 @@ async def customer_pricing_by_customer_collection(
     response_model_exclude_none=True,
     tags=["jsonapi", GetType.Collection, "discounts"],
 )
+@trusted_jsonapi
 async def vendors_product_class_discounts_collection(
     token: Token,
     session: NewSession,
@@ -496,6 +506,7 @@ async def vendors_product_class_discounts_collection(
     response_model_exclude_none=True,
     tags=["jsonapi", GetType.Collection, "pricing"],
 )
+@trusted_jsonapi
 async def vendor_customer_pricing_classes_collection(
     token: Token,
     session: NewSession,
@@ -524,6 +535,7 @@ async def vendor_customer_pricing_classes_collection(
     response_model_exclude_none=True,
     tags=["jsonapi", GetType.Collection, "quotes"],
 )
+@trusted_jsonapi
 async def vendors_quotes_collection(
     token: Token,
     session: NewSession,
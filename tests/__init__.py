@@ -0,0 +1,4 @@
+import os
+
+# validate every JSON:API response against its model, trusted routes included
+os.environ.setdefault("JSONAPI_VALIDATION_SAMPLE_RATE", "1")
@@ -1,11 +1,46 @@
-from pytest import mark
+import os
+import json
+import asyncio
+from io import BytesIO
+from time import time
+from datetime import datetime
+from pytest import mark, approx, raises
 from pathlib import Path
+import numpy as np
+import openpyxl
+from openpyxl.styles import Font, Alignment, numbers
 from fastapi.testclient import TestClient
 from app.main import app
 from app.auth import authenticate_auth0_token
-from app.db import S3 as real_S3
+from app.db import S3 as real_S3, DB_V2
+from app.db.cache import (
+    CACHE,
+    Cache,
+    MemoryBackend,
+    FileBackend,
+    UnsafeDirectory,
+    shared_directory,
+)
+from app.adp.adp_models.model_series import KEY_PRICES
+from app.adp.extraction.models import parse_model_string
+from app.adp.utils.models import ParsingModes
+from app.adp.extraction import repricing
+from app.adp.extraction.repricing import (
+    reprice_models,
+    reprice_customer_models,
+    RepricingResult,
+    SeriesPricingSnapshot,
+)
+from app.admin.price_updates import price_update_handlers
+from app.adp.adp_models import MODELS
+from app.adp.utils import validator
+from app.adp.utils.validator import Validator, SeriesRegistry, SERIES_REGISTRY
+from app.adp.utils.pricebook import PriceBook, StampedPriceBook, Logos
+from app.adp.adp_models.model_series import Fields, ModelSeries
+from app.db import Stage
 from tests import auth_overrides
 import pandas as pd
+from sqlalchemy.exc import OperationalError
 
 # pytest doesn't like putting this under TYPE_CHECKING
 from app.auth import VerifiedToken
@@ -60,6 +95,310 @@ def test_model_zero_discount_pricing(model, price):
     assert resp.json()["zero_discount_price"] == price
 
 
+def test_batch_repricing_matches_single_model_pricing():
+    """the shared pricing snapshot has to price the reference models
+    exactly as the one-at-a-time parser does"""
+    session = next(DB_V2.get_db())
+    models = list(enumerate(PRICED_MODELS.model_number.to_list()))
+    repriced = reprice_models(session, models, ParsingModes.BASE_PRICE)
+    assert not repriced.failures, repriced.failures
+    expected = PRICED_MODELS.price.to_list()
+    for id_, price in repriced.prices:
+        assert price / 100 == approx(expected[id_]), PRICED_MODELS.model_number[id_]
+    assert repriced.throughput > 0
+
+
+class FakeSnapshot:
+    queries_run = queries_saved = 0
+
+    def __init__(self, *args, **kwargs) -> None: ...
+
+
+class FakeSession:
+    def __init__(self) -> None:
+        self.commits = 0
+
+    def commit(self) -> None:
+        self.commits += 1
+
+    def rollback(self) -> None: ...
+
+    def close(self) -> None: ...
+
+
+def fake_parse(session, customer_id, model, mode, db) -> dict:
+    if model == "bad":
+        raise ValueError("not a model")
+    return {Fields.NET_PRICE.value: 1.5, Fields.ZERO_DISCOUNT_PRICE.value: 2.5}
+
+
+def test_repricing_writes_chunks_as_it_goes(monkeypatch):
+    monkeypatch.setattr(repricing, "parse_model_string", fake_parse)
+    chunks = []
+    models = [(1, "a"), (2, "bad"), (3, "b"), (4, "c"), (5, "d")]
+    result = reprice_models(
+        None,
+        models,
+        ParsingModes.BASE_PRICE,
+        snapshot=FakeSnapshot(),
+        write_chunk=chunks.append,
+        chunk_size=2,
+    )
+    assert chunks == [[(1, 250.0), (3, 250.0)], [(4, 250.0), (5, 250.0)]]
+    assert [id_ for id_, *_ in result.failures] == [2]
+
+
+def test_customer_repricing_reports_failed_units(monkeypatch):
+    """chunks commit as each customer goes, and a customer that fails
+    partway through is reported rather than dropped"""
+    sessions = []
+
+    class FakeDB:
+        def get_db(self):
+            sessions.append(FakeSession())
+            yield sessions[-1]
+
+    written = []
+
+    def write_chunk(session, customer_id, chunk) -> None:
+        if customer_id == 20 and any(c[1] for c in written if c[0] == 20):
+            raise RuntimeError("connection lost")
+        written.append((customer_id, chunk))
+
+    monkeypatch.setattr(repricing, "DB_V2", FakeDB())
+    monkeypatch.setattr(repricing, "SeriesPricingSnapshot", FakeSnapshot)
+    monkeypatch.setattr(repricing, "parse_model_string", fake_parse)
+    models = [(1, "a", 10), (2, "b", 10), (3, "c", 20), (4, "d", 20), (5, "e", 20)]
+    result = reprice_customer_models(
+        models, ParsingModes.CUSTOMER_PRICING, write_chunk, chunk_size=2
+    )
+    assert result.failed_units == [20]
+    assert sorted(id_ for _, chunk in written for id_, _ in chunk) == [1, 2, 3, 4]
+    assert sum(session.commits for session in sessions) == 2
+
+
+@mark.parametrize("failed_units", [[], [20]])
+def test_customer_price_update_resumes_and_holds_back_on_failures(
+    monkeypatch, failed_units
+):
+    """only what a previous run didn't save is repriced, and future pricing
+    isn't established, nor the saved progress cleared, if any customer failed"""
+    executed, repriced = [], []
+
+    class FakeResult:
+        def __init__(self, rows: list) -> None:
+            self.rows = rows
+
+        def scalars(self) -> list:
+            return self.rows
+
+        def fetchall(self) -> list:
+            return self.rows
+
+    class FakeDB:
+        def execute(self, session, sql, params=None) -> FakeResult:
+            executed.append(sql.name)
+            match sql.name:
+                case "adp_customer_pricing_progress_completed":
+                    return FakeResult([1])
+                case "adp_customer_pricing_all_models":
+                    return FakeResult(
+                        [(1, "m1", 10, None), (2, "m2", 10, "pl2"), (3, "m3", 20, None)]
+                    )
+            return FakeResult([])
+
+    def fake_reprice(models, mode, write_chunk) -> RepricingResult:
+        repriced.extend(models)
+        return RepricingResult(failed_units=failed_units)
+
+    monkeypatch.setattr(price_update_handlers, "DB_V2", FakeDB())
+    monkeypatch.setattr(price_update_handlers, "reprice_customer_models", fake_reprice)
+    update = price_update_handlers._adp_update_customer_prices
+    asyncio.run(update(FakeSession(), datetime(2026, 1, 1)))
+
+    assert repriced == [(2, "pl2", 10), (3, "m3", 20)]
+    finishing = {
+        "adp_customer_pricing_establish_future",
+        "adp_customer_pricing_progress_clear",
+    }
+    if failed_units:
+        assert not finishing & set(executed)
+    else:
+        assert finishing <= set(executed)
+
+
+@mark.parametrize("model", [*PRICED_MODELS.model_number.to_list(), "12345678"])
+def test_series_registry_candidates(model):
+    """narrowing by length and leading character can't drop a series
+    whose regex would have matched"""
+    text = Validator.normalize(model)
+    matching = {
+        m
+        for m in MODELS
+        if len(text) in m.text_len and SERIES_REGISTRY.pattern(m).match(text)
+    }
+    assert matching
+    assert matching <= set(Validator.candidates(model))
+
+
+def test_series_registry_without_regex_parser(monkeypatch):
+    """if the regex parser internals can't be used, no series is narrowed out"""
+    monkeypatch.setattr(validator, "sre_parse", None)
+    registry = SeriesRegistry()
+    registry.register(*MODELS)
+    for m in MODELS:
+        for length in m.text_len:
+            assert m in registry.candidates("Z" * length)
+
+
+def lookup_single(models: list[str]) -> dict[str, dict]:
+    single = {}
+    for model in models:
+        resp = test_client.get(f"{PATH_PREFIX}?customer_id=0&model_number={model}")
+        assert resp.status_code == 200, resp.content
+        single[resp.json()["model_number"]] = resp.json()
+    return single
+
+
+def lookup_batch(models: list[str]) -> dict[str, dict]:
+    resp = test_client.post(
+        f"{PATH_PREFIX}/batch", json={"model_numbers": models, "customer_id": 0}
+    )
+    assert resp.status_code == 200, resp.content
+    assert not resp.json()["errors"], resp.json()["errors"]
+    return {record["model_number"]: record for record in resp.json()["data"]}
+
+
+def test_batch_model_lookup_matches_single_lookups():
+    """the batch endpoint has to return the same pricing as the single lookup"""
+    app.dependency_overrides[authenticate_auth0_token] = auth_overrides.AdminToken
+    try:
+        models = PRICED_MODELS.model_number.to_list()
+        single = lookup_single(models)
+        batch = lookup_batch(models)
+        assert batch.keys() == single.keys()
+        for model, record in single.items():
+            assert batch[model]["zero_discount_price"] == record["zero_discount_price"]
+    finally:
+        app.dependency_overrides[authenticate_auth0_token] = {}
+
+
+def test_batch_model_lookup_fails_on_database_errors(monkeypatch):
+    """a database error fails the request instead of calling every model invalid"""
+
+    class Unreachable(ModelSeries):
+        text_len = (8,)
+        regex = r"^(?P<series>\d{8})$"
+
+        def __init__(self, *args, **kwargs) -> None:
+            raise OperationalError("SELECT", {}, Exception("connection lost"))
+
+    monkeypatch.setattr(SeriesPricingSnapshot, "load", lambda self, session: None)
+    monkeypatch.setattr(Validator, "candidates", staticmethod(lambda _: [Unreachable]))
+    app.dependency_overrides[authenticate_auth0_token] = auth_overrides.AdminToken
+    try:
+        client = TestClient(app, raise_server_exceptions=False)
+        resp = client.post(
+            f"{PATH_PREFIX}/batch",
+            json={"model_numbers": ["12345678", "87654321"], "customer_id": 0},
+        )
+        assert resp.status_code == 500, resp.content
+    finally:
+        app.dependency_overrides[authenticate_auth0_token] = {}
+
+
+@mark.skipif(
+    not os.getenv("RUN_BENCHMARKS"), reason="set RUN_BENCHMARKS to time lookups"
+)
+def test_batch_model_lookup_per_model_cost():
+    """benchmark: the batch endpoint has to cost less per model
+    than the single lookup"""
+    app.dependency_overrides[authenticate_auth0_token] = auth_overrides.AdminToken
+    try:
+        models = PRICED_MODELS.model_number.to_list()
+        start_ = time()
+        lookup_single(models)
+        single_cost = (time() - start_) / len(models)
+        start_ = time()
+        lookup_batch(models)
+        batch_cost = (time() - start_) / len(models)
+        print(
+            f"ADP lookup per model over {len(models)} models: "
+            f"single {single_cost*1000:,.1f}ms, batch {batch_cost*1000:,.1f}ms"
+        )
+        assert batch_cost < single_cost
+    finally:
+        app.dependency_overrides[authenticate_auth0_token] = {}
+
+
+@mark.parametrize("backend", ["memory", "file"])
+def test_cache_invalidated_by_vendor_update(backend, tmp_path):
+    match backend:
+        case "memory":
+            cache = Cache(MemoryBackend(max_entries=2))
+        case "file":
+            cache = Cache(FileBackend(tmp_path, max_entries=2))
+    adp = cache.register_namespace("adp_test", vendors=("adp",))
+    atco = cache.register_namespace("atco_test", vendors=("atco",))
+    cache.set(adp, "key", {"price": 100})
+    cache.set(atco, "key", {"price": 200})
+    assert cache.get(adp, "key") == {"price": 100}
+
+    cache.invalidate_vendor("adp")
+    assert cache.get(adp, "key") is None
+    assert cache.get(atco, "key") == {"price": 200}
+    assert cache.get(adp, "expired", "default") == "default"
+    cache.set(adp, "expired", 1, ttl=-1)
+    assert cache.get(adp, "expired") is None
+    stats = cache.stats()
+    assert stats[adp]["invalidations"] == 1
+    assert stats[adp]["hits"] == 1 and stats[adp]["misses"] == 3
+
+    if backend == "file":
+        # another worker on the host sees the same entries and versions
+        other_worker = Cache(FileBackend(tmp_path))
+        assert other_worker.get(atco, "key") == {"price": 200}
+    else:
+        cache.set(adp, "a", 1)
+        cache.set(adp, "b", 2)
+        assert cache.get(atco, "key") is None
+        assert cache.stats()[atco]["evictions"] == 1
+
+
+def test_file_backend_only_uses_private_directories(tmp_path, monkeypatch):
+    """entries are unpickled, so a directory anyone else can write to is refused"""
+    open_dir = tmp_path / "open"
+    open_dir.mkdir()
+    open_dir.chmod(0o777)
+    with raises(UnsafeDirectory):
+        FileBackend(open_dir)
+
+    monkeypatch.delenv("CACHE_DIR", raising=False)
+    assert shared_directory("CACHE_DIR") is None
+    monkeypatch.setenv("CACHE_DIR", str(open_dir))
+    assert shared_directory("CACHE_DIR") is None
+    monkeypatch.setenv("CACHE_DIR", str(tmp_path / "private"))
+    assert shared_directory("CACHE_DIR") == tmp_path / "private"
+    assert (tmp_path / "private").stat().st_mode & 0o777 == 0o700
+
+
+def test_key_prices_memoized_until_invalidated():
+    session = next(DB_V2.get_db())
+    mode = ParsingModes.BASE_PRICE
+    CACHE.invalidate(KEY_PRICES)
+    first = parse_model_string(session, 0, TEST_COIL_MODEL, mode)
+    hits = CACHE.stats()[KEY_PRICES].get("hits", 0)
+    second = parse_model_string(session, 0, TEST_COIL_MODEL, mode)
+    assert CACHE.stats()[KEY_PRICES]["hits"] > hits
+    assert second["zero_discount_price"] == first["zero_discount_price"]
+
+    CACHE.invalidate_vendor("adp")
+    misses = CACHE.stats()[KEY_PRICES]["misses"]
+    parse_model_string(session, 0, TEST_COIL_MODEL, mode)
+    assert CACHE.stats()[KEY_PRICES]["misses"] > misses
+    session.close()
+
+
 mapped_perms = [
     (auth_overrides.AdminToken, True, True, True),
     (auth_overrides.SCAEmployeeToken, True, True, True),
@@ -87,3 +426,207 @@ def test_model_lookup(token, no_cid, zero_disc, gating):
     )
     assert (response.status_code == 200) == gating
     app.dependency_overrides[authenticate_auth0_token] = {}
+
+
+PRICEBOOK_TEMPLATE = Path(__file__).parents[1] / "app/adp/templates/template.xlsx"
+PRICEBOOK_GOLDEN = Path(__file__).parent / "assets/pricebook_golden.json"
+
+
+class PriceBookProgram:
+    """one product program with a fixed number of rows per category"""
+
+    def __init__(self, rows_by_category: dict[str, int], seed: int) -> None:
+        self.rows_by_category = rows_by_category
+        self.product_categories = list(rows_by_category)
+        self.seed = seed
+
+    def category_data(self, category, customer_id, session) -> pd.DataFrame:
+        n = self.rows_by_category[category]
+        rng = np.random.default_rng(self.seed + len(category))
+        return pd.DataFrame(
+            {
+                Fields.MODEL_NUMBER.value: [f"HE32924D175B{i:04d}AP" for i in range(n)],
+                Fields.PALLET_QTY.value: rng.integers(1, 40, n),
+                Fields.WIDTH.value: rng.choice([14.5, 17.5, 21.0], n),
+                Fields.DEPTH.value: rng.integers(18, 30, n).astype(float),
+                Fields.HEIGHT.value: rng.integers(20, 60, n),
+                Fields.WEIGHT.value: ["--" if i % 7 == 0 else i * 3 for i in range(n)],
+                Fields.METERING.value: rng.choice(["TXV", "Piston", None], n),
+                Fields.NET_PRICE.value: rng.integers(50000, 200000, n) / 100,
+                Fields.RATED.value: [i % 3 != 0 for i in range(n)],
+                Fields.SERIES.value: "HE",
+                Fields.STAGE.value: [
+                    Stage.PROPOSED.name if i % 5 == 0 else Stage.ACTIVE.name
+                    for i in range(n)
+                ],
+                Fields.PRICE_ID.value: np.arange(n) + 1000,
+            }
+        )
+
+
+class PriceBookCustomerProgram:
+    """the parts of a CustomerProgram that PriceBook reads, without a database"""
+
+    customer_id = ADP_CUSTOMER_ID
+    customer_name = "Test Customer"
+    logo_path = ""
+    series_contained = {"HE"}
+
+    def __init__(self, rows: int) -> None:
+        self.progs = [
+            PriceBookProgram({"Cased": rows, "Uncased": 1, "Slab": rows // 2}, 1),
+            PriceBookProgram({"Multi-Position": rows}, 2),
+        ]
+        parts = rows // 4 + 3
+        self.parts = pd.DataFrame(
+            {
+                "description": [f"part {i}" for i in range(parts)],
+                "part_number": [f"P{i:05d}" for i in range(parts)],
+                "pkg_qty": [1 + i % 3 for i in range(parts)],
+                "standard": [10.5 + i for i in range(parts)],
+            }
+        )
+        bold_right = dict(font=Font(bold=True), alignment=Alignment(horizontal="right"))
+        self.terms = {
+            "Payment Terms": {"value": "2% 10 Net 30", "style": bold_right},
+            "Freight": {
+                "value": 2500,
+                "style": bold_right | {"number_format": numbers.FORMAT_CURRENCY_USD},
+            },
+            "Effective Date": {
+                "value": datetime(2024, 1, 1),
+                "style": bold_right | {"number_format": numbers.FORMAT_DATE_YYYYMMDD2},
+            },
+        }
+        n = max(rows // 2, 4)
+        self.ratings = pd.DataFrame(
+            {
+                "OEM Series": [None if i % 2 else "GSXC" for i in range(n)],
+                "OutdoorModel": [f"GSXC{i:04d}" for i in range(n)],
+                "OEM Name": [None if i % 2 else "Goodman" for i in range(n)],
+                "OEMName": ["Goodman"] * n,
+                "FurnaceModel": [None] * n,
+                "Furnace Model Number": [None] * n,
+                "HSPF2": [0 if i % 2 else 7.5 for i in range(n)],
+                "Model Number": [None if i % 3 else f"GSXC{i:04d}" for i in range(n)],
+                "Coil Model Number": [
+                    None if i % 3 else f"HE{i:04d}" for i in range(n)
+                ],
+                "IndoorModel": [f"HE{i:04d}" for i in range(n)],
+                "ADP Series": ["HE" if i % 4 == 0 else None for i in range(n)],
+                "AHRI Ref Number": [0 if i % 2 else 1000 + i for i in range(n)],
+                "AHRINumber": [2000 + i for i in range(n)],
+                "SEER2": ["14.3"] * n,
+                "EER2": ["11.2"] * n,
+                "Capacity2": [24000] * n,
+                "seer2_as_submitted": ["0"] * n,
+                "eer95f2_as_submitted": ["11"] * n,
+                "capacity2_as_submitted": [36000] * n,
+                "hspf2_as_submitted": [7.8] * n,
+            }
+        )
+
+    def __iter__(self):
+        return iter(self.progs)
+
+    def sample_from_program(self, series: str) -> str:
+        return TEST_COIL_MODEL
+
+
+def build_pricebook(builder: type[PriceBook], rows: int) -> BytesIO:
+    return (
+        builder(PRICEBOOK_TEMPLATE, PriceBookCustomerProgram(rows), logos=Logos())
+        .build_program(session=None)
+        .add_footer(offset=(0, 1))
+        .attach_nomenclature_tab()
+        .attach_ratings()
+        .save_and_close()
+    )
+
+
+def color_key(color) -> str | None:
+    match color and color.type:
+        case "rgb":
+            return color.rgb
+        case "theme":
+            return f"theme {color.theme} {color.tint}"
+        case "indexed":
+            return f"indexed {color.indexed}"
+
+
+def pricebook_snapshot(file: BytesIO) -> dict:
+    """every cell's value and visible style, one line per cell,
+    and the merged ranges and column widths of each sheet"""
+    snapshot = {}
+    for ws in openpyxl.load_workbook(file):
+        cells = {}
+        for row in ws.iter_rows():
+            for cell in row:
+                font, fill, border = cell.font, cell.fill, cell.border
+                cells[cell.coordinate] = " | ".join(
+                    str(attr)
+                    for attr in (
+                        repr(cell.value),
+                        font.b,
+                        font.i,
+                        font.sz,
+                        color_key(font.color),
+                        color_key(fill.fgColor),
+                        fill.patternType,
+                        border.left.style,
+                        border.right.style,
+                        border.top.style,
+                        border.bottom.style,
+                        cell.alignment.horizontal,
+                        cell.number_format,
+                    )
+                )
+        snapshot[ws.title] = {
+            "cells": cells,
+            "merged": sorted(str(merged) for merged in ws.merged_cells.ranges),
+            "widths": {k: dim.width for k, dim in ws.column_dimensions.items()},
+        }
+    return snapshot
+
+
+@mark.parametrize("builder", [PriceBook, StampedPriceBook])
+def test_pricebook_matches_golden_file(builder, monkeypatch):
+    """set UPDATE_GOLDEN to rewrite the golden file from the cell-by-cell builder"""
+    monkeypatch.setenv("SHORT_OEM_PREFIXES", '["ABC"]')
+    monkeypatch.setenv("LONG_OEM_PREFIXES", '["XYZ"]')
+    snapshot = pricebook_snapshot(build_pricebook(builder, rows=6))
+    if os.getenv("UPDATE_GOLDEN") and builder is PriceBook:
+        PRICEBOOK_GOLDEN.write_text(json.dumps(snapshot, indent=1, sort_keys=True))
+    golden = json.loads(PRICEBOOK_GOLDEN.read_text())
+    assert snapshot.keys() == golden.keys()
+    for sheet, expected in golden.items():
+        assert snapshot[sheet]["merged"] == expected["merged"], sheet
+        assert snapshot[sheet]["widths"] == expected["widths"], sheet
+        for coordinate, cell in expected["cells"].items():
+            assert snapshot[sheet]["cells"].get(coordinate) == cell, coordinate
+        assert snapshot[sheet]["cells"].keys() == expected["cells"].keys(), sheet
+
+
+@mark.skipif(
+    not os.getenv("RUN_BENCHMARKS"), reason="set RUN_BENCHMARKS to time pricebooks"
+)
+def test_stamped_pricebook_benchmark(monkeypatch):
+    """benchmark: the stamped builder against the cell-by-cell one
+    on a large program, for the same file"""
+    monkeypatch.setenv("SHORT_OEM_PREFIXES", '["ABC"]')
+    monkeypatch.setenv("LONG_OEM_PREFIXES", '["XYZ"]')
+    rows = int(os.getenv("PRICEBOOK_BENCHMARK_ROWS", 1000))
+    timings, files = {}, {}
+    for builder in (PriceBook, StampedPriceBook):
+        start_ = time()
+        files[builder] = build_pricebook(builder, rows)
+        timings[builder] = time() - start_
+    print(
+        f"PriceBook with {rows} rows per category: "
+        f"cell-by-cell {timings[PriceBook]:.2f}s, "
+        f"stamped {timings[StampedPriceBook]:.2f}s"
+    )
+    assert pricebook_snapshot(files[StampedPriceBook]) == pricebook_snapshot(
+        files[PriceBook]
+    )
+    assert timings[StampedPriceBook] * 2 < timings[PriceBook]
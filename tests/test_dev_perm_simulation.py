@@ -1,10 +1,19 @@
+import time
+import asyncio
 from fastapi.testclient import TestClient
 from fastapi import Header
+from fastapi.security.http import HTTPAuthorizationCredentials
 from pytest import mark
 from pprint import pformat
+from jose import jwt, jwk
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
 
 from app.main import app
-from app.auth import authenticate_auth0_token
+from app import auth
+from app.auth import authenticate_auth0_token, JWKSCache, LocalTokenStore, TokenShard
+from app.db.cache import CACHE, Cache, FileBackend
+from app.jsonapi.sqla_models import SCACustomer
 from tests import auth_overrides
 
 test_client = TestClient(app)
@@ -39,3 +48,142 @@ def test_dev_simulated_perms(sim_perm: int, ids: set[int]):
     else:
         returned_ids = set([customer["id"] for customer in resp.json()["data"]])
         assert returned_ids == ids, pformat(resp.text)
+
+
+def test_concurrent_first_hits_verify_once(monkeypatch):
+    """a token is verified once no matter how many requests arrive with it
+    before it's stored, and a new signing key is picked up without a restart"""
+    calls = {"jwks": 0, "userinfo": 0}
+    keys = []
+
+    def signed_token(kid: str) -> str:
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        pem = private_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+        public_pem = private_key.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        keys.append(
+            jwk.construct(public_pem, "RS256").to_dict() | {"kid": kid, "use": "sig"}
+        )
+        claims = {
+            "aud": "test-audience",
+            "azp": "test-client",
+            "exp": int(time.time()) + 60,
+            "permissions": ["customer-std"],
+        }
+        return jwt.encode(claims, pem, algorithm="RS256", headers={"kid": kid})
+
+    async def fetch() -> list[dict]:
+        calls["jwks"] += 1
+        await asyncio.sleep(0.05)
+        return list(keys)
+
+    async def get_user_info(access_token: str) -> dict:
+        calls["userinfo"] += 1
+        await asyncio.sleep(0.05)
+        return dict(nickname="test", name="test", email="", email_verified=True)
+
+    jwks = JWKSCache(url="", ttl=3600, min_refresh=0)
+    monkeypatch.setattr(jwks, "fetch", fetch)
+    monkeypatch.setattr(auth, "JWKS", jwks)
+    monkeypatch.setattr(auth, "get_user_info", get_user_info)
+    monkeypatch.setattr(auth, "ALGORITHMS", ["RS256"])
+    monkeypatch.setattr(auth, "AUDIENCE", "test-audience")
+
+    async def authenticate(token: str, times: int) -> list[auth.VerifiedToken]:
+        creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+        return await asyncio.gather(
+            *(authenticate_auth0_token(creds, 20) for _ in range(times))
+        )
+
+    verified = asyncio.run(authenticate(signed_token("first"), 10))
+    assert len({id(token) for token in verified}) == 1
+    assert verified[0].permissions == auth.Permissions.customer_std
+    assert calls == {"jwks": 1, "userinfo": 1}
+
+    asyncio.run(authenticate(signed_token("rotated"), 3))
+    assert calls == {"jwks": 2, "userinfo": 2}
+    assert set(jwks.keys) == {"first", "rotated"}
+    assert not auth.PENDING_VERIFICATIONS
+
+
+def test_jwks_fetched_on_first_use_soon_after_boot(monkeypatch):
+    """the monotonic clock starts near zero on a freshly booted host"""
+    fetches = []
+
+    async def fetch() -> list[dict]:
+        fetches.append(1)
+        return [dict(kid="key", kty="RSA", use="sig", n="n", e="e")]
+
+    monkeypatch.setattr(time, "monotonic", lambda: 5.0)
+    jwks = JWKSCache(url="", ttl=3600, min_refresh=30)
+    monkeypatch.setattr(jwks, "fetch", fetch)
+    assert asyncio.run(jwks.get_key("key"))["kid"] == "key"
+    assert asyncio.run(jwks.get_key("key"))
+    assert fetches == [1]
+
+
+def test_token_store_bounded_expiring_and_shared(monkeypatch, tmp_path):
+    monkeypatch.setattr(LocalTokenStore, "shards", [TokenShard(max_entries=2)])
+    monkeypatch.setattr(LocalTokenStore, "shared", None)
+
+    def token(value: str, expires_in: int) -> auth.VerifiedToken:
+        return auth.VerifiedToken(
+            token=value,
+            exp=int(time.time()) + expires_in,
+            permissions=auth.Permissions.customer_std,
+            nickname="test",
+            name="test",
+            email="",
+            email_verified=True,
+        )
+
+    LocalTokenStore.add_token(token("expired", -1))
+    LocalTokenStore.add_token(token("later", 60))
+    assert LocalTokenStore.sweep() == 1
+    assert LocalTokenStore.stats()["size"] == 1
+
+    LocalTokenStore.add_token(token("soonest", 30))
+    LocalTokenStore.add_token(token("latest", 90))
+    assert LocalTokenStore.get("soonest") is None, "soonest to expire is evicted"
+    assert LocalTokenStore.get("later")
+    assert LocalTokenStore.get("latest")
+
+    # another worker sharing the directory picks up the verified token
+    shared = Cache(FileBackend(tmp_path))
+    monkeypatch.setattr(LocalTokenStore, "shared", shared)
+    LocalTokenStore.add_token(token("shared", 60))
+    monkeypatch.setattr(LocalTokenStore, "shards", [TokenShard(max_entries=2)])
+    assert LocalTokenStore.get("shared").nickname == "test"
+    assert LocalTokenStore.stats()["size"] == 1
+
+
+def test_permitted_ids_memoized_per_user_type_until_a_write():
+    loads = []
+
+    def load() -> set[int]:
+        loads.append(1)
+        return {1, 2}
+
+    def secop(sim_perm: int) -> auth.SecOp:
+        return auth.CustomersOperations(
+            auth_overrides.DeveloperToken(sim_perm), SCACustomer
+        )
+
+    CACHE.invalidate(auth.PERMITTED_IDS)
+    request = secop(12)
+    assert request.memoized_ids("test", load) == frozenset({1, 2})
+    assert request.memoized_ids("test", load) == frozenset({1, 2})
+    assert secop(12).memoized_ids("test", load) == frozenset({1, 2})
+    assert len(loads) == 1
+
+    secop(10).memoized_ids("test", load)
+    assert len(loads) == 2, "simulated permissions are cached separately"
+
+    CACHE.invalidate(auth.PERMITTED_IDS)
+    secop(12).memoized_ids("test", load)
+    assert len(loads) == 3
@@ -1,5 +1,11 @@
 """test endpoints for returning formatted pricing and executing price updates"""
 
+import os
+import asyncio
+import pytest
+from time import perf_counter
+from uuid import UUID
+from functools import partial
 from fastapi.testclient import TestClient
 from httpx import Response
 from datetime import datetime, timedelta
@@ -7,7 +13,17 @@ from datetime import datetime, timedelta
 from app.main import app
 from app.auth import authenticate_auth0_token
 from tests import auth_overrides
-from app.db import DB_V2
+from app.db import DB_V2, DB_V2_ASYNC
+from app.admin.models import Pricing, VendorId
+from app.v2.pricing import (
+    transform,
+    resolve_prices_as_of,
+    fetch_pricing_rows,
+    fetch_pricing_rows_async,
+    EXPORT_CHUNK_ROWS,
+)
+import app.downloads as downloads
+from app.downloads import DownloadIDs, DetachedSession, NonExistant
 
 test_client = TestClient(app)
 
@@ -183,3 +199,180 @@ def test_customer_pricing_class_update_alters_pricing_labels():
     expected = {e[0]: e[1] for e in expected}
     for price in altered_pricing:
         assert expected[price["id"]] == price["pricing_class_id"]
+
+
+def test_combined_pricing_json_drops_overridden_class_pricing():
+    app.dependency_overrides[authenticate_auth0_token] = auth_overrides.AdminToken
+    path = f"/v2/vendors/{TEST_VENDOR}/vendor-customers/{TEST_CUSTOMER_ID}/pricing"
+    resp: Response = test_client.get(path)
+    assert resp.status_code == 200, resp.text
+    pricing = resp.json()["pricing"]["data"]
+    overridden = {p["product"]["id"] for p in pricing if p.get("override")}
+    class_pricing = [p for p in pricing if "notes" not in p]
+    assert class_pricing
+    assert not any(p["product"]["id"] in overridden for p in class_pricing)
+
+    # the validated path, resolving prices as of today, returns the same records
+    resp: Response = test_client.get(path, params={"effective_date": str(TODAY.date())})
+    assert resp.status_code == 200, resp.text
+    validated = resp.json()["pricing"]["data"]
+    assert {p["id"] for p in validated} <= {p["id"] for p in pricing}
+    app.dependency_overrides[authenticate_auth0_token] = {}
+
+
+def test_pricing_export_streams_in_chunks():
+    prices = [
+        {
+            "id": i,
+            "category": {"id": 1, "name": "STANDARD"},
+            "product": {
+                "id": i,
+                "part_id": f"PART-{i:05d}",
+                "description": "",
+                "categories": [{"id": 1, "name": "Category", "rank": 1}],
+                "attrs": [
+                    {"id": 1, "attr": "upc_code", "type": "STRING", "value": "0"}
+                ],
+            },
+            "price": 1000 + i,
+            "effective_date": YESTERDAY,
+            "history": [],
+        }
+        for i in range(EXPORT_CHUNK_ROWS * 2 + 5)
+    ]
+    customer = {"data": {"attributes": {"name": "Test Customer"}}}
+    resp = transform(
+        customer, VendorId.ATCO, Pricing(data=prices), remove_cols=["upc_code"]
+    )
+
+    async def read_chunks() -> list[bytes]:
+        return [chunk async for chunk in resp.body_iterator]
+
+    chunks = asyncio.run(read_chunks())
+    assert len(chunks) == 3
+    lines = b"".join(chunks).decode().splitlines()
+    assert lines[0] == (
+        "Part Id,Description,Price Category,Category 1,Effective Date,Price,Notes"
+    )
+    assert len(lines) == len(prices) + 1
+    assert lines[1].startswith("PART-00000,,STANDARD,Category,")
+    assert lines[1].endswith(",10.0,")
+
+
+def test_resolve_prices_as_of():
+    last_year = TODAY - timedelta(days=365)
+    two_years_ago = TODAY - timedelta(days=730)
+
+    history = [
+        {"id": 1, "price": 100, "effective_date": two_years_ago, "timestamp": TODAY},
+        {"id": 2, "price": 200, "effective_date": last_year, "timestamp": TODAY},
+    ]
+
+    def price_record(id_: int, **kwargs) -> dict:
+        record = {"id": id_, "price": 200, "effective_date": last_year}
+        return record | {"history": history} | kwargs
+
+    prices = [
+        price_record(1),
+        price_record(2, future={"price": 300, "effective_date": FUTURE_DATE}),
+        price_record(3, price=400, effective_date=FUTURE_DATE, history=[]),
+    ]
+
+    def as_of(date: datetime | None) -> dict[int, int]:
+        return {r["id"]: r["price"] for r in resolve_prices_as_of(prices, date)}
+
+    assert as_of(None) == {1: 200, 2: 200}
+    assert as_of(FUTURE_DATE) == {1: 200, 2: 300, 3: 400}
+    assert as_of(last_year) == {1: 200, 2: 200}
+    assert as_of(YESTERDAY - timedelta(days=500)) == {1: 100, 2: 100}
+    assert as_of(two_years_ago - timedelta(days=1)) == {}
+    assert prices[1]["price"] == 200, "input records shouldn't be modified"
+
+
+def test_download_links_are_bounded_and_expire(monkeypatch, tmp_path):
+    monkeypatch.setattr(downloads, "DL_LINK_MAX_ACTIVE", 2)
+    monkeypatch.setattr(DownloadIDs, "active_requests", dict())
+    monkeypatch.setattr(DownloadIDs, "expiry_heap", [])
+    monkeypatch.setattr(DownloadIDs, "shared_dir", None)
+
+    session = next(DB_V2.get_db())
+    try:
+        first = DownloadIDs.add_request("pricing", callback=partial(len, session))
+    finally:
+        session.close()
+    stored = DownloadIDs.active_requests[hash(UUID(first))]
+    assert isinstance(stored.callback.args[0], DetachedSession)
+
+    second = DownloadIDs.add_request("pricing")
+    third = DownloadIDs.add_request("pricing")
+    assert len(DownloadIDs.active_requests) == 2
+    assert stored.callback is None, "evicted links should release their payload"
+    with pytest.raises(NonExistant):
+        DownloadIDs.use_download("pricing", first)
+    assert DownloadIDs.use_download("pricing", second)
+
+    monkeypatch.setattr(downloads, "DL_LINK_DURATION", timedelta(minutes=-1))
+    DownloadIDs.add_request("pricing")
+    monkeypatch.setattr(downloads, "DL_LINK_DURATION", timedelta(minutes=5))
+    assert DownloadIDs.sweep() == 1
+    assert list(DownloadIDs.active_requests) == [hash(UUID(third))]
+    assert DownloadIDs.use_download("pricing", third)
+
+    # a link written to the shared directory can be redeemed by any worker
+    monkeypatch.setattr(DownloadIDs, "shared_dir", tmp_path)
+    shared = DownloadIDs.add_request("pricing", callback=partial(str, "ok"))
+    assert not DownloadIDs.active_requests
+    assert DownloadIDs.stats()["active"] == 1
+    assert DownloadIDs.use_download("pricing", shared).callback() == "ok"
+    with pytest.raises(NonExistant):
+        DownloadIDs.use_download("pricing", shared)
+
+    expiring = DownloadIDs.add_request("pricing", s3_path="logo.png")
+    os.utime(tmp_path / f"{expiring}.pkl", (0, 0))
+    assert DownloadIDs.sweep() == 1
+    with pytest.raises(NonExistant):
+        DownloadIDs.use_download("pricing", expiring)
+
+
+def test_async_pricing_rows_match_sync_rows():
+    async def fetch_async() -> list[dict]:
+        async with DB_V2_ASYNC.sessionmaker() as session:
+            return await fetch_pricing_rows_async(
+                session, VendorId.TEST, TEST_CUSTOMER_ID, mode="both"
+            )
+
+    session = next(DB_V2.get_db())
+    sync_rows = fetch_pricing_rows(session, VendorId.TEST, TEST_CUSTOMER_ID, "both")
+    async_rows = asyncio.run(fetch_async())
+    assert async_rows == sync_rows
+
+
+@pytest.mark.skipif(
+    not os.getenv("RUN_BENCHMARKS"), reason="set RUN_BENCHMARKS to time concurrency"
+)
+def test_async_queries_run_concurrently():
+    """N overlapping slow queries, issued from coroutines on one event loop,
+    take about as long as one on the async path and N times as long on the sync
+    path, which blocks the loop for the length of each query"""
+    concurrency, sql = 10, "SELECT pg_sleep(0.2)"
+
+    async def sync_path() -> None:
+        session = next(DB_V2.get_db())
+        try:
+            DB_V2.execute(session, sql)
+        finally:
+            session.close()
+
+    async def async_path() -> None:
+        async with DB_V2_ASYNC.sessionmaker() as session:
+            await DB_V2_ASYNC.execute(session, sql)
+
+    async def timed(path) -> float:
+        start = perf_counter()
+        await asyncio.gather(*(path() for _ in range(concurrency)))
+        return perf_counter() - start
+
+    blocking = asyncio.run(timed(sync_path))
+    concurrent = asyncio.run(timed(async_path))
+    print(f"{concurrency} queries: sync {blocking:.2f}s, async {concurrent:.2f}s")
+    assert concurrent < blocking / 2
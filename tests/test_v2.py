@@ -1,19 +1,39 @@
 from fastapi.testclient import TestClient
-from pytest import mark, fixture
+from pytest import mark, fixture, raises
 from random import random
 from pprint import pformat
 from httpx import Response
 from pathlib import Path
-from typing import Union, Optional
+from typing import Union, Optional, Any, Annotated, get_args, get_origin
+from types import UnionType
+from enum import Enum
+import orjson
+from pydantic import BaseModel
 from dataclasses import dataclass, asdict, replace
 from enum import StrEnum
 from itertools import chain
 from datetime import datetime, timedelta
+import os
+from time import perf_counter
+from sqlalchemy import event, text
+from sqlalchemy.dialects import postgresql
 
 from app.main import app
+from app.db import DB_V2
 from app.auth import authenticate_auth0_token
 from tests import auth_overrides
 from app.jsonapi.sqla_models import *
+from app.jsonapi import responses
+from app.jsonapi.render_plans import render_plan
+from app.jsonapi.sqla_jsonapi_ext import cursor_page_size, MAX_PAGE_SIZE
+from fastapi import HTTPException
+from app.v2.models import VendorCustomerCollectionResp
+from app.jsonapi.filtering import (
+    FilterStrategy,
+    filter_clause,
+    index_ddl,
+    strategy_for,
+)
 
 test_client = TestClient(app)
 
@@ -1046,3 +1066,512 @@ def test_deep_filtering_within_includes(filter_arg: str, item_count: int):
     assert (
         equal_counts
     ), f"{msg(the_count,item_count)} products returned. {the_count} vs. {item_count}"
+
+
+def test_collection_includes_cost_a_fixed_number_of_queries():
+    """includes are eager loaded, so the number of queries for a page doesn't grow
+    with the number of resources on it"""
+    app.dependency_overrides[authenticate_auth0_token] = auth_overrides.AdminToken
+    route = (
+        str(TEST_VENDOR / "vendor-customers")
+        + "?include=vendor-pricing-by-customer.vendor-products,vendors"
+    )
+    statements = []
+
+    def count(conn, cursor, statement, *args) -> None:
+        statements.append(statement)
+
+    query_counts = []
+    event.listen(DB_V2._ENGINE, "before_cursor_execute", count)
+    try:
+        for page_size in (1, 10):
+            statements.clear()
+            resp = test_client.get(route + f"&page_size={page_size}")
+            assert resp.status_code == 200, resp.text
+            query_counts.append(len(statements))
+    finally:
+        event.remove(DB_V2._ENGINE, "before_cursor_execute", count)
+    assert query_counts[0] == query_counts[1], query_counts
+
+
+def test_cursor_pagination_walks_the_whole_collection():
+    app.dependency_overrides[authenticate_auth0_token] = auth_overrides.AdminToken
+    route = str(TEST_VENDOR / "vendor-customers")
+    resp = test_client.get(route + "?page_number=0&sort=-name")
+    assert resp.status_code == 200, resp.text
+    expected = [customer["id"] for customer in resp.json()["data"]]
+
+    walked = []
+    link = route + "?sort=-name&page_size=3&page_after=&page_count=exact"
+    while link:
+        resp = test_client.get(link)
+        assert resp.status_code == 200, resp.text
+        body = resp.json()
+        assert body["meta"]["totalRecords"] == len(expected)
+        walked.extend(customer["id"] for customer in body["data"])
+        next_link = body["links"].get("next")
+        link = (
+            route + next_link[next_link.index("?") :] + "&sort=-name"
+            if next_link
+            else None
+        )
+    assert len(walked) == len(set(walked))
+    assert sorted(walked) == sorted(expected)
+
+
+@mark.parametrize("size", ["abc", "1.5", "[3]"])
+def test_cursor_pagination_rejects_bad_page_sizes(size: str):
+    session = next(DB_V2.get_db())
+    query = {"page[after]": "", "page[size]": size}
+    try:
+        with raises(HTTPException) as e:
+            serializer.get_collection(session, query, "vendors")
+    finally:
+        session.close()
+    assert e.value.status_code == 400
+    assert cursor_page_size("0") == 1
+    assert cursor_page_size(None) == cursor_page_size("9999") == MAX_PAGE_SIZE
+
+
+def _compiled(clause) -> str:
+    return str(
+        clause.compile(
+            dialect=postgresql.dialect(paramstyle="named"),
+            compile_kwargs={"literal_binds": True},
+        )
+    )
+
+
+@mark.parametrize(
+    "model,field",
+    [
+        (VendorProduct, "vendor_product_identifier"),
+        (VendorProductAttr, "attr"),
+        (VendorQuote, "vendor_quote_number"),
+    ],
+)
+def test_text_filters_still_match_substrings(model, field: str):
+    """declaring strategies mustn't narrow what an existing filter matches"""
+    assert strategy_for(model, field) == "trigram"
+    column = getattr(model, field)
+    clause = _compiled(filter_clause(column, strategy_for(model, field), ["A1"]))
+    assert "ILIKE '%A1%'" in clause
+
+
+def test_filter_strategies_compile_to_indexable_clauses():
+    assert strategy_for(VendorProduct, "vendor_id") == "exact"
+    assert strategy_for(VendorCustomer, "name") == "trigram"
+    # undeclared fields fall back on their column type
+    assert strategy_for(Vendor, "name") == "trigram"
+    assert strategy_for(VendorProductClass, "rank") == "exact"
+
+    column = VendorProduct.vendor_product_identifier
+    exact = _compiled(filter_clause(column, FilterStrategy.EXACT, ["A1", "B2"]))
+    assert "IN ('A1', 'B2')" in exact
+    prefix = filter_clause(column, FilterStrategy.PREFIX, ["50%_off"]).compile()
+    # wildcards in the value are matched literally
+    assert list(prefix.params.values()) == ["50\\%\\_off%"]
+    trigram = _compiled(filter_clause(column, FilterStrategy.TRIGRAM, ["coil"]))
+    assert "ILIKE '%coil%'" in trigram and "% 'coil'" in trigram
+    fulltext = filter_clause(column, FilterStrategy.FULLTEXT, ["coil"]).compile(
+        dialect=postgresql.dialect()
+    )
+    assert "@@ plainto_tsquery(" in str(fulltext)
+    assert "coil" in fulltext.params.values()
+
+    ddl = index_ddl([VendorProduct, VendorProductClass])
+    assert ddl[0] == "CREATE EXTENSION IF NOT EXISTS pg_trgm;"
+    assert any(
+        "ix_vendor_products_vendor_product_description_trgm" in stmt
+        and "gin_trgm_ops" in stmt
+        for stmt in ddl
+    )
+    # nothing for exact matches or models without declared strategies
+    assert not any(
+        "vendor_id" in stmt or "vendor_product_classes" in stmt for stmt in ddl
+    )
+
+
+@mark.skipif(
+    not os.getenv("RUN_BENCHMARKS"), reason="set RUN_BENCHMARKS to time filters"
+)
+def test_trigram_index_speeds_up_substring_filters():
+    session = next(DB_V2.get_db())
+    try:
+        session.execute(
+            text(
+                "CREATE TEMP TABLE filter_bench "
+                "(id serial PRIMARY KEY, description varchar)"
+            )
+        )
+        session.execute(
+            text(
+                "INSERT INTO filter_bench (description) "
+                "SELECT md5(i::text) || ' coil ' || md5((i * 7)::text) "
+                "FROM generate_series(1, 200000) AS i"
+            )
+        )
+        session.execute(text("ANALYZE filter_bench"))
+        query = text(
+            "SELECT count(*) FROM filter_bench WHERE description ILIKE :pattern"
+        )
+
+        def timed() -> float:
+            start = perf_counter()
+            session.execute(query, dict(pattern="%abc12%")).scalar_one()
+            return perf_counter() - start
+
+        unindexed = min(timed() for _ in range(3))
+        session.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        session.execute(
+            text("CREATE INDEX ON filter_bench USING gin (description gin_trgm_ops)")
+        )
+        session.execute(text("ANALYZE filter_bench"))
+        indexed = min(timed() for _ in range(3))
+        print(f"ILIKE unindexed {unindexed*1000:.1f}ms, indexed {indexed*1000:.1f}ms")
+        assert indexed < unindexed
+    finally:
+        session.rollback()
+        session.close()
+
+
+def _transient_customers(n: int) -> list[VendorCustomer]:
+    vendor = Vendor(id="adp", name="ADP")
+    return [
+        VendorCustomer(
+            id=i,
+            name=f"Customer {i}",
+            vendors=vendor,
+            vendor_customer_attrs=[
+                VendorCustomerAttr(id=i * 10 + j, attr=f"attr_{j}", value=str(j))
+                for j in range(3)
+            ],
+        )
+        for i in range(n)
+    ]
+
+
+def test_render_plans_are_compiled_once_per_shape():
+    include = {"vendors": [], "vendor-customer-attrs": []}
+    fields = {"vendor-customers": ["name", "vendors", "vendor-customer-attrs"]}
+    render_plan.cache_clear()
+    first, second = (
+        serializer._render_full_resource(customer, include, fields, {}, {})[0]
+        for customer in _transient_customers(2)
+    )
+    # one plan each for customers, vendors and attrs, reused by the second row
+    assert render_plan.cache_info().misses == 3
+    assert first["attributes"] == {"name": "Customer 0"}
+    assert set(first["relationships"]) == {"vendors", "vendor-customer-attrs"}
+    assert first["relationships"]["vendors"]["data"] == {"type": "vendors", "id": "adp"}
+    assert len(second["included"]) == 4
+    assert second["included"][("vendor-customer-attrs", 11)]["attributes"] == {
+        "attr": "attr_1",
+        "deleted-at": None,
+        "type": None,
+        "value": "1",
+    }
+
+
+@mark.skipif(
+    not os.getenv("RUN_BENCHMARKS"), reason="set RUN_BENCHMARKS to time rendering"
+)
+def test_render_plan_throughput():
+    customers = _transient_customers(300)
+    include = {"vendors": [], "vendor-customer-attrs": []}
+
+    def rows_per_sec(recompile: bool) -> float:
+        start = perf_counter()
+        for customer in customers:
+            if recompile:
+                render_plan.cache_clear()
+            serializer._render_full_resource(customer, include, {}, {}, {})
+        return len(customers) / (perf_counter() - start)
+
+    uncached = min(rows_per_sec(recompile=True) for _ in range(5))
+    cached = min(rows_per_sec(recompile=False) for _ in range(5))
+    print(f"render: {uncached:.0f} rows/s recompiled, {cached:.0f} rows/s planned")
+    assert cached > uncached
+
+
+TRUSTED_COLLECTIONS = [
+    str(TEST_VENDOR / "vendor-products") + "?include=vendor-product-attrs",
+    str(TEST_VENDOR / "vendor-customers") + "?include=vendor-pricing-by-customer",
+    str(TEST_VENDOR / "vendor-pricing-classes"),
+]
+
+
+@mark.parametrize("route", TRUSTED_COLLECTIONS)
+def test_trusted_responses_match_validated_ones(monkeypatch, route: str):
+    app.dependency_overrides[authenticate_auth0_token] = auth_overrides.AdminToken
+    validated = test_client.get(route)
+    assert validated.status_code == 200, validated.text
+    monkeypatch.setattr(responses, "VALIDATION_SAMPLE_RATE", 0)
+    trusted = test_client.get(route)
+    assert trusted.status_code == 200, trusted.text
+    assert trusted.json() == validated.json()
+
+
+TRUSTED_MODELS = {
+    route.endpoint.__name__: route.response_model
+    for route in app.routes
+    if getattr(route, "endpoint", None)
+    and route.endpoint.__code__.co_filename == responses.__file__
+}
+
+
+def _sample(annotation: Any, metadata: list = ()) -> Any:
+    """a payload the serializer could produce for `annotation`, with keys the
+    model doesn't declare, missing optional fields and nulls mixed in"""
+    while get_origin(annotation) is Annotated:
+        annotation, *extra = get_args(annotation)
+        metadata = [*metadata, *extra]
+    origin = get_origin(annotation)
+    if origin in (Union, UnionType):
+        options = [arg for arg in get_args(annotation) if arg is not type(None)]
+        return _sample(options[0], metadata)
+    if origin is list or annotation is list:
+        item = get_args(annotation)[0] if get_args(annotation) else dict
+        return [_sample(item), _sample(item)]
+    if origin is dict or annotation in (dict, Any):
+        return {"kept": None, "nested": {"also-kept": None}}
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        payload = {"not-in-the-model": {"data": []}}
+        for i, (name, info) in enumerate(annotation.model_fields.items()):
+            if not info.is_required() and i % 3 == 1:
+                continue
+            value = None
+            if info.is_required() or i % 3 == 0:
+                value = _sample(info.annotation, info.metadata)
+            payload[info.alias or name] = value
+        return payload
+    if isinstance(annotation, type) and issubclass(annotation, Enum):
+        return next(iter(annotation)).value
+    if annotation is bool:
+        return True
+    if annotation is int:
+        bounds = [m.ge for m in metadata if getattr(m, "ge", None) is not None]
+        bounds += [
+            b.ge
+            for m in metadata
+            for b in getattr(m, "metadata", ())
+            if hasattr(b, "ge")
+        ]
+        return bounds[0] if bounds else 7
+    if annotation is float:
+        return 1.5
+    if annotation is datetime:
+        return "2026-01-01T00:00:00"
+    return "text"
+
+
+def _assert_trusted_matches_validated(model: type[BaseModel], payload: Any) -> None:
+    validated = model.model_validate(payload).model_dump(
+        mode="json", by_alias=True, exclude_none=True
+    )
+    fitted = responses.fit(payload, responses.layout(model))
+    assert responses.TrustedJSONAPIResponse(fitted).body == orjson.dumps(validated)
+
+
+@mark.parametrize("endpoint", TRUSTED_MODELS)
+def test_trusted_payloads_fit_their_response_models(endpoint: str):
+    """the trusted path has to produce what validating against the route's
+    response model would, key for key and in the same order"""
+    model = TRUSTED_MODELS[endpoint]
+    assert responses.layout(model) is not None
+    _assert_trusted_matches_validated(model, _sample(model))
+
+
+def test_trusted_serializer_output_fits_its_response_model():
+    """relationships the response model doesn't declare are left out"""
+    customers = _transient_customers(2)
+    data = [serializer._render_full_resource(c, {}, {}, {}, {})[0] for c in customers]
+    for resource in data:
+        resource.pop("included")
+    assert "vendor-product-discounts" in data[0]["relationships"]
+    payload = {"data": data, "included": [], "jsonapi": {"version": "1.0"}, "meta": {}}
+    _assert_trusted_matches_validated(VendorCustomerCollectionResp, payload)
+
+
+@mark.skipif(
+    not os.getenv("RUN_BENCHMARKS"), reason="set RUN_BENCHMARKS to time responses"
+)
+@mark.parametrize("route", TRUSTED_COLLECTIONS)
+def test_trusted_response_latency(monkeypatch, route: str):
+    app.dependency_overrides[authenticate_auth0_token] = auth_overrides.AdminToken
+
+    def percentiles(runs: int = 50) -> tuple[float, float]:
+        timings = []
+        for _ in range(runs):
+            start = perf_counter()
+            assert test_client.get(route).status_code == 200
+            timings.append(perf_counter() - start)
+        timings.sort()
+        return timings[runs // 2], timings[int(runs * 0.99)]
+
+    validated = percentiles()
+    monkeypatch.setattr(responses, "VALIDATION_SAMPLE_RATE", 0)
+    trusted = percentiles()
+    print(
+        f"{route}: validated p50 {validated[0]*1000:.1f}ms p99 {validated[1]*1000:.1f}ms"
+        f", trusted p50 {trusted[0]*1000:.1f}ms p99 {trusted[1]*1000:.1f}ms"
+    )
+    assert trusted[0] < validated[0]
+
+
+@mark.parametrize(
+    "perm,response_code",
+    [
+        (auth_overrides.AdminToken, 200),
+        (auth_overrides.SCAEmployeeToken, 401),
+        (auth_overrides.CustomerAdminToken, 401),
+    ],
+)
+def test_admin_metrics_report_pool_usage(perm: auth_overrides.Token, response_code):
+    app.dependency_overrides[authenticate_auth0_token] = auth_overrides.AdminToken
+    assert test_client.get(str(TEST_VENDOR / "vendor-customers")).status_code == 200
+    app.dependency_overrides[authenticate_auth0_token] = perm
+    resp = test_client.get("/admin/metrics")
+    assert resp.status_code == response_code, resp.text
+    if response_code == 200:
+        pool = resp.json()["db_pool"]
+        assert pool["checkouts"] >= 1
+        assert pool["checkouts"] == pool["checkins"] + pool["in_use"]
+        assert "checkout_wait_max_ms" in pool
+
+
+def test_queries_are_timed_by_name_and_tallied_per_request():
+    from app.db import perf
+    from app.db.sql import queries
+
+    perf.QUERIES.clear()
+    with perf.request_scope() as tally:
+        perf.record_query(queries.pricing_both_json, 0.2, 10)
+        perf.record_query(queries.pricing_both_json, 0.4, 12)
+        perf.record_query("SELECT 1", 0.01, 1)
+    assert (tally.queries, tally.rows) == (3, 23)
+    assert perf.CURRENT_REQUEST.get() is None
+
+    by_total = perf.QUERIES.top(by="total")
+    assert by_total[0]["name"] == "pricing_both_json"
+    assert by_total[0]["count"] == 2 and by_total[0]["rows"] == 22
+    assert by_total[1]["name"].startswith("adhoc:")
+
+    app.dependency_overrides[authenticate_auth0_token] = auth_overrides.AdminToken
+    resp = test_client.get("/admin/perf", params=dict(sort="p95", limit=1))
+    assert resp.status_code == 200, resp.text
+    assert [q["name"] for q in resp.json()["queries"]] == ["pricing_both_json"]
+
+
+def test_failed_queries_are_timed_too():
+    """a statement that fails, such as one cancelled by the statement timeout,
+    is still timed, with no row count"""
+    import asyncio
+    from sqlalchemy.exc import OperationalError
+    from app.db import perf, DB_V2_ASYNC
+
+    timeout = OperationalError("SELECT", {}, Exception("statement timeout"))
+
+    class TimedOut:
+        def execute(self, *args, **kwargs):
+            raise timeout
+
+    class AsyncTimedOut:
+        async def execute(self, *args, **kwargs):
+            raise timeout
+
+    perf.QUERIES.clear()
+    with perf.request_scope() as tally:
+        with raises(OperationalError):
+            DB_V2.execute(TimedOut(), "SELECT pg_sleep(10)")
+        with raises(OperationalError):
+            asyncio.run(DB_V2_ASYNC.execute(AsyncTimedOut(), "SELECT pg_sleep(10)"))
+    assert (tally.queries, tally.rows) == (2, 0)
+    assert perf.QUERIES.top(by="total")[0]["count"] == 2
+
+
+def test_sql_registry_loads_queries_lazily(tmp_path: Path):
+    import pickle
+    from app.db.sql import Queries, SQL, build_stub
+
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "nested" / "by_id.sql").write_text("SELECT * FROM t WHERE id = :id")
+    registry = Queries(str(tmp_path))
+    assert not registry._loaded
+
+    query = registry.by_id
+    assert isinstance(query, SQL) and query.name == "by_id"
+    assert query == "SELECT * FROM t WHERE id = :id"
+    assert registry.by_id is query
+    assert query.clause is query.clause
+    assert list(query.clause.compile().params) == ["id"]
+    assert pickle.loads(pickle.dumps(query)).name == "by_id"
+    with raises(AttributeError):
+        registry.missing
+    assert dir(registry) == ["by_id"]
+
+    stub = tmp_path / "__init__.pyi"
+    build_stub(str(stub))
+    assert "    pricing_both_json: SQL\n" in stub.read_text()
+
+
+def test_startup_defers_heavy_clients():
+    from app.startup import parse_importtime, by_group, report, profile_imports
+
+    imported = {timing.module for timing in profile_imports()}
+    assert "app.v2.models" in imported
+    assert not imported & {"boto3", "pypdf"}
+
+    output = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       150 |        150 |     pandas.core\n"
+        "import time:       600 |        750 |   pandas\n"
+        "import time:      1000 |       1000 |     app.v2.models\n"
+        "import time:       250 |       2000 | app.main\n"
+    )
+    timings = parse_importtime(output)
+    assert [(t.module, t.self_us, t.depth) for t in timings] == [
+        ("pandas.core", 150, 2),
+        ("pandas", 600, 1),
+        ("app.v2.models", 1000, 2),
+        ("app.main", 250, 0),
+    ]
+    assert by_group(timings) == [
+        ("app.v2", 1000, 1),
+        ("pandas", 750, 2),
+        ("app.main", 250, 1),
+    ]
+    assert report(timings).startswith("4 modules imported in 2ms")
+
+
+def test_tarpit_route_index_agrees_with_a_linear_scan():
+    import re
+    from starlette.routing import Match
+    from app.tarpit import RouteIndex
+
+    def linear_scan(scope: dict):
+        for route in app.routes:
+            if route.matches(scope)[0] == Match.FULL:
+                return route
+
+    index = RouteIndex(app.router.routes)
+    paths = ["/", "/favicon.ico", "/wp-admin", "/.env", "/v2//vendors"]
+    for route in app.routes:
+        path = re.sub(r"\{[^}]+\}", "1", route.path)
+        paths += [path, path + "/", path + "/extra"]
+    for path in paths:
+        for method in ("GET", "POST", "PATCH", "DELETE"):
+            scope = {"type": "http", "method": method, "path": path}
+            assert index.match(scope) is linear_scan(scope), scope
+
+
+def test_requests_are_timed_by_route_template():
+    from app.db import perf
+
+    perf.REQUESTS.clear()
+    before = perf.STATUSES["2xx"]
+    for _ in range(2):
+        assert test_client.get("/v2").status_code == 200
+    timings = perf.REQUESTS.timings["GET /v2"]
+    assert timings.count == 2
+    assert perf.STATUSES["2xx"] == before + 2